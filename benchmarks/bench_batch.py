@@ -0,0 +1,70 @@
+"""Time to load and validate many files one by one and with load_many and
+validate_many.
+"""
+
+import os
+import shutil
+import tempfile
+
+from utils import bench, generate_dtd, generate_xml, report
+
+from xmltool import batch, dtd, factory
+
+SECTIONS = 10
+FILES = 50
+
+
+def load_loop(filenames):
+    for filename in filenames:
+        factory.load(filename)
+
+
+def load_many(filenames, workers):
+    for result in batch.load_many(filenames, workers=workers):
+        assert result.ok, result.error
+
+
+def validate_many(filenames, workers, processes=False):
+    for result in batch.validate_many(filenames, workers=workers, processes=processes):
+        assert result.ok, result.error
+
+
+def main():
+    directory = tempfile.mkdtemp()
+    try:
+        with open(os.path.join(directory, "bench.dtd"), "w") as f:
+            f.write(generate_dtd(SECTIONS * 4))
+        xml = generate_xml(1000, sections=SECTIONS).replace(
+            b"<document>", b'<!DOCTYPE document SYSTEM "bench.dtd">\n<document>'
+        )
+        filenames = []
+        for i in range(FILES):
+            filename = os.path.join(directory, "bench%s.xml" % i)
+            with open(filename, "wb") as f:
+                f.write(xml)
+            filenames += [filename]
+
+        loop = bench(lambda: load_loop(filenames), number=1)
+        rows = [("load", "loop", 1, loop, "1.00x")]
+        for workers in [2, 4]:
+            t = bench(lambda: load_many(filenames, workers), number=1)
+            rows += [("load", "threads", workers, t, "%.2fx" % (loop / t))]
+        dtd.clear_validators()
+        loop = bench(lambda: validate_many(filenames, 1), number=1)
+        rows += [("validate", "1 thread", 1, loop, "1.00x")]
+        for workers in [2, 4]:
+            t = bench(lambda: validate_many(filenames, workers), number=1)
+            rows += [("validate", "threads", workers, t, "%.2fx" % (loop / t))]
+            t = bench(lambda: validate_many(filenames, workers, True), number=1)
+            rows += [("validate", "processes", workers, t, "%.2fx" % (loop / t))]
+        report(
+            "Load and validate %s files of 1000 items (s)" % FILES,
+            rows,
+            ["work", "mode", "workers", "time", "speedup"],
+        )
+    finally:
+        shutil.rmtree(directory)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,68 @@
+"""Time to load a document when the CDATA sections are found by an expat
+pass over the source and when each text element is serialized to find them
+(the previous behaviour).
+"""
+
+import os
+import shutil
+import tempfile
+
+from utils import bench, generate_dtd, generate_xml, report
+
+from xmltool import factory
+
+SECTIONS = 10
+ROUNDS = 20
+
+get_cdata_elements = factory._get_cdata_elements
+
+
+def serialize(source, root):
+    return None
+
+
+def main():
+    directory = tempfile.mkdtemp()
+    try:
+        with open(os.path.join(directory, "bench.dtd"), "w") as f:
+            f.write(generate_dtd(SECTIONS * 4))
+        rows = []
+        for size in [1000, 10000]:
+            xml = generate_xml(size, sections=SECTIONS)
+            xml = xml.replace(
+                b"<document>",
+                b'<!DOCTYPE document SYSTEM "bench.dtd">\n<document>',
+            )
+            cdata_xml = xml.replace(b">value ", b"><![CDATA[<b>value</b> ")
+            cdata_xml = cdata_xml.replace(b"</item", b"]]></item")
+            for name, content in [("no cdata", xml), ("cdata", cdata_xml)]:
+                filename = os.path.join(directory, "bench%s.xml" % size)
+                with open(filename, "wb") as f:
+                    f.write(content)
+                number = max(1, 10000 // size)
+
+                def load():
+                    return factory.load(filename, validate=False)
+
+                expat = serialized = float("inf")
+                for i in range(ROUNDS):
+                    expat = min(expat, bench(load, number, 1))
+                    factory._get_cdata_elements = serialize
+                    try:
+                        serialized = min(serialized, bench(load, number, 1))
+                    finally:
+                        factory._get_cdata_elements = get_cdata_elements
+                rows += [
+                    (size, name, serialized, expat, "%.2fx" % (serialized / expat))
+                ]
+        report(
+            "Load a document (s)",
+            rows,
+            ["items", "content", "serialized", "expat", "speedup"],
+        )
+    finally:
+        shutil.rmtree(directory)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,64 @@
+"""Time to copy a loaded document with clone, copy.deepcopy and a to_xml +
+load_from_xml round trip.
+"""
+
+import copy
+import os
+import shutil
+import tempfile
+
+from utils import bench, generate_dtd, generate_xml, report
+
+from xmltool import factory
+
+SECTIONS = 10
+
+
+def round_trip(obj):
+    new = obj.__class__()
+    new.load_from_xml(obj.to_xml())
+    return new
+
+
+def main():
+    directory = tempfile.mkdtemp()
+    try:
+        with open(os.path.join(directory, "bench.dtd"), "w") as f:
+            f.write(generate_dtd(SECTIONS * 4))
+        rows = []
+        for size in [100, 1000, 10000]:
+            filename = os.path.join(directory, "bench%s.xml" % size)
+            xml = generate_xml(size, sections=SECTIONS)
+            xml = xml.replace(
+                b"<document>",
+                b'<!DOCTYPE document SYSTEM "bench.dtd">\n<document>',
+            )
+            with open(filename, "wb") as f:
+                f.write(xml)
+            obj = factory.load(filename)
+            assert str(obj.clone()) == str(obj)
+            number = max(1, 1000 // size)
+            clone = bench(obj.clone, number=number)
+            deepcopy = bench(lambda: copy.deepcopy(obj), number=number)
+            reload = bench(lambda: round_trip(obj), number=number)
+            rows += [
+                (
+                    size,
+                    clone,
+                    deepcopy,
+                    reload,
+                    "%.2fx" % (deepcopy / clone),
+                    "%.2fx" % (reload / clone),
+                )
+            ]
+        report(
+            "Copy a loaded document of %s sections (s)" % SECTIONS,
+            rows,
+            ["items", "clone", "deepcopy", "round trip", "vs deepcopy", "vs trip"],
+        )
+    finally:
+        shutil.rmtree(directory)
+
+
+if __name__ == "__main__":
+    main()
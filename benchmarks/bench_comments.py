@@ -0,0 +1,97 @@
+"""Time to load a commented document when the parents read the comments of
+their children in one pass and when each element looks at its siblings and
+the text elements remove their comments from the text (the previous
+behaviour).
+"""
+
+import os
+import shutil
+import tempfile
+
+from lxml import etree
+from utils import bench, generate_dtd, generate_xml, report
+
+from xmltool import elements, factory
+
+SECTIONS = 10
+ROUNDS = 5
+
+iter_children_xml = elements._iter_children_xml
+text_load_from_xml = elements.TextElement.load_from_xml
+
+
+def old_iter_children_xml(xml):
+    for child in xml:
+        if not isinstance(child, etree._Comment):
+            yield child, None
+
+
+def old_text_load_from_xml(self, xml, comments=None):
+    self.set_lxml_elt(xml)
+    self._load_extra_from_xml(xml)
+    self.text = ""
+    comments = [e.text for e in xml if isinstance(e, etree._Comment)]
+    self.comment = "\n".join(comments)
+    for s in xml.itertext():
+        if s in comments:
+            comments.remove(s)
+            continue
+        self.text += s
+
+
+def add_comments(xml, comments):
+    block = b"<!-- comment -->" * comments
+    xml = xml.replace(b"    <item", block + b"<item")
+    return xml.replace(b"</item", block + b"text" + block + b"</item")
+
+
+def main():
+    directory = tempfile.mkdtemp()
+    try:
+        with open(os.path.join(directory, "bench.dtd"), "w") as f:
+            f.write(generate_dtd(SECTIONS * 4))
+        rows = []
+        size = 1000
+        for comments in [1, 10, 100]:
+            filename = os.path.join(directory, "bench%s.xml" % comments)
+            xml = generate_xml(size, sections=SECTIONS)
+            xml = xml.replace(
+                b"<document>",
+                b'<!DOCTYPE document SYSTEM "bench.dtd">\n<document>',
+            )
+            with open(filename, "wb") as f:
+                f.write(add_comments(xml, comments))
+
+            def load():
+                return factory.load(filename, validate=False)
+
+            one_pass = siblings = float("inf")
+            for i in range(ROUNDS):
+                one_pass = min(one_pass, bench(load, 1, 1))
+                elements._iter_children_xml = old_iter_children_xml
+                elements.TextElement.load_from_xml = old_text_load_from_xml
+                try:
+                    siblings = min(siblings, bench(load, 1, 1))
+                finally:
+                    elements._iter_children_xml = iter_children_xml
+                    elements.TextElement.load_from_xml = text_load_from_xml
+            rows += [
+                (
+                    size,
+                    comments * 3,
+                    siblings,
+                    one_pass,
+                    "%.2fx" % (siblings / one_pass),
+                )
+            ]
+        report(
+            "Load a commented document (s)",
+            rows,
+            ["items", "comments/item", "siblings", "one pass", "speedup"],
+        )
+    finally:
+        shutil.rmtree(directory)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,72 @@
+"""Time to create a document and render it, with the required descendants
+added on each rendering or created from the cached skeleton.
+"""
+
+from utils import bench, report
+
+from xmltool import factory
+
+# A document with required descendants on several levels
+DTD = """
+<!ELEMENT invoice (header, customer, lines, total, notes?)>
+<!ELEMENT header (number, date, currency)>
+<!ELEMENT customer (name, address, email?)>
+<!ELEMENT address (street, city, zip, country)>
+<!ELEMENT lines (line+)>
+<!ELEMENT line (product, quantity, price)>
+<!ELEMENT number (#PCDATA)>
+<!ELEMENT date (#PCDATA)>
+<!ELEMENT currency (#PCDATA)>
+<!ELEMENT name (#PCDATA)>
+<!ELEMENT email (#PCDATA)>
+<!ELEMENT street (#PCDATA)>
+<!ELEMENT city (#PCDATA)>
+<!ELEMENT zip (#PCDATA)>
+<!ELEMENT country (#PCDATA)>
+<!ELEMENT product (#PCDATA)>
+<!ELEMENT quantity (#PCDATA)>
+<!ELEMENT price (#PCDATA)>
+<!ELEMENT total (#PCDATA)>
+<!ELEMENT notes (#PCDATA)>
+"""
+
+
+def create_and_fill(skeleton):
+    obj = factory.create("invoice", dtd_str=DTD, skeleton=skeleton)
+    header = obj.get_or_add("header")
+    header.get_or_add("number").set_text("1")
+    header.get_or_add("currency").set_text("EUR")
+    customer = obj.get_or_add("customer")
+    customer.get_or_add("address").get_or_add("city").set_text("Paris")
+    return str(obj)
+
+
+def main():
+    # Warm the caches
+    assert create_and_fill(False) == create_and_fill(True)
+    rows = []
+    for name, func in [
+        (
+            "create",
+            lambda skeleton: factory.create("invoice", dtd_str=DTD, skeleton=skeleton),
+        ),
+        (
+            "create + render",
+            lambda skeleton: str(
+                factory.create("invoice", dtd_str=DTD, skeleton=skeleton)
+            ),
+        ),
+        ("create + fill + render", create_and_fill),
+    ]:
+        default = bench(lambda: func(False), number=1000)
+        skeleton = bench(lambda: func(True), number=1000)
+        rows += [(name, default, skeleton, "%.2fx" % (default / skeleton))]
+    report(
+        "Time by document (s)",
+        rows,
+        ["work", "default", "skeleton", "speedup"],
+    )
+
+
+if __name__ == "__main__":
+    main()
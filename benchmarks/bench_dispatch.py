@@ -0,0 +1,56 @@
+"""Time to load a document when the tag -> class tables are built once by
+class and when they are rebuilt on each add (the previous behaviour).
+"""
+
+import os
+import shutil
+import tempfile
+
+from utils import bench, generate_dtd, generate_xml, report
+
+from xmltool import elements, factory
+
+SECTIONS = 40
+
+get_class_to_create = elements.Element.__dict__["get_class_to_create"]
+
+
+def rebuild_table(cls, tagname):
+    return cls._get_creatable_subclass_by_tagnames().get(tagname)
+
+
+def main():
+    directory = tempfile.mkdtemp()
+    try:
+        with open(os.path.join(directory, "bench.dtd"), "w") as f:
+            f.write(generate_dtd(SECTIONS * 4))
+        rows = []
+        for size in [1000, 10000]:
+            filename = os.path.join(directory, "bench%s.xml" % size)
+            xml = generate_xml(size, sections=SECTIONS)
+            xml = xml.replace(
+                b"<document>",
+                b'<!DOCTYPE document SYSTEM "bench.dtd">\n<document>',
+            )
+            with open(filename, "wb") as f:
+                f.write(xml)
+            factory.load(filename)
+            number = max(1, 10000 // size)
+            tables = bench(lambda: factory.load(filename, validate=False), number)
+            elements.Element.get_class_to_create = classmethod(rebuild_table)
+            try:
+                rebuild = bench(lambda: factory.load(filename, validate=False), number)
+            finally:
+                elements.Element.get_class_to_create = get_class_to_create
+            rows += [(size, rebuild, tables, "%.2fx" % (rebuild / tables))]
+        report(
+            "Load a document of %s section types (s)" % SECTIONS,
+            rows,
+            ["items", "rebuilt tables", "tables", "speedup"],
+        )
+    finally:
+        shutil.rmtree(directory)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,62 @@
+"""Parse time of dtd_parser.dtd_to_dict_v2 against the size of the dtd.
+
+The previous implementation (comments removed with a regex, a findall on the
+declarations and each entity replaced in each element) is kept here to
+compare.
+"""
+
+import re
+
+from utils import bench, generate_dtd, report
+
+from xmltool import dtd_parser
+
+
+comment_regex_compile = re.compile(r"<!--(.*?)-->", re.DOTALL)
+tag_regex_compile = re.compile(r"<!(?P<type>[A-Z]+)(.*?)>", re.DOTALL)
+
+
+def previous_dtd_to_dict(dtd):
+    dtd_entities = {}
+    dtd_attributes = {}
+    dtd_elements = {}
+    res = comment_regex_compile.sub("", dtd)
+    tags = tag_regex_compile.findall(res)
+    for element, value in tags:
+        clean_value = dtd_parser.cleanup(value)
+        if element == "ELEMENT":
+            tagname, elements = dtd_parser.parse_element(clean_value)
+            dtd_elements[tagname] = elements
+        elif element == "ENTITY":
+            tagname, elements = dtd_parser.parse_entity(clean_value)
+            dtd_entities[tagname] = elements
+        elif element == "ATTLIST":
+            tagname, attributes = dtd_parser.parse_attribute(value)
+            dtd_attributes.setdefault(tagname, []).extend(attributes)
+
+    dic = {}
+    for tagname, elements in dtd_elements.items():
+        for key, value in dtd_entities.items():
+            elements = elements.replace("%s;" % key, value)
+        dic[tagname] = {"elts": elements, "attrs": dtd_attributes.get(tagname) or []}
+    return dic
+
+
+def main():
+    rows = []
+    for size in [100, 1000, 4000]:
+        dtd_str = generate_dtd(size)
+        assert previous_dtd_to_dict(dtd_str) == dtd_parser.dtd_to_dict_v2(dtd_str)
+        number = max(1, 2000 // size)
+        previous = bench(lambda: previous_dtd_to_dict(dtd_str), number=number)
+        current = bench(lambda: dtd_parser.dtd_to_dict_v2(dtd_str), number=number)
+        rows += [(size, previous, current, "%.2fx" % (previous / current))]
+    report(
+        "dtd_to_dict_v2 parse time (s)",
+        rows,
+        ["elements", "previous", "current", "speedup"],
+    )
+
+
+if __name__ == "__main__":
+    main()
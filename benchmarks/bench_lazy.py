@@ -0,0 +1,58 @@
+"""Time to the first load of a small document on a large dtd, with the
+classes created eagerly or lazily.
+"""
+
+import os
+import shutil
+import tempfile
+import time
+
+from utils import generate_dtd, report
+
+from xmltool import dtd, factory
+
+
+XML = b"""<?xml version='1.0' encoding='UTF-8'?>
+<!DOCTYPE document SYSTEM "document.dtd">
+<document>
+  <section0>
+    <title>Title</title>
+    <item0>value</item0>
+  </section0>
+</document>
+"""
+
+
+def first_load(filename, lazy):
+    # The parsed dtd is memoized by the previous loads
+    dtd.clear_memoized()
+    start = time.perf_counter()
+    obj = factory.load(filename, validate=False, lazy=lazy)
+    next(obj.children)["item0"][0].text
+    return time.perf_counter() - start
+
+
+def main():
+    directory = tempfile.mkdtemp()
+    try:
+        filename = os.path.join(directory, "document.xml")
+        with open(filename, "wb") as f:
+            f.write(XML)
+        rows = []
+        for size in [100, 1000, 4000, 8000]:
+            with open(os.path.join(directory, "document.dtd"), "w") as f:
+                f.write(generate_dtd(size))
+            eager = min(first_load(filename, False) for i in range(3))
+            lazy = min(first_load(filename, True) for i in range(3))
+            rows += [(size, eager, lazy, "%.2fx" % (eager / lazy))]
+        report(
+            "Time to the first load (s)",
+            rows,
+            ["elements", "eager", "lazy", "speedup"],
+        )
+    finally:
+        shutil.rmtree(directory)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,50 @@
+"""Latency to load a big document and read one field, with the object tree
+created eagerly or on access (lazy_xml).
+"""
+
+import os
+import shutil
+import tempfile
+
+from utils import bench, generate_dtd, generate_xml, report
+
+from xmltool import factory
+
+SECTIONS = 10
+
+
+def load_and_read(filename, validate, lazy_xml):
+    obj = factory.load(filename, validate=validate, lazy_xml=lazy_xml)
+    return next(obj.children)["title"].text
+
+
+def main():
+    directory = tempfile.mkdtemp()
+    try:
+        with open(os.path.join(directory, "bench.dtd"), "w") as f:
+            f.write(generate_dtd(SECTIONS * 4))
+        rows = []
+        for size in [100, 1000, 10000]:
+            filename = os.path.join(directory, "bench%s.xml" % size)
+            xml = generate_xml(size, sections=SECTIONS)
+            xml = xml.replace(
+                b"<document>",
+                b'<!DOCTYPE document SYSTEM "bench.dtd">\n<document>',
+            )
+            with open(filename, "wb") as f:
+                f.write(xml)
+            for validate in [True, False]:
+                eager = bench(lambda: load_and_read(filename, validate, False))
+                lazy = bench(lambda: load_and_read(filename, validate, True))
+                rows += [(size, validate, eager, lazy, "%.2fx" % (eager / lazy))]
+        report(
+            "Load a document of %s sections and read one title (s)" % SECTIONS,
+            rows,
+            ["items", "validate", "eager", "lazy_xml", "speedup"],
+        )
+    finally:
+        shutil.rmtree(directory)
+
+
+if __name__ == "__main__":
+    main()
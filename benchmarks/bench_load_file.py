@@ -0,0 +1,80 @@
+"""Peak memory and time to load a big XML file given as str, as bytes, by
+filename and mapped in memory with load_file. Each loading runs in its own
+process to measure its peak memory, tracemalloc gives the peak of the
+python allocations (the copies of the XML) and ru_maxrss the peak of the
+process.
+"""
+
+import os
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+from utils import generate_dtd, generate_xml, report
+
+from xmltool import factory
+
+SECTIONS = 10
+
+
+def run(mode, filename):
+    tracemalloc.start()
+    start = time.perf_counter()
+    if mode == "str":
+        with open(filename) as f:
+            factory.load_string(f.read(), validate=False)
+    elif mode == "bytes":
+        with open(filename, "rb") as f:
+            factory.load_string(f.read(), validate=False)
+    elif mode == "load":
+        factory.load(filename, validate=False)
+    else:
+        factory.load_file(filename, validate=False)
+    elapsed = time.perf_counter() - start
+    python_peak = tracemalloc.get_traced_memory()[1] / 1024.0 / 1024.0
+    # ru_maxrss is in KB on linux
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0
+    print("%s %s %s" % (elapsed, python_peak, peak))
+
+
+def main():
+    directory = tempfile.mkdtemp()
+    try:
+        with open(os.path.join(directory, "bench.dtd"), "w") as f:
+            f.write(generate_dtd(SECTIONS * 4))
+        rows = []
+        for size in [100000]:
+            filename = os.path.join(directory, "bench%s.xml" % size)
+            xml = generate_xml(size, sections=SECTIONS)
+            xml = xml.replace(
+                b"<document>",
+                b'<!DOCTYPE document SYSTEM "%s">\n<document>'
+                % os.path.join(directory, "bench.dtd").encode("utf-8"),
+            )
+            with open(filename, "wb") as f:
+                f.write(xml)
+            size_mb = len(xml) / 1024.0 / 1024.0
+            for mode in ["str", "bytes", "load", "load_file"]:
+                out = subprocess.check_output(
+                    [sys.executable, os.path.abspath(__file__), mode, filename]
+                )
+                elapsed, python_peak, peak = [float(v) for v in out.split()]
+                rows += [("%.1f" % size_mb, mode, elapsed, python_peak, peak)]
+        report(
+            "Load a document of %s sections" % SECTIONS,
+            rows,
+            ["file (MB)", "mode", "time (s)", "python peak (MB)", "peak (MB)"],
+        )
+    finally:
+        shutil.rmtree(directory)
+
+
+if __name__ == "__main__":
+    if len(sys.argv) == 3:
+        run(*sys.argv[1:])
+    else:
+        main()
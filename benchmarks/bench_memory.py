@@ -0,0 +1,63 @@
+"""Python memory used by the loaded objects, in bytes by element.
+
+tracemalloc only sees the python allocations, the lxml tree is not counted.
+"""
+
+import gc
+import os
+import shutil
+import tempfile
+import tracemalloc
+
+from utils import generate_dtd, generate_xml, report
+
+from xmltool import factory
+
+SECTIONS = 10
+
+
+def measure(load, filename):
+    gc.collect()
+    tracemalloc.start()
+    obj = load(filename)
+    gc.collect()
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    count = 1 + sum(1 for e in obj.walk())
+    return size, count
+
+
+def main():
+    directory = tempfile.mkdtemp()
+    try:
+        with open(os.path.join(directory, "bench.dtd"), "w") as f:
+            f.write(generate_dtd(SECTIONS * 4))
+        rows = []
+        for size in [10000, 100000]:
+            filename = os.path.join(directory, "bench%s.xml" % size)
+            xml = generate_xml(size, sections=SECTIONS)
+            xml = xml.replace(
+                b"<document>",
+                b'<!DOCTYPE document SYSTEM "bench.dtd">\n<document>',
+            )
+            with open(filename, "wb") as f:
+                f.write(xml)
+            # Create the classes before measuring
+            factory.load(filename)
+            for mode, load in [
+                ("load", factory.load),
+                ("load_stream", factory.load_stream),
+            ]:
+                total, count = measure(load, filename)
+                rows += [(size, mode, count, total / 1024.0 / 1024.0, total // count)]
+        report(
+            "Python memory of a loaded document of %s sections" % SECTIONS,
+            rows,
+            ["items", "mode", "elements", "total (MB)", "bytes by element"],
+        )
+    finally:
+        shutil.rmtree(directory)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,41 @@
+"""Cold start: parse the dtd against rehydrate the classes from the compiled
+schema stored on disk.
+
+The rehydration doesn't parse the content models, its time is spent creating
+the classes which both have to do.
+"""
+
+import shutil
+import tempfile
+
+from utils import bench, generate_dtd, report
+
+from xmltool import dtd_parser, schema
+
+
+def main():
+    directory = tempfile.mkdtemp()
+    try:
+        store = schema.SchemaStore(directory)
+        rows = []
+        for size in [100, 1000, 4000]:
+            dtd_str = generate_dtd(size)
+            store.get_or_compile(dtd_str)
+            key = schema.content_hash(dtd_str)
+            parse = bench(
+                lambda: dtd_parser._create_classes(dtd_parser.dtd_to_dict_v2(dtd_str)),
+                number=3,
+            )
+            rehydrate = bench(lambda: schema.build_classes(store.get(key)), number=3)
+            rows += [(size, parse, rehydrate, "%.2fx" % (parse / rehydrate))]
+        report(
+            "Time to get the classes (s)",
+            rows,
+            ["elements", "parse", "rehydrate", "speedup"],
+        )
+    finally:
+        shutil.rmtree(directory)
+
+
+if __name__ == "__main__":
+    main()
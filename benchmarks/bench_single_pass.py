@@ -0,0 +1,46 @@
+"""Time to load a validated document when the tree is validated after the
+parsing and when it's validated while parsing (single_pass).
+"""
+
+import os
+import shutil
+import tempfile
+
+from utils import bench, generate_dtd, generate_xml, report
+
+from xmltool import factory
+
+SECTIONS = 10
+
+
+def main():
+    directory = tempfile.mkdtemp()
+    try:
+        with open(os.path.join(directory, "bench.dtd"), "w") as f:
+            f.write(generate_dtd(SECTIONS * 4))
+        rows = []
+        for size in [10, 1000, 10000]:
+            filename = os.path.join(directory, "bench%s.xml" % size)
+            xml = generate_xml(size, sections=SECTIONS)
+            xml = xml.replace(
+                b"<document>",
+                b'<!DOCTYPE document SYSTEM "bench.dtd">\n<document>',
+            )
+            with open(filename, "wb") as f:
+                f.write(xml)
+            # Warm the caches
+            factory.load(filename)
+            two_pass = bench(lambda: factory.load(filename))
+            single_pass = bench(lambda: factory.load(filename, single_pass=True))
+            rows += [(size, two_pass, single_pass, "%.2fx" % (two_pass / single_pass))]
+        report(
+            "Load and validate a document of %s sections (s)" % SECTIONS,
+            rows,
+            ["items", "two pass", "single pass", "speedup"],
+        )
+    finally:
+        shutil.rmtree(directory)
+
+
+if __name__ == "__main__":
+    main()
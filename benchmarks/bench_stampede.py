@@ -0,0 +1,88 @@
+"""Many threads ask for the classes of a dtd when its cache entry expires: the
+get-then-set used before against the single-flight get_or_create.
+"""
+
+import os
+import shutil
+import tempfile
+import threading
+import time
+
+from dogpile.cache.api import NO_VALUE
+from utils import generate_dtd, report
+
+from xmltool import cache, dtd, dtd_parser
+
+THREADS = 16
+
+
+def legacy_parse(dtd_obj):
+    """DTD.parse before the single-flight"""
+    cache_key = "xmltool.parse.%s" % dtd_obj.url
+    value = cache.region.get(cache_key, cache.CACHE_TIMEOUT)
+    if value is not NO_VALUE:
+        return value
+    value = dtd_obj._parse()
+    cache.region.set(cache_key, value)
+    return value
+
+
+def run(func, url):
+    """Returns the number of parsings and the time for all the threads"""
+    calls = []
+    original = dtd_parser.dtd_to_dict_v2
+
+    def counting(content):
+        calls.append(1)
+        return original(content)
+
+    barrier = threading.Barrier(THREADS)
+
+    def target():
+        barrier.wait()
+        func(dtd.DTD(url))
+
+    dtd_parser.dtd_to_dict_v2 = counting
+    try:
+        threads = [threading.Thread(target=target) for i in range(THREADS)]
+        start = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - start
+    finally:
+        dtd_parser.dtd_to_dict_v2 = original
+    return len(calls), elapsed
+
+
+def main():
+    directory = tempfile.mkdtemp()
+    cache.CACHE_TIMEOUT = 3600
+    try:
+        rows = []
+        for size in [100, 1000, 4000]:
+            url = os.path.join(directory, "bench%s.dtd" % size)
+            with open(url, "w") as f:
+                f.write(generate_dtd(size))
+            # The content is in the cache, only the parsed classes expire
+            content = dtd.DTD(url).content
+            for name, func in [
+                ("get-then-set", legacy_parse),
+                ("single-flight", lambda obj: obj.parse()),
+            ]:
+                cache.region.invalidate()
+                cache.region.set("xmltool.get_dtd_content.%s" % url, content)
+                parsings, elapsed = run(func, url)
+                rows += [(size, name, parsings, elapsed)]
+        report(
+            "%s threads asking for an expired dtd" % THREADS,
+            rows,
+            ["elements", "strategy", "parsings", "time (s)"],
+        )
+    finally:
+        shutil.rmtree(directory)
+
+
+if __name__ == "__main__":
+    main()
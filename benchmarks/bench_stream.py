@@ -0,0 +1,69 @@
+"""Peak memory and time to load a big XML file with load, load_stream and
+iterload. Each loading runs in its own process to measure its peak memory.
+"""
+
+import os
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+from utils import generate_dtd, generate_xml, report
+
+from xmltool import factory
+
+SECTIONS = 10
+
+
+def run(mode, filename):
+    start = time.perf_counter()
+    if mode == "load":
+        factory.load(filename)
+    elif mode == "load_stream":
+        factory.load_stream(filename)
+    else:
+        for section in factory.iterload(filename):
+            pass
+    elapsed = time.perf_counter() - start
+    # ru_maxrss is in KB on linux
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0
+    print("%s %s" % (elapsed, peak))
+
+
+def main():
+    directory = tempfile.mkdtemp()
+    try:
+        with open(os.path.join(directory, "bench.dtd"), "w") as f:
+            f.write(generate_dtd(SECTIONS * 4))
+        rows = []
+        for size in [10000, 100000]:
+            filename = os.path.join(directory, "bench%s.xml" % size)
+            xml = generate_xml(size, sections=SECTIONS)
+            xml = xml.replace(
+                b"<document>",
+                b'<!DOCTYPE document SYSTEM "bench.dtd">\n<document>',
+            )
+            with open(filename, "wb") as f:
+                f.write(xml)
+            for mode in ["load", "load_stream", "iterload"]:
+                out = subprocess.check_output(
+                    [sys.executable, os.path.abspath(__file__), mode, filename]
+                )
+                elapsed, peak = [float(v) for v in out.split()]
+                rows += [(size, mode, elapsed, peak)]
+        report(
+            "Load a document of %s sections" % SECTIONS,
+            rows,
+            ["items", "mode", "time (s)", "peak (MB)"],
+        )
+    finally:
+        shutil.rmtree(directory)
+
+
+if __name__ == "__main__":
+    if len(sys.argv) == 3:
+        run(*sys.argv[1:])
+    else:
+        main()
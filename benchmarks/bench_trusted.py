@@ -0,0 +1,65 @@
+"""Objects created by second when loading a validated document: the
+following items of a list are attached directly (trusted) or all the
+children are added with the checks of add.
+"""
+
+import os
+import shutil
+import tempfile
+
+from utils import bench, generate_dtd, generate_xml, report
+
+from xmltool import factory
+
+SECTIONS = 10
+ROUNDS = 20
+
+
+def main():
+    directory = tempfile.mkdtemp()
+    try:
+        with open(os.path.join(directory, "bench.dtd"), "w") as f:
+            f.write(generate_dtd(SECTIONS * 4))
+        rows = []
+        for size in [1000, 10000]:
+            filename = os.path.join(directory, "bench%s.xml" % size)
+            xml = generate_xml(size, sections=SECTIONS)
+            xml = xml.replace(
+                b"<document>",
+                b'<!DOCTYPE document SYSTEM "bench.dtd">\n<document>',
+            )
+            with open(filename, "wb") as f:
+                f.write(xml)
+            obj = factory.load(filename)
+            count = sum(1 for o in obj.walk())
+            tree = factory.etree.parse(filename)
+            dic = factory.dtd.DTD(tree.docinfo.system_url, directory).parse()
+            number = max(1, 10000 // size)
+
+            def build(trusted):
+                return factory._create_from_tree(tree, filename, dic, trusted=trusted)
+
+            # Interleaved since the difference is small against the noise
+            checked = trusted = float("inf")
+            for i in range(ROUNDS):
+                checked = min(checked, bench(lambda: build(False), number, 1))
+                trusted = min(trusted, bench(lambda: build(True), number, 1))
+            rows += [
+                (
+                    count,
+                    "%d" % (count / checked),
+                    "%d" % (count / trusted),
+                    "%.2fx" % (checked / trusted),
+                )
+            ]
+        report(
+            "Objects created by second from a validated tree",
+            rows,
+            ["objects", "add", "trusted", "speedup"],
+        )
+    finally:
+        shutil.rmtree(directory)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,67 @@
+"""Compile the dtd with a temporary file like before against the in-memory
+compilation, and the validations per second of validate_xml with the cache of
+the validators.
+"""
+
+import os
+import tempfile
+from io import StringIO
+
+from lxml import etree
+from utils import bench, generate_dtd, generate_xml, report
+
+from xmltool import dtd
+
+
+def legacy_compile_validator(content):
+    """The compilation of the dtd before the in-memory validation"""
+    f, filename = tempfile.mkstemp()
+    try:
+        try:
+            os.write(f, content.encode("utf-8"))
+        finally:
+            os.close(f)
+        dtd_obj = etree.DTD(filename)
+    finally:
+        os.remove(filename)
+    if dtd_obj.error_log:
+        raise dtd.ValidationError(dtd_obj.error_log)
+    return dtd_obj
+
+
+def legacy_validate_xml(content, xml):
+    """validate_xml compiled the dtd twice before the cache of the validators"""
+    legacy_compile_validator(content)
+    etree.DTD(StringIO(content)).assertValid(xml)
+
+
+def main():
+    rows = []
+    for size in [100, 1000, 4000]:
+        content = generate_dtd(size)
+        legacy = bench(lambda: legacy_compile_validator(content), number=20)
+        memory = bench(lambda: dtd.compile_validator(content), number=20)
+        rows += [(size, 1 / legacy, 1 / memory, "%.2fx" % (legacy / memory))]
+    report(
+        "Dtd compilations per second",
+        rows,
+        ["elements", "tempfile", "in-memory", "speedup"],
+    )
+
+    rows = []
+    xml = etree.fromstring(generate_xml(100))
+    for size in [100, 1000, 4000]:
+        content = generate_dtd(size)
+        dtd_obj = dtd.DTD(StringIO(content))
+        legacy = bench(lambda: legacy_validate_xml(content, xml), number=20)
+        cached = bench(lambda: dtd_obj.validate_xml(xml), number=20)
+        rows += [(size, 1 / legacy, 1 / cached, "%.2fx" % (legacy / cached))]
+    report(
+        "validate_xml per second",
+        rows,
+        ["elements", "before", "after", "speedup"],
+    )
+
+
+if __name__ == "__main__":
+    main()
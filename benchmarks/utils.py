@@ -0,0 +1,69 @@
+"""Helpers shared by the benchmark scripts.
+
+The benchmarks are plain scripts, run them from the root of the repository:
+
+    python benchmarks/bench_dtd_parser.py
+"""
+
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+
+def generate_dtd(size):
+    """Generate a dtd with about `size` elements.
+
+    Each section contains a list, a choice and some text elements. The
+    declarations are commented and use parameter entities like the industry
+    dtds do.
+    """
+    lines = [
+        "<!-- Generated dtd with %s elements -->" % size,
+        '<!ENTITY % common "title?, para*">',
+        "<!ELEMENT title (#PCDATA)>",
+        "<!ELEMENT para (#PCDATA)>",
+    ]
+    sections = max(size // 4, 1)
+    root_children = "|".join("section%s" % i for i in range(sections))
+    lines += ["<!ELEMENT document (%s)*>" % root_children]
+    for i in range(sections):
+        lines += [
+            "<!-- Section %s: a list of items and a choice -->" % i,
+            '<!ENTITY %% items%s "item%s+">' % (i, i),
+            "<!ELEMENT section%s (%%common;, %%items%s;, (choice%sa|choice%sb)?)>"
+            % (i, i, i, i),
+            "<!ATTLIST section%s id ID #IMPLIED>" % i,
+            "<!ELEMENT item%s (#PCDATA)>" % i,
+            "<!ELEMENT choice%sa (#PCDATA)>" % i,
+            "<!ELEMENT choice%sb (para+)>" % i,
+        ]
+    return "\n".join(lines)
+
+
+def generate_xml(size, sections=10):
+    """Generate a document valid for generate_dtd(sections * 4)"""
+    lines = ["<?xml version='1.0' encoding='UTF-8'?>", "<document>"]
+    for i in range(sections):
+        lines += ['  <section%s id="s%s">' % (i, i), "    <title>Title</title>"]
+        items = max(size // sections, 1)
+        lines += ["    <item%s>value %s</item%s>" % (i, j, i) for j in range(items)]
+        lines += ["  </section%s>" % i]
+    lines += ["</document>", ""]
+    return "\n".join(lines).encode("utf-8")
+
+
+def bench(func, number=10, repeat=3):
+    """Returns the best time in seconds of one call to func"""
+    return min(timeit.repeat(func, number=number, repeat=repeat)) / number
+
+
+def report(title, rows, headers):
+    print(title)
+    print("  ".join("%15s" % h for h in headers))
+    for row in rows:
+        print(
+            "  ".join("%15.6f" % v if isinstance(v, float) else "%15s" % v for v in row)
+        )
+    print()
@@ -46,5 +46,7 @@ setup(
     ],
     entry_points="""
       # -*- Entry points: -*-
+      [console_scripts]
+      xmltool-codegen = xmltool.codegen:main
       """,
 )
@@ -426,7 +426,7 @@ class TestElementWithAttributes(ElementTester):
         dic = dtd.DTD(StringIO(self.dtd_str)).parse()
         obj = dic[root.tag]()
         obj.load_from_xml(root)
-        self.assertEqual(obj._attribute_names, ["idtexts", "name"])
+        self.assertEqual(obj._attribute_names, ("idtexts", "name"))
         self.assertEqual(
             obj.attributes,
             {
@@ -434,21 +434,21 @@ class TestElementWithAttributes(ElementTester):
                 "name": "my texts",
             },
         )
-        self.assertEqual(obj["text"]._attribute_names, ["idtext"])
+        self.assertEqual(obj["text"]._attribute_names, ("idtext",))
         self.assertEqual(
             obj["text"].attributes,
             {
                 "idtext": "id_text",
             },
         )
-        self.assertEqual(obj["text1"][0]._attribute_names, ["idtext1"])
+        self.assertEqual(obj["text1"][0]._attribute_names, ("idtext1",))
         self.assertEqual(
             obj["text1"][0].attributes,
             {
                 "idtext1": "id_text1_1",
             },
         )
-        self.assertEqual(obj["text1"][1]._attribute_names, ["idtext1"])
+        self.assertEqual(obj["text1"][1]._attribute_names, ("idtext1",))
         self.assertEqual(obj["text1"][1].attributes, None)
 
     def test_walk(self):
@@ -0,0 +1,96 @@
+#!/usr/bin/env python
+
+from lxml import etree
+import mock
+import threading
+from unittest import TestCase
+
+from xmltool import batch, dtd, factory
+
+
+class TestBatch(TestCase):
+    def test_load_many(self):
+        filenames = [
+            "tests/exercise.xml",
+            "tests/exercise-notvalid.xml",
+            "tests/exercise.xml",
+            "tests/not-found.xml",
+        ]
+        results = list(batch.load_many(filenames, workers=2))
+        self.assertEqual([r.filename for r in results], filenames)
+        self.assertEqual([r.ok for r in results], [True, False, True, False])
+        expected = factory.load("tests/exercise.xml")
+        self.assertEqual(str(results[0].obj), str(expected))
+        self.assertEqual(results[0].obj.filename, "tests/exercise.xml")
+        self.assertEqual(results[0].obj.dtd_url, "exercise.dtd")
+        # The classes are shared by the files of the same dtd
+        self.assertTrue(results[0].obj.__class__ is results[2].obj.__class__)
+        self.assertTrue(isinstance(results[1].error, etree.DocumentInvalid))
+        self.assertEqual(
+            str(results[1].error),
+            "Element comments content does not follow the DTD, expecting "
+            "(comment)+, got (), line 17",
+        )
+        self.assertTrue(isinstance(results[3].error, IOError))
+
+        results = list(batch.load_many(["tests/exercise-notvalid.xml"], validate=False))
+        self.assertEqual(results[0].ok, True)
+        self.assertEqual(results[0].obj.tagname, "Exercise")
+
+    def test_load_many_dtd_once(self):
+        with mock.patch(
+            "xmltool.dtd.DTD.parse", side_effect=dtd.DTD.parse, autospec=True
+        ) as m:
+            results = list(batch.load_many(["tests/exercise.xml"] * 6, workers=3))
+        self.assertEqual([r.ok for r in results], [True] * 6)
+        # Once when creating the dtd, then the parsed classes are given
+        self.assertEqual(len(set(id(call[0][0]) for call in m.call_args_list)), 1)
+
+    def test_max_in_flight(self):
+        in_flight = [0]
+        max_seen = [0]
+        lock = threading.Lock()
+        load_file = batch._load_file
+
+        def _load_file(*args):
+            with lock:
+                in_flight[0] += 1
+                max_seen[0] = max(max_seen[0], in_flight[0])
+            return load_file(*args)
+
+        with mock.patch("xmltool.batch._load_file", side_effect=_load_file):
+            for result in batch.load_many(
+                ("tests/exercise.xml" for i in range(10)),
+                workers=4,
+                max_in_flight=2,
+            ):
+                self.assertEqual(result.ok, True)
+                with lock:
+                    in_flight[0] -= 1
+        self.assertTrue(max_seen[0] <= 2)
+
+    def test_validate_many(self):
+        filenames = ["tests/exercise.xml", "tests/exercise-notvalid.xml"]
+        results = list(batch.validate_many(filenames, workers=2))
+        self.assertEqual([r.filename for r in results], filenames)
+        self.assertEqual([r.ok for r in results], [True, False])
+        self.assertEqual(results[0].obj, None)
+        self.assertTrue(isinstance(results[1].error, etree.DocumentInvalid))
+
+    def test_validate_many_processes(self):
+        filenames = ["tests/exercise.xml", "tests/exercise-notvalid.xml"]
+        results = list(batch.validate_many(filenames, workers=2, processes=True))
+        self.assertEqual([r.ok for r in results], [True, False])
+        self.assertTrue(isinstance(results[1].error, batch.BatchError))
+        self.assertEqual(results[1].error.error_type, "DocumentInvalid")
+        self.assertEqual(
+            str(results[1].error),
+            "Element comments content does not follow the DTD, expecting "
+            "(comment)+, got (), line 17",
+        )
+
+    def test__get_process_schemas(self):
+        with mock.patch("xmltool.batch._process_schemas", {}):
+            schemas = batch._get_process_schemas(None)
+            self.assertEqual(schemas.dtd_module, None)
+            self.assertTrue(batch._get_process_schemas(None) is schemas)
@@ -0,0 +1,129 @@
+#!/usr/bin/env python
+
+import os
+import shutil
+import tempfile
+from unittest import TestCase
+
+from dogpile.cache.api import NO_VALUE
+
+from xmltool import cache, dtd_parser
+
+
+class TestLRUDict(TestCase):
+    def test_lru_dict(self):
+        dic = cache.LRUDict(2)
+        dic.set("key1", "value1")
+        dic.set("key2", "value2")
+        self.assertEqual(dic.get("key1"), "value1")
+        dic.set("key3", "value3")
+        self.assertEqual(dic.get("key2"), None)
+        self.assertEqual(dic.get("key2", "default"), "default")
+        self.assertEqual(len(dic), 2)
+        dic.clear()
+        self.assertEqual(dic.get("key1"), None)
+
+
+class TestLRUBackend(TestCase):
+    def test_max_entries(self):
+        backend = cache.LRUBackend({"max_entries": 2})
+        backend.set("key1", "value1")
+        backend.set("key2", "value2")
+        self.assertEqual(backend.get("key1"), "value1")
+        backend.set("key3", "value3")
+        # key2 is the least recently used
+        self.assertEqual(backend.get("key2"), NO_VALUE)
+        self.assertEqual(backend.get("key1"), "value1")
+        self.assertEqual(backend.get("key3"), "value3")
+        self.assertEqual(
+            backend.stats(),
+            {
+                "hits": 3,
+                "misses": 1,
+                "disk_hits": 0,
+                "evictions": 1,
+                "entries": 2,
+                "bytes": 12,
+            },
+        )
+
+    def test_max_bytes(self):
+        backend = cache.LRUBackend({"max_bytes": 10})
+        backend.set("key1", "12345")
+        backend.set("key2", "12345")
+        self.assertEqual(backend.stats()["bytes"], 10)
+        backend.set("key1", "123")
+        self.assertEqual(backend.stats()["bytes"], 8)
+        backend.set("key3", "1234")
+        self.assertEqual(backend.get("key2"), NO_VALUE)
+        self.assertEqual(backend.stats()["bytes"], 7)
+        # A value bigger than the limit is not kept
+        backend.set("key4", "12345678901")
+        self.assertEqual(backend.stats()["entries"], 0)
+        self.assertEqual(backend.stats()["evictions"], 4)
+
+        backend.set("key1", "123")
+        backend.delete("key1")
+        self.assertEqual(backend.get("key1"), NO_VALUE)
+        self.assertEqual(backend.stats()["bytes"], 0)
+
+    def test_sizeof(self):
+        self.assertEqual(cache._sizeof("12345"), 5)
+        self.assertEqual(cache._sizeof(b"123"), 3)
+        content = "<!ELEMENT tag (sub)><!ELEMENT sub (#PCDATA)>"
+        classes = dtd_parser._create_classes(dtd_parser.dtd_to_dict_v2(content))
+        self.assertEqual(cache._sizeof(classes), 2 * cache.CLASS_SIZE)
+        lazy = dtd_parser.LazyClassDict(dtd_dict=dtd_parser.dtd_to_dict_v2(content))
+        self.assertEqual(cache._sizeof(lazy), 2 * cache.CLASS_SIZE)
+
+
+class TestDiskCache(TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+        cache.configure()
+
+    def test_disk(self):
+        backend = cache.LRUBackend({"max_entries": 1, "directory": self.directory})
+        backend.set("key1", "value1")
+        backend.set("key2", "value2")
+        self.assertEqual(len(os.listdir(self.directory)), 2)
+        # The values not in memory are read from the disk
+        self.assertEqual(backend.get("key1"), "value1")
+        self.assertEqual(backend.stats()["disk_hits"], 1)
+        self.assertEqual(backend.get("key1"), "value1")
+        self.assertEqual(backend.stats()["hits"], 1)
+
+        # Like after a restart
+        backend = cache.LRUBackend({"directory": self.directory})
+        self.assertEqual(backend.get("key2"), "value2")
+
+        # The values we can't pickle are only in memory
+        value = type("Cls", (object,), {})
+        backend.set("key3", value)
+        self.assertEqual(len(os.listdir(self.directory)), 2)
+        self.assertEqual(backend.get("key3"), value)
+
+        backend.delete("key2")
+        self.assertEqual(len(os.listdir(self.directory)), 1)
+        self.assertEqual(backend.get("key2"), NO_VALUE)
+
+    def test_configure(self):
+        cache.configure(max_entries=None, max_bytes=1000, directory=self.directory)
+        self.assertEqual(cache.region.backend.max_entries, None)
+        self.assertEqual(cache.region.backend.max_bytes, 1000)
+        self.assertEqual(
+            cache.get_schema_dir(), os.path.join(self.directory, "schemas")
+        )
+        cache.region.set("key", "value")
+        self.assertEqual(cache.region.get("key"), "value")
+        self.assertEqual(cache.stats()["hits"], 1)
+        self.assertEqual(cache.stats()["entries"], 1)
+
+        cache.configure()
+        self.assertEqual(cache.region.backend.max_entries, cache.DEFAULT_MAX_ENTRIES)
+        self.assertEqual(cache.region.backend.disk, None)
+        self.assertEqual(cache.get_schema_dir(), None)
+        self.assertEqual(cache.region.get("key"), NO_VALUE)
@@ -0,0 +1,90 @@
+#!/usr/bin/env python
+
+import importlib.util
+import os
+import shutil
+import tempfile
+from io import StringIO
+from lxml import etree
+from unittest import TestCase
+
+from xmltool import codegen, dtd, factory
+from xmltool.elements import ChoiceElement, ListElement, TextElement
+
+from .test_dtd_parser import EXERCISE_DTD, MOVIE_DTD, MOVIE_XML_TITANIC
+
+
+def import_module(filename):
+    spec = importlib.util.spec_from_file_location("generated_dtd", filename)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+class TestCodegen(TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.filename = os.path.join(self.directory, "generated_dtd.py")
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_generate_module(self):
+        codegen.write_module(self.filename, dtd_str=MOVIE_DTD)
+        module = import_module(self.filename)
+        self.assertEqual(module.DTD_URL, None)
+        self.assertEqual(module.DTD_CONTENT, MOVIE_DTD)
+
+        expected = dtd.DTD(StringIO(MOVIE_DTD)).parse()
+        self.assertEqual(sorted(module.CLASSES), sorted(expected))
+        for tagname, cls in expected.items():
+            generated = module.CLASSES[tagname]
+            self.assertEqual(generated.tagname, tagname)
+            self.assertEqual(generated.__slots__, ())
+            self.assertEqual(
+                [(c.tagname, c._required) for c in generated.children_classes],
+                [(c.tagname, c._required) for c in cls.children_classes],
+            )
+            self.assertEqual(
+                sorted(generated._creatable_subclasses),
+                sorted(cls._get_creatable_subclass_by_tagnames()),
+            )
+
+        movie = module.CLASSES["Movie"]
+        self.assertTrue(issubclass(module.CLASSES["name"], TextElement))
+        self.assertTrue(issubclass(movie.children_classes[-1], ListElement))
+        self.assertEqual(
+            movie.children_classes[-1]._children_class._parent_cls,
+            movie.children_classes[-1],
+        )
+
+        obj = factory.load_string(
+            MOVIE_XML_TITANIC.decode("utf-8"), validate=False, dtd_module=module
+        )
+        self.assertEqual(obj["actors"]["actor"][1]["name"].text, "Winslet")
+        root = etree.fromstring(MOVIE_XML_TITANIC)
+        expected_obj = expected["Movie"]()
+        expected_obj.load_from_xml(root)
+        self.assertEqual(str(obj), str(expected_obj))
+
+    def test_generate_module_choice(self):
+        codegen.write_module(self.filename, dtd_str=EXERCISE_DTD)
+        module = import_module(self.filename)
+        test = module.CLASSES["test"]
+        self.assertTrue(issubclass(test.children_classes[0], ChoiceElement))
+        obj = factory.create("test", dtd_module=module)
+        obj.add("qcm")
+        self.assertFalse(obj.is_addable("mqm"))
+        self.assertEqual(obj.dtd_str, EXERCISE_DTD)
+
+    def test_main(self):
+        codegen.main(["tests/exercise.dtd", self.filename])
+        module = import_module(self.filename)
+        self.assertEqual(module.DTD_URL, "tests/exercise.dtd")
+        obj = factory.load("tests/exercise.xml", dtd_module=module)
+        self.assertEqual(obj.tagname, "Exercise")
+        try:
+            factory.load("tests/exercise-notvalid.xml", dtd_module=module)
+            assert 0
+        except etree.DocumentInvalid:
+            pass
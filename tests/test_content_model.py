@@ -0,0 +1,104 @@
+#!/usr/bin/env python
+
+from unittest import TestCase
+from xmltool import content_model
+from xmltool.content_model import ContentModelAutomaton, Group, Name
+
+
+class TestContentModel(TestCase):
+    def test_parse(self):
+        self.assertEqual(content_model.parse("EMPTY"), Name("EMPTY"))
+        self.assertEqual(content_model.parse("#PCDATA"), Name("#PCDATA"))
+        self.assertEqual(content_model.parse("tag+"), Name("tag", "+"))
+        self.assertEqual(
+            content_model.parse("a,b?"), Group(",", [Name("a"), Name("b", "?")])
+        )
+        self.assertEqual(
+            content_model.parse("(a|b)*"), Group("|", [Name("a"), Name("b")], "*")
+        )
+        node = content_model.parse("(a,(b|c)+,d?)")
+        expected = Group(
+            ",",
+            [Name("a"), Group("|", [Name("b"), Name("c")], "+"), Name("d", "?")],
+        )
+        self.assertEqual(node, expected)
+        self.assertEqual(content_model.to_string(node), "(a,(b|c)+,d?)")
+
+        node = content_model.parse("(#PCDATA|a|b)*")
+        self.assertTrue(node.is_mixed)
+        self.assertEqual(node.names(), ["#PCDATA", "a", "b"])
+
+    def test_parse_exception(self):
+        self.assertRaises(Exception, content_model.parse, "(a,b")
+        self.assertRaises(Exception, content_model.parse, "a,b|c")
+        self.assertRaises(Exception, content_model.parse, "a,,b")
+
+    def test_automaton(self):
+        automaton = ContentModelAutomaton.compile(content_model.parse("(a,(b|c)+,d?)"))
+        self.assertEqual(automaton.alphabet, set(["a", "b", "c", "d"]))
+        self.assertEqual(automaton.required, set(["a"]))
+        self.assertTrue(automaton.accepts(["a", "b"]))
+        self.assertTrue(automaton.accepts(["a", "b", "c", "b", "d"]))
+        self.assertFalse(automaton.accepts(["a"]))
+        self.assertFalse(automaton.accepts(["a", "d"]))
+        self.assertFalse(automaton.accepts(["b", "a"]))
+        self.assertEqual(automaton.allowed(["a"]), set(["b", "c"]))
+        self.assertEqual(automaton.allowed(["a", "b"]), set(["b", "c", "d"]))
+        self.assertEqual(automaton.allowed(["d"]), set())
+
+    def test_automaton_special(self):
+        automaton = ContentModelAutomaton.compile(content_model.parse("EMPTY"))
+        self.assertTrue(automaton.accepts([]))
+        self.assertFalse(automaton.accepts(["a"]))
+
+        automaton = ContentModelAutomaton.compile(content_model.parse("ANY"))
+        self.assertTrue(automaton.accepts(["a", "b"]))
+
+        automaton = ContentModelAutomaton.compile(content_model.parse("(#PCDATA|a|b)*"))
+        self.assertTrue(automaton.accepts([]))
+        self.assertTrue(automaton.accepts(["b", "a", "b"]))
+        self.assertEqual(automaton.required, set())
+
+    def test_automaton_tables(self):
+        automaton = ContentModelAutomaton.compile(content_model.parse("(a,(b|c)+,d?)"))
+        self.assertEqual(automaton.repeatable, set(["b", "c"]))
+        self.assertEqual(automaton.excluded, {})
+
+        automaton = ContentModelAutomaton.compile(
+            content_model.parse("(a,((b,c)|d),a?)")
+        )
+        self.assertEqual(automaton.repeatable, set(["a"]))
+        self.assertEqual(
+            automaton.excluded,
+            {"b": set(["d"]), "c": set(["d"]), "d": set(["b", "c"])},
+        )
+        self.assertEqual(automaton.required, set(["a"]))
+
+        data = automaton.to_data()
+        loaded = ContentModelAutomaton.from_data(data)
+        self.assertEqual(loaded.to_data(), data)
+        self.assertEqual(loaded.excluded, automaton.excluded)
+
+        automaton = ContentModelAutomaton.compile(content_model.parse("ANY"))
+        self.assertEqual(automaton.repeatable, set())
+        self.assertEqual(automaton.excluded, {})
+
+    def test_check_addable(self):
+        automaton = ContentModelAutomaton.compile(
+            content_model.parse("(a,((b,c)|d),e*)")
+        )
+        automaton.check_addable([], "a")
+        automaton.check_addable(["a", "b"], "c")
+        automaton.check_addable(["e"], "e")
+        # Not in the content model
+        automaton.check_addable(["a"], "list__e")
+        try:
+            automaton.check_addable(["a"], "a")
+            assert 0
+        except Exception as e:
+            self.assertEqual(str(e), "a is already defined")
+        try:
+            automaton.check_addable(["a", "c"], "d")
+            assert 0
+        except Exception as e:
+            self.assertEqual(str(e), "c is defined so you can't add d")
@@ -1,12 +1,18 @@
 #!/usr/bin/env python
 
 from dogpile.cache.api import NO_VALUE
+from http.server import BaseHTTPRequestHandler, HTTPServer
 from io import StringIO
 from lxml import etree
 import mock
+import os
+import shutil
+import tempfile
+import threading
+import time
 from unittest import TestCase
 
-from xmltool import cache, dtd
+from xmltool import cache, dtd, dtd_parser
 from xmltool.elements import (
     TextElement,
     Element,
@@ -89,6 +95,16 @@ class TestDTD(TestCase):
         self.assertTrue(issubclass(dic["Exercise"], Element))
         self.assertTrue(issubclass(dic["question"], TextElement))
 
+    def test_parse_lazy(self):
+        dtd_str = """
+            <!ELEMENT Exercise (question)>
+            <!ELEMENT question (#PCDATA)>
+        """
+        dic = dtd.DTD(StringIO(dtd_str), lazy=True).parse()
+        self.assertTrue(isinstance(dic, dtd_parser.LazyClassDict))
+        self.assertEqual(sorted(dic.keys()), sorted(["question", "Exercise"]))
+        self.assertEqual(dic["Exercise"].children_classes[0].tagname, "question")
+
     def test_parse(self):
         dtd_str = """
             <!ELEMENT Exercise (question)>
@@ -131,3 +147,250 @@ class TestDTD(TestCase):
             assert 0
         except etree.DocumentInvalid:
             pass
+
+    def test_get_validator(self):
+        dtd.clear_validators()
+        dtd_obj = dtd.DTD(StringIO(EXERCISE_DTD))
+        validator = dtd_obj.get_validator()
+        self.assertTrue(isinstance(validator, etree.DTD))
+
+        # The dtd is neither compiled nor parsed again
+        with mock.patch("xmltool.dtd.compile_validator") as m:
+            dtd_obj._parsed_dict = None
+            self.assertEqual(dtd.DTD(StringIO(EXERCISE_DTD)).get_validator(), validator)
+            dtd_obj.validate_xml(etree.fromstring(EXERCISE_XML))
+            self.assertEqual(m.call_count, 0)
+            self.assertEqual(dtd_obj._parsed_dict, None)
+
+        self.assertEqual(dtd.get_validator(EXERCISE_DTD), validator)
+
+        # The invalid dtds are not cached
+        dtd_obj._content = (
+            "<!ELEMENT tag1 (subtag)>"
+            "<!ATTLIST tag1 id1 ID #IMPLIED>"
+            "<!ATTLIST tag1 id2 ID #IMPLIED>"
+        )
+        self.assertRaises(dtd.ValidationError, dtd_obj.get_validator)
+        self.assertRaises(dtd.ValidationError, dtd_obj.get_validator)
+        self.assertEqual(len(dtd._get_validators()), 1)
+
+    def test_get_validator_max_size(self):
+        dtd.clear_validators()
+        with mock.patch("xmltool.dtd.VALIDATORS_MAX_SIZE", 2):
+            for i in range(3):
+                dtd.get_validator("<!ELEMENT tag%s (#PCDATA)>" % i)
+            self.assertEqual(len(dtd._get_validators()), 2)
+            first = dtd.get_validator("<!ELEMENT tag1 (#PCDATA)>")
+            dtd.get_validator("<!ELEMENT tag3 (#PCDATA)>")
+            # tag1 was the last used so tag2 has been removed
+            self.assertEqual(dtd.get_validator("<!ELEMENT tag1 (#PCDATA)>"), first)
+            self.assertEqual(len(dtd._get_validators()), 2)
+
+    def test_get_validator_threads(self):
+        validator = dtd.get_validator(EXERCISE_DTD)
+        results = []
+
+        def target():
+            results.append(dtd.get_validator(EXERCISE_DTD))
+            results.append(dtd.get_validator(EXERCISE_DTD))
+
+        thread = threading.Thread(target=target)
+        thread.start()
+        thread.join()
+        # The validators are not shared between the threads
+        self.assertTrue(results[0] is results[1])
+        self.assertTrue(results[0] is not validator)
+
+        # The validators of all the threads are cleared
+        dtd.clear_validators()
+        self.assertEqual(len(dtd._get_validators()), 0)
+        self.assertTrue(dtd.get_validator(EXERCISE_DTD) is not validator)
+
+    def test_compile_validator(self):
+        validator = dtd.compile_validator(EXERCISE_DTD)
+        self.assertTrue(validator.validate(etree.fromstring(EXERCISE_XML)))
+        self.assertFalse(validator.validate(etree.fromstring(INVALID_EXERCISE_XML)))
+
+        self.assertRaises(etree.DTDParseError, dtd.compile_validator, "Invalid")
+        self.assertRaises(
+            dtd.ValidationError,
+            dtd.compile_validator,
+            "<!ELEMENT tag1 (#PCDATA)><!ELEMENT tag1 (#PCDATA)>",
+        )
+
+        # The dtd is compiled in memory
+        with mock.patch("tempfile.mkstemp") as m:
+            dtd.compile_validator(EXERCISE_DTD)
+            self.assertEqual(m.call_count, 0)
+
+    def test_compile_validator_entities(self):
+        directory = tempfile.mkdtemp()
+        try:
+            with open(os.path.join(directory, "sub.ent"), "w") as f:
+                f.write("<!ELEMENT sub (#PCDATA)>")
+            content = '<!ENTITY % sub SYSTEM "sub.ent">' "%sub;" "<!ELEMENT root (sub)>"
+            validator = dtd.compile_validator(content, directory)
+            root = etree.fromstring("<root><sub>text</sub></root>")
+            self.assertTrue(validator.validate(root))
+            self.assertEqual(dtd.get_validator(content, directory).validate(root), True)
+        finally:
+            shutil.rmtree(directory)
+
+    def test__get_entities_path(self):
+        dtd_obj = dtd.DTD("exercise.dtd", path="tests/")
+        self.assertEqual(dtd_obj._get_entities_path(), "tests")
+        dtd_obj = dtd.DTD("http://localhost/exercise.dtd", path="tests/")
+        self.assertEqual(dtd_obj._get_entities_path(), "tests/")
+        dtd_obj = dtd.DTD(StringIO(EXERCISE_DTD), path="tests/")
+        self.assertEqual(dtd_obj._get_entities_path(), "tests/")
+
+    def test_parse_cache_relative_url(self):
+        # The same relative url in two directories gives two dtds
+        directories = [tempfile.mkdtemp() for i in range(2)]
+        try:
+            for directory, tagname in zip(directories, ["a", "b"]):
+                with open(os.path.join(directory, "x.dtd"), "w") as f:
+                    f.write("<!ELEMENT %s (#PCDATA)>" % tagname)
+            with mock.patch("xmltool.cache.CACHE_TIMEOUT", 3600):
+                dics = [dtd.DTD("x.dtd", path=d).parse() for d in directories]
+        finally:
+            for directory in directories:
+                shutil.rmtree(directory)
+        self.assertEqual(list(dics[0]), ["a"])
+        self.assertEqual(list(dics[1]), ["b"])
+
+    def test_parse_single_flight(self):
+        calls = []
+        event = threading.Event()
+
+        def slow_parse(self):
+            calls.append(self)
+            event.wait(1)
+            return {"tag": None}
+
+        results = []
+        with mock.patch("xmltool.cache.CACHE_TIMEOUT", 3600), mock.patch(
+            "xmltool.dtd.DTD._parse", slow_parse
+        ), mock.patch("xmltool.dtd.DTD.get_validator"):
+            cache.region.delete("xmltool.parse.single-flight.dtd")
+            cache.region.set("xmltool.get_dtd_content.single-flight.dtd", "content")
+            threads = [
+                threading.Thread(
+                    target=lambda: results.append(dtd.DTD("single-flight.dtd").parse())
+                )
+                for i in range(5)
+            ]
+            for thread in threads:
+                thread.start()
+            time.sleep(0.1)
+            event.set()
+            for thread in threads:
+                thread.join()
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(results, [{"tag": None}] * 5)
+
+    def test_validate_and_parse_threads(self):
+        # The content is fetched slowly so a thread validates the dtd while
+        # the other parses it
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                time.sleep(0.3)
+                self.send_response(200)
+                self.end_headers()
+                self.wfile.write(EXERCISE_DTD.encode("utf-8"))
+
+            def log_message(self, *args):
+                pass
+
+        server = HTTPServer(("127.0.0.1", 0), Handler)
+        server_thread = threading.Thread(target=server.serve_forever)
+        server_thread.start()
+        url = "http://127.0.0.1:%s/exercise.dtd" % server.server_port
+        results = []
+        try:
+            with mock.patch("xmltool.cache.CACHE_TIMEOUT", 3600):
+                threads = [
+                    threading.Thread(
+                        target=lambda: results.append(dtd.DTD(url).validate())
+                    ),
+                    threading.Thread(
+                        target=lambda: results.append(dtd.DTD(url).parse())
+                    ),
+                ]
+                for thread in threads:
+                    thread.daemon = True
+                    thread.start()
+                    time.sleep(0.1)
+                for thread in threads:
+                    thread.join(5)
+                self.assertEqual([thread.is_alive() for thread in threads], [False] * 2)
+        finally:
+            server.shutdown()
+            server.server_close()
+            server_thread.join()
+        self.assertEqual(len(results), 2)
+
+    def test_parse_serve_stale(self):
+        dtd_obj = dtd.DTD("stale.dtd")
+        cache.configure(serve_stale=True)
+        try:
+            with mock.patch("xmltool.cache.CACHE_TIMEOUT", 3600), mock.patch(
+                "xmltool.dtd.DTD.get_validator"
+            ):
+                cache.region.set("xmltool.parse.stale.dtd", "old")
+                cache.region.invalidate(hard=False)
+                cache.region.set("xmltool.get_dtd_content.stale.dtd", "content")
+                event = threading.Event()
+                with mock.patch(
+                    "xmltool.dtd.DTD._parse", lambda self: event.wait(1) and "new"
+                ):
+                    # The expired value is given while it's refreshed in a
+                    # thread
+                    self.assertEqual(dtd_obj.parse(), "old")
+                    event.set()
+                    for i in range(100):
+                        value = cache.region.get("xmltool.parse.stale.dtd")
+                        if value == "new":
+                            break
+                        time.sleep(0.01)
+                    self.assertEqual(value, "new")
+        finally:
+            cache.configure()
+
+    def test_memoized(self):
+        # The memoization is only used without cache timeout
+        with mock.patch("xmltool.cache.CACHE_TIMEOUT", None):
+            dtd.clear_memoized()
+            directory = tempfile.mkdtemp()
+            try:
+                filename = os.path.join(directory, "memo.dtd")
+                with open(filename, "w") as f:
+                    f.write("<!ELEMENT tag (#PCDATA)>")
+                dic = dtd.DTD(filename).parse()
+                self.assertEqual(list(dic), ["tag"])
+
+                # The file is neither read nor parsed again
+                with mock.patch("xmltool.dtd.DTD._fetch") as m_fetch, mock.patch(
+                    "xmltool.dtd.DTD._parse"
+                ) as m_parse:
+                    self.assertTrue(dtd.DTD(filename).parse() is dic)
+                    self.assertEqual(m_fetch.call_count, 0)
+                    self.assertEqual(m_parse.call_count, 0)
+
+                # The lazy classes are memoized separately
+                lazy = dtd.DTD(filename, lazy=True).parse()
+                self.assertTrue(isinstance(lazy, dtd_parser.LazyClassDict))
+
+                # A modified file is read again
+                with open(filename, "w") as f:
+                    f.write("<!ELEMENT tag2 (#PCDATA)>")
+                stat = os.stat(filename)
+                os.utime(filename, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+                self.assertEqual(list(dtd.DTD(filename).parse()), ["tag2"])
+
+                # The dtd given as string are memoized by content
+                dic = dtd.DTD(StringIO(EXERCISE_DTD)).parse()
+                self.assertTrue(dtd.DTD(StringIO(EXERCISE_DTD)).parse() is dic)
+            finally:
+                shutil.rmtree(directory)
+                dtd.clear_memoized()
@@ -1,5 +1,8 @@
 #!/usr/bin/env python
 
+import mock
+import threading
+from types import MappingProxyType
 from unittest import TestCase
 from xmltool import dtd_parser
 from xmltool.elements import (
@@ -271,6 +274,15 @@ class DtdParser(TestCase):
         expected = ("Movie", "name,year,directors,actors,resume?,critique*")
         self.assertEqual(dtd_parser.parse_element(element), expected)
 
+    def test_parse_element_occurrence(self):
+        element = "Movie (name|year)*"
+        expected = ("Movie", "(name|year)*")
+        self.assertEqual(dtd_parser.parse_element(element), expected)
+
+        element = "p (#PCDATA|b)* "
+        expected = ("p", "(#PCDATA|b)*")
+        self.assertEqual(dtd_parser.parse_element(element), expected)
+
     def test_parse_element_exception(self):
         element = "Movie (name,year,directors,actors,resume?,critique*"
         try:
@@ -385,6 +397,77 @@ class DtdParser(TestCase):
         dic = dtd_parser.dtd_to_dict_v2(EXERCISE_DTD_2)
         self.assertEqual(dic, expected)
 
+    def test_iter_declarations(self):
+        dtd_str = """
+            <!-- <!ELEMENT fake (skipme+)> -->
+            <!ENTITY % greater "a>b">
+            <!ELEMENT tag (#PCDATA)>
+            <!ATTLIST tag value CDATA '>'>
+        """
+        lis = list(dtd_parser.iter_declarations(dtd_str))
+        expected = [
+            ("ENTITY", ' % greater "a>b"'),
+            ("ELEMENT", " tag (#PCDATA)"),
+            ("ATTLIST", " tag value CDATA '>'"),
+        ]
+        self.assertEqual(lis, expected)
+
+    def test_iter_declarations_unterminated(self):
+        dtd_str = open("tests/exercise.dtd").read()
+        # Truncated in the last declaration
+        dtd_str = dtd_str[: dtd_str.rindex("#IMPLIED") + 6]
+        dic = dtd_parser.dtd_to_dict_v2(dtd_str)
+        self.assertEqual(dic["choice"], {"elts": "#PCDATA", "attrs": []})
+        self.assertEqual(dic["question"]["attrs"], [("idquestion", "ID", "#IMPLIED")])
+
+        for dtd_str in [
+            "<!ELEMENT " + "a" * 10000,
+            '<!ATTLIST a b "x" ' * 1000,
+            "<!-- " * 1000,
+            '<!ATTLIST "' * 1000,
+        ]:
+            self.assertEqual(list(dtd_parser.iter_declarations(dtd_str)), [])
+        lis = list(dtd_parser.iter_declarations("<!a <!ELEMENT b (#PCDATA)>"))
+        self.assertEqual(lis, [("ELEMENT", " b (#PCDATA)")])
+
+    def test_dtd_to_dict_quoted_entity(self):
+        dtd_str = """
+            <!ENTITY % content 'sub1,sub2'>
+            <!ENTITY % greater "a>b">
+            <!ELEMENT tag (%content;)>
+        """
+        dic = dtd_parser.dtd_to_dict_v2(dtd_str)
+        self.assertEqual(dic, {"tag": {"elts": "sub1,sub2", "attrs": []}})
+
+    def test_entity_resolver(self):
+        resolver = dtd_parser.EntityResolver(
+            {"%person": "name,%names;", "%names": "firstname*", "%loop": "%loop;"}
+        )
+        self.assertEqual(resolver.resolve("%person"), "name,firstname*")
+        self.assertEqual(
+            resolver.expand("(%person;),%unknown;"), "(name,firstname*),%unknown;"
+        )
+        self.assertEqual(resolver.expand("name"), "name")
+        try:
+            resolver.resolve("%loop")
+            assert 0
+        except Exception as e:
+            self.assertEqual(str(e), "Recursive entity %loop")
+
+    def test_dtd_to_dict_nested_entities(self):
+        dtd_str = """
+            <!ENTITY % names "firstname, lastname">
+            <!ENTITY % person "%names;, age?">
+            <!ELEMENT actor (%person;)>
+            <!ELEMENT director (%person;)>
+        """
+        dic = dtd_parser.dtd_to_dict_v2(dtd_str)
+        expected = {
+            "actor": {"elts": "firstname,lastname,age?", "attrs": []},
+            "director": {"elts": "firstname,lastname,age?", "attrs": []},
+        }
+        self.assertEqual(dic, expected)
+
     def test_parse_dtd_to_dict_exception(self):
         dtd = "<!PLOP Movie (name, year, directors, actors, resume?, critique*)>"
         self.assertRaises(Exception, dtd_parser.dtd_to_dict_v2, dtd)
@@ -438,6 +521,45 @@ class DtdParser(TestCase):
         ]
         self.assertEqual(lis, expected)
 
+    def test__parse_elts_nested(self):
+        lis = dtd_parser._parse_elts("a,(b|c)+,d?")
+        expected = [
+            ("a", True, False, []),
+            ("b_c", True, True, [("b", True, False, []), ("c", True, False, [])]),
+            ("d", False, False, []),
+        ]
+        self.assertEqual(lis, expected)
+
+        lis = dtd_parser._parse_elts("a,(b,c)?")
+        expected = [
+            ("a", True, False, []),
+            ("b", False, False, []),
+            ("c", False, False, []),
+        ]
+        self.assertEqual(lis, expected)
+
+    def test__create_classes_nested(self):
+        dtd_str = """
+            <!ELEMENT tag (a,(b|c)+,d?)>
+            <!ELEMENT p (#PCDATA|a)*>
+            <!ELEMENT a (#PCDATA)>
+            <!ELEMENT b (#PCDATA)>
+            <!ELEMENT c (#PCDATA)>
+            <!ELEMENT d (#PCDATA)>
+        """
+        dic = dtd_parser._create_classes(dtd_parser.dtd_to_dict_v2(dtd_str))
+        tag = dic["tag"]
+        self.assertEqual(len(tag.children_classes), 3)
+        self.assertTrue(issubclass(tag.children_classes[1], ChoiceListElement))
+        self.assertTrue(tag._automaton.accepts(["a", "c", "b", "d"]))
+        self.assertFalse(tag._automaton.accepts(["a", "d"]))
+        self.assertEqual(tag._automaton.required, set(["a"]))
+
+        p = dic["p"]
+        self.assertTrue(issubclass(p, TextElement))
+        self.assertEqual(len(p.children_classes), 1)
+        self.assertEqual(p.children_classes[0]._required, False)
+
     def test__create_class_dict(self):
         dtd_dict = {
             "tag": {"elts": "#PCDATA", "attrs": [("idtag", "ID", "#IMPLIED")]},
@@ -448,8 +570,8 @@ class DtdParser(TestCase):
         self.assertTrue(issubclass(tag, TextElement))
         self.assertEqual(tag.tagname, "tag")
         self.assertEqual(tag._is_empty, False)
-        self.assertEqual(tag._attribute_names, ["idtag"])
-        self.assertEqual(tag.children_classes, [])
+        self.assertEqual(tag._attribute_names, ("idtag",))
+        self.assertEqual(tag.children_classes, ())
 
         dtd_dict = {
             "tag": {"elts": "(#PCDATA|tag1|tag2)*", "attrs": []},
@@ -460,10 +582,13 @@ class DtdParser(TestCase):
         self.assertTrue(issubclass(tag, TextElement))
         self.assertEqual(tag.tagname, "tag")
         self.assertEqual(tag._is_empty, False)
-        self.assertEqual(tag._attribute_names, [])
-        self.assertEqual(tag.children_classes, [])
-        # dtd_dict has changed because of the mixed content
-        self.assertEqual(dtd_dict, {"tag": {"elts": "tag1?,tag2?", "attrs": []}})
+        self.assertEqual(tag._attribute_names, ())
+        self.assertEqual(tag.children_classes, ())
+        self.assertEqual(tag._automaton.alphabet, set(["tag1", "tag2"]))
+        # dtd_dict is not modified by the mixed content
+        self.assertEqual(
+            dtd_dict, {"tag": {"elts": "(#PCDATA|tag1|tag2)*", "attrs": []}}
+        )
 
         dtd_dict = {
             "tag": {"elts": "(tag1)*", "attrs": []},
@@ -474,8 +599,8 @@ class DtdParser(TestCase):
         self.assertTrue(issubclass(tag, Element))
         self.assertEqual(tag.tagname, "tag")
         self.assertEqual(tag._is_empty, False)
-        self.assertEqual(tag._attribute_names, [])
-        self.assertEqual(tag.children_classes, [])
+        self.assertEqual(tag._attribute_names, ())
+        self.assertEqual(tag.children_classes, ())
 
         dtd_dict = {
             "tag": {"elts": "(tag1|tag2)", "attrs": []},
@@ -486,8 +611,8 @@ class DtdParser(TestCase):
         self.assertTrue(issubclass(tag, Element))
         self.assertEqual(tag.tagname, "tag")
         self.assertEqual(tag._is_empty, False)
-        self.assertEqual(tag._attribute_names, [])
-        self.assertEqual(tag.children_classes, [])
+        self.assertEqual(tag._attribute_names, ())
+        self.assertEqual(tag.children_classes, ())
 
         dtd_dict = {
             "tag": {"elts": "EMPTY", "attrs": []},
@@ -498,7 +623,7 @@ class DtdParser(TestCase):
         self.assertTrue(issubclass(tag, TextElement))
         self.assertEqual(tag.tagname, "tag")
         self.assertEqual(tag._is_empty, True)
-        self.assertEqual(tag.children_classes, [])
+        self.assertEqual(tag.children_classes, ())
 
     def test__create_new_class(self):
         dtd_dict = {
@@ -598,7 +723,7 @@ class DtdParser(TestCase):
         tag = class_dict["tag"]
         self.assertEqual(tag.__name__, "tag")
         self.assertEqual(tag._required, False)
-        self.assertEqual(tag.children_classes, [])
+        self.assertEqual(tag.children_classes, ())
 
         dtd_dict = {
             "tag": {"elts": "subtag", "attrs": []},
@@ -615,5 +740,113 @@ class DtdParser(TestCase):
         self.assertEqual(tag._required, False)
         self.assertEqual(subtag.__name__, "subtag")
         self.assertEqual(subtag._required, True)
-        self.assertEqual(subtag.children_classes, [])
+        self.assertEqual(subtag.children_classes, ())
         self.assertEqual(subtag._parent_cls, tag)
+
+    def test_lazy_class_dict(self):
+        dtd_dict = dtd_parser.dtd_to_dict_v2(MOVIE_DTD)
+        dic = dtd_parser.LazyClassDict(dtd_dict=dtd_dict)
+        self.assertEqual(len(dic), 11)
+        self.assertEqual(sorted(dic), sorted(dtd_dict))
+        self.assertTrue("Movie" in dic)
+        self.assertFalse("unknown" in dic)
+        self.assertEqual(dic._classes, {})
+
+        movie = dic["Movie"]
+        self.assertTrue(dic["Movie"] is movie)
+        self.assertEqual(list(dic._classes), ["Movie"])
+        # The children are created when we read them
+        children = movie.children_classes
+        self.assertTrue(movie.children_classes is children)
+        self.assertEqual(
+            sorted(dic._classes),
+            sorted(
+                [
+                    "Movie",
+                    "is-publish",
+                    "name",
+                    "year",
+                    "directors",
+                    "actors",
+                    "resume",
+                    "critique",
+                ]
+            ),
+        )
+        # The sub classes of the base classes get the children classes
+        directors = children[3]
+        self.assertEqual(directors.tagname, "directors")
+        self.assertEqual(len(directors.children_classes), 1)
+        self.assertTrue(dic["directors"].children_classes is directors.children_classes)
+
+        expected = dtd_parser._create_classes(dtd_dict)
+        for tagname, cls in expected.items():
+            self.assertEqual(
+                [c.tagname for c in cls.children_classes],
+                [c.tagname for c in dic[tagname].children_classes],
+            )
+
+        schema = dtd_parser.dtd_dict_to_schema(dtd_dict)
+        dic = dtd_parser.LazyClassDict(schema=schema)
+        self.assertEqual(len(dic["actors"].children_classes), 1)
+
+    def test_lazy_class_dict_threads(self):
+        dtd_dict = dtd_parser.dtd_to_dict_v2(MOVIE_DTD)
+        dic = dtd_parser.LazyClassDict(dtd_dict=dtd_dict)
+        barrier = threading.Barrier(8)
+        results = []
+
+        def target():
+            barrier.wait()
+            results.append((dic["Movie"], dic["Movie"].children_classes))
+
+        threads = [threading.Thread(target=target) for i in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        # All the threads see the same complete classes
+        self.assertEqual(len(results), 8)
+        for cls, children in results:
+            self.assertTrue(cls is results[0][0])
+            self.assertTrue(children is results[0][1])
+            self.assertTrue(isinstance(children, tuple))
+
+    def test_creatable_subclasses(self):
+        dic = dtd_parser._create_classes(dtd_parser.dtd_to_dict_v2(MOVIE_DTD))
+        lazy_dic = dtd_parser.LazyClassDict(dtd_parser.dtd_to_dict_v2(MOVIE_DTD))
+        for d in [dic, lazy_dic]:
+            cls = d["Movie"]
+            # Created with the children classes
+            cls.children_classes
+            table = cls.__dict__["_creatable_subclasses"]
+            self.assertTrue(isinstance(table, MappingProxyType))
+            self.assertEqual(dict(table), cls._get_creatable_subclass_by_tagnames())
+            with self.assertRaises(TypeError):
+                table["name"] = None
+
+            directors = cls.get_class_to_create("directors")
+            lis = directors.get_class_to_create("director")._parent_cls
+            self.assertEqual(
+                dict(lis._creatable_subclasses), {"director": lis._children_class}
+            )
+            with mock.patch.object(Element, "_get_creatable_subclass_by_tagnames") as m:
+                self.assertEqual(
+                    cls.get_class_to_create("critique"),
+                    cls._creatable_subclasses["critique"],
+                )
+                self.assertEqual(m.call_count, 0)
+
+        dic = dtd_parser._create_classes(dtd_parser.dtd_to_dict_v2(EXERCISE_DTD))
+        choice = dic["test"].children_classes[0]
+        self.assertEqual(sorted(choice._creatable_subclasses), ["mqm", "qcm"])
+
+    def test_create_classes_frozen(self):
+        dic = dtd_parser._create_classes(dtd_parser.dtd_to_dict_v2(EXERCISE_DTD))
+        for cls in dic.values():
+            self.assertTrue(isinstance(cls.children_classes, tuple))
+            self.assertTrue(isinstance(cls._attribute_names, tuple))
+        choice = dic["test"].children_classes[0]
+        self.assertTrue(isinstance(choice._choice_classes, tuple))
+        for cls in choice._choice_classes:
+            self.assertTrue(cls._parent_cls is choice)
@@ -17,6 +17,8 @@ from xmltool.elements import (
     InChoiceMixin,
 )
 import xmltool.elements as elements
+from xmltool import content_model
+from xmltool.content_model import ContentModelAutomaton
 from .test_dtd_parser import (
     BOOK_XML,
     BOOK_DTD,
@@ -166,6 +168,45 @@ class TestElement(BaseTest):
         res = obj.is_addable("subtag")
         self.assertEqual(res, False)
 
+    def test_is_addable_content_model(self):
+        other_cls = type(
+            "OtherCls",
+            (ContainerElement,),
+            {"tagname": "other", "children_classes": []},
+        )
+        self.cls.children_classes = [self.sub_cls, other_cls]
+        self.cls._automaton = ContentModelAutomaton.compile(
+            content_model.parse("(subtag|other)")
+        )
+        obj = self.cls()
+        self.assertEqual(obj.is_addable("other"), True)
+        obj.add("subtag")
+        self.assertEqual(obj.is_addable("other"), False)
+        try:
+            obj.add("other")
+            assert 0
+        except Exception as e:
+            self.assertEqual(str(e), "subtag is defined so you can't add other")
+
+    def test_required_tagnames(self):
+        self.assertEqual(self.cls.required_tagnames(), set())
+        self.sub_cls._required = True
+        self.assertEqual(self.cls.required_tagnames(), set(["subtag"]))
+
+        dic = dtd.DTD(StringIO(MOVIE_DTD)).parse()
+        self.assertEqual(
+            dic["Movie"].required_tagnames(),
+            set(["name", "year", "directors", "actors"]),
+        )
+
+    def test_has_valid_children(self):
+        self.assertTrue(self.cls().has_valid_children())
+        dic = dtd.DTD(StringIO(MOVIE_DTD)).parse()
+        obj = dic["directors"]()
+        self.assertFalse(obj.has_valid_children())
+        obj.add("director")
+        self.assertTrue(obj.has_valid_children())
+
     def test_add(self):
         root_cls = type(
             "RootElement",
@@ -532,6 +573,175 @@ class TestElement(BaseTest):
                 os.remove(filename)
 
 
+class TestAttach(BaseTest):
+    def test__attach(self):
+        dic = dtd.DTD(StringIO(MOVIE_DTD)).parse()
+        movie = dic["Movie"]()
+        name = dic["Movie"].get_class_to_create("name")._attach(movie)
+        self.assertEqual(movie["name"], name)
+        self.assertEqual(name.parent, movie)
+
+        directors = movie.add("directors")
+        cls = dic["directors"].get_class_to_create("director")
+        director1 = cls._attach(directors)
+        director2 = cls._attach(directors)
+        self.assertEqual(list(directors["director"]), [director1, director2])
+        self.assertEqual(director1.parent, directors)
+        self.assertEqual(director1._parent_obj, directors["director"])
+
+    def test__attach_choice(self):
+        dtd_str = """
+        <!ELEMENT root (a|b)>
+        <!ELEMENT a (#PCDATA)>
+        <!ELEMENT b (#PCDATA)>
+        """
+        dic = dtd.DTD(StringIO(dtd_str)).parse()
+        root = dic["root"]()
+        b = dic["root"].get_class_to_create("b")._attach(root)
+        self.assertEqual(root["b"], b)
+        self.assertEqual(b.parent, root)
+        self.assertEqual(list(root.children), [b])
+        self.assertEqual(b._parent_obj._value, b)
+
+    def test__get_skeleton(self):
+        def tagnames(skeleton):
+            return [(cls.tagname, tagnames(sub)) for cls, sub in skeleton]
+
+        dic = dtd.DTD(StringIO(MOVIE_DTD)).parse()
+        skeleton = dic["Movie"]._get_skeleton()
+        self.assertEqual(
+            tagnames(skeleton),
+            [
+                ("name", []),
+                ("year", []),
+                ("directors", [("director", [("name", []), ("firstname", [])])]),
+                ("actors", [("actor", [("name", []), ("firstname", [])])]),
+            ],
+        )
+        self.assertTrue(dic["Movie"]._get_skeleton() is skeleton)
+
+        # The choices are not created
+        dic = dtd.DTD(StringIO(EXERCISE_DTD)).parse()
+        self.assertEqual(
+            tagnames(dic["Exercise"]._get_skeleton()),
+            [("question", []), ("test", [])],
+        )
+
+        dtd_str = """
+        <!ELEMENT a (b)>
+        <!ELEMENT b (a)>
+        """
+        dic = dtd.DTD(StringIO(dtd_str)).parse()
+        self.assertEqual(tagnames(dic["a"]._get_skeleton()), [("b", [])])
+        # The skeleton of b doesn't depend on the one of a
+        self.assertEqual(tagnames(dic["b"]._get_skeleton()), [("a", [])])
+        # The classes are not modified
+        self.assertFalse("_skeleton" in dic["a"].__dict__)
+
+    def test__add_skeleton(self):
+        dic = dtd.DTD(StringIO(MOVIE_DTD)).parse()
+        obj = dic["Movie"]()
+        obj._add_skeleton()
+        self.assertEqual(
+            [o.tagname for o in obj.walk()],
+            [
+                "name",
+                "year",
+                "directors",
+                "director",
+                "name",
+                "firstname",
+                "actors",
+                "actor",
+                "name",
+                "firstname",
+            ],
+        )
+        self.assertEqual([o._auto_added for o in obj.walk()], [False] * 10)
+
+
+class TestClone(BaseTest):
+    def setUp(self):
+        self.dic = dtd.DTD(StringIO(MOVIE_DTD)).parse()
+        self.movie = self.dic["Movie"]()
+        self.movie.load_from_xml(etree.fromstring(MOVIE_XML_TITANIC_COMMENTS))
+        self.movie.dtd_url = "movie.dtd"
+        self.movie.encoding = "UTF-8"
+
+    def test_clone(self):
+        obj = self.movie.clone()
+        self.assertEqual(str(obj), str(self.movie))
+        self.assertEqual(obj.dtd_url, "movie.dtd")
+        self.assertEqual(obj.encoding, "UTF-8")
+        self.assertEqual(obj.comment, " Movie comment ")
+        self.assertEqual(obj.root, obj)
+        actor = obj["actors"]["actor"][1]
+        self.assertEqual(actor.root, obj)
+        self.assertEqual(actor.parent, obj["actors"])
+        self.assertEqual(actor._parent_obj, obj["actors"]["actor"])
+        self.assertEqual(actor.comment, " actor 2 comment ")
+        self.assertEqual(getattr(actor, "_lxml_elt", None), None)
+
+        # The copy is independent
+        actor["name"].text = "Kate"
+        self.assertEqual(self.movie["actors"]["actor"][1]["name"].text, "Winslet")
+
+        name = self.movie["actors"]["actor"][0]["name"].clone()
+        self.assertEqual(name.text, "DiCaprio")
+        self.assertEqual(name.parent, None)
+        self.assertEqual(name.dtd_url, None)
+
+        self.assertRaises(Exception, self.movie["actors"]["actor"].clone)
+
+    def test_clone_into(self):
+        obj = self.dic["Movie"]()
+        name = self.movie["name"].clone_into(obj)
+        self.assertEqual(obj["name"], name)
+        self.assertEqual(name.text, "Titanic")
+        self.assertEqual(name.comment, " name comment ")
+        try:
+            self.movie["name"].clone_into(obj)
+            assert 0
+        except Exception as e:
+            self.assertEqual(str(e), "name is already defined")
+
+        actors = obj.add("actors")
+        actor = self.movie["actors"]["actor"][2].clone_into(actors)
+        self.assertEqual(actor.parent, actors)
+        self.assertEqual(list(actors["actor"]), [actor])
+        self.assertEqual(actor["firstname"].text, "Billy")
+
+        lis = self.movie["actors"]["actor"].clone_into(actors["actor"])
+        self.assertEqual(lis, actors["actor"])
+        self.assertEqual(
+            [a["name"].text for a in lis], ["Zane", "DiCaprio", "Winslet", "Zane"]
+        )
+
+        try:
+            self.movie["actors"].clone_into(self.movie["name"])
+            assert 0
+        except Exception as e:
+            self.assertEqual(str(e), "Invalid child actors")
+
+    def test_clone_choice(self):
+        dtd_str = """
+        <!ELEMENT root (a|b)>
+        <!ELEMENT a (#PCDATA)>
+        <!ELEMENT b (#PCDATA)>
+        """
+        dic = dtd.DTD(StringIO(dtd_str)).parse()
+        root = dic["root"]()
+        root.add("b", "value")
+        obj = root.clone()
+        self.assertEqual(obj["b"].text, "value")
+        self.assertEqual(obj["b"]._parent_obj._value, obj["b"])
+
+        obj = dic["root"]()
+        choice = root["b"]._parent_obj.clone_into(obj)
+        self.assertEqual(choice._value, obj["b"])
+        self.assertRaises(Exception, root["b"]._parent_obj.clone)
+
+
 class TestContainerElement(BaseTest):
     def setUp(self):
         self.sub_cls = type(
@@ -1162,3 +1372,28 @@ class TestFunctions(BaseTest):
 
         res = update_eol("Hello\r")
         self.assertEqual(res, "Hello\r\n")
+
+    def test__iter_children_xml(self):
+        xml = etree.Element("test")
+        self.assertEqual(list(elements._iter_children_xml(xml)), [])
+
+        subs = []
+        for i in range(7):
+            if i in [1, 4]:
+                elt = etree.Element("sub")
+                subs.append(elt)
+            else:
+                elt = etree.Comment("comment %i" % i)
+            xml.append(elt)
+        self.assertEqual(
+            list(elements._iter_children_xml(xml)),
+            [
+                (subs[0], ["comment 0"]),
+                (subs[1], ["comment 2", "comment 3", "comment 5", "comment 6"]),
+            ],
+        )
+        # Same comments as _load_comment_from_xml
+        for sub, comments in elements._iter_children_xml(xml):
+            obj = TextElement()
+            obj._load_comment_from_xml(sub)
+            self.assertEqual(obj.comment, "\n".join(comments))
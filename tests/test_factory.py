@@ -1,8 +1,16 @@
 #!/usr/bin/env python
 
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from io import BytesIO
+import mmap
+import mock
+import os
+import shutil
+import tempfile
+import threading
 from xmltool.testbase import BaseTest
 from lxml import etree
-from xmltool import factory
+from xmltool import elements, factory
 
 
 class TestFactory(BaseTest):
@@ -10,6 +18,15 @@ class TestFactory(BaseTest):
         obj = factory.create("Exercise", dtd_url="tests/exercise.dtd")
         self.assertEqual(obj.tagname, "Exercise")
 
+    def test_create_skeleton(self):
+        obj = factory.create("Exercise", dtd_url="tests/exercise.dtd", skeleton=True)
+        self.assertEqual(obj["number"].text, None)
+        self.assertEqual(obj.dtd_url, "tests/exercise.dtd")
+        expected = factory.create("Exercise", dtd_url="tests/exercise.dtd")
+        self.assertEqual(str(obj), str(expected))
+        # The rendering doesn't delete the skeleton
+        self.assertTrue("number" in obj)
+
     def test_load(self):
         obj = factory.load("tests/exercise.xml")
         self.assertEqual(obj.tagname, "Exercise")
@@ -31,6 +48,147 @@ class TestFactory(BaseTest):
         obj = factory.load("tests/exercise-notvalid.xml", validate=False)
         self.assertEqual(obj.tagname, "Exercise")
 
+    def test_load_trusted(self):
+        expected = factory.load("tests/exercise.xml", validate=False)
+        self.assertEqual(expected._trusted_xml, False)
+        with mock.patch(
+            "xmltool.elements.Element.add", side_effect=Exception
+        ), mock.patch("xmltool.elements.Element.add_attribute", side_effect=Exception):
+            obj = factory.load("tests/exercise.xml")
+        self.assertEqual(obj._trusted_xml, True)
+        self.assertEqual(obj.attributes, {"idexercise": "E1"})
+        self.assertEqual(str(obj), str(expected))
+        self.assertEqual(
+            [(o.tagname, o.sourceline) for o in obj.walk()],
+            [(o.tagname, o.sourceline) for o in expected.walk()],
+        )
+        self.assertEqual(
+            obj["test"][1]["comments"]["comment"][1].parent,
+            obj["test"][1]["comments"],
+        )
+
+        with mock.patch("xmltool.elements.Element.add", side_effect=Exception):
+            obj = factory.load("tests/exercise.xml", lazy_xml=True)
+            self.assertEqual(str(obj), str(expected))
+
+    def _load_with_dtd(self, dtd_str, xml_str, **kw):
+        directory = tempfile.mkdtemp()
+        try:
+            with open(os.path.join(directory, "x.dtd"), "w") as f:
+                f.write(dtd_str)
+            filename = os.path.join(directory, "x.xml")
+            with open(filename, "w") as f:
+                f.write('<!DOCTYPE root SYSTEM "x.dtd">' + xml_str)
+            return factory.load(filename, **kw)
+        finally:
+            shutil.rmtree(directory)
+
+    def test_load_trusted_flattened(self):
+        # The XML is valid but doesn't fit in the objects: the first a is
+        # not lost
+        dtd_str = (
+            "<!ELEMENT root (a,b,a)>\n" "<!ELEMENT a (#PCDATA)>\n<!ELEMENT b (#PCDATA)>"
+        )
+        xml_str = "<root><a>1</a><b/><a>2</a></root>"
+        for validate in [True, False]:
+            try:
+                self._load_with_dtd(dtd_str, xml_str, validate=validate)
+                assert 0
+            except Exception as e:
+                self.assertEqual(str(e), "a is already defined")
+
+        dtd_str = (
+            "<!ELEMENT root (a|(b,c))>\n<!ELEMENT a (#PCDATA)>\n"
+            "<!ELEMENT b (#PCDATA)>\n<!ELEMENT c (#PCDATA)>"
+        )
+        xml_str = "<root><b/><c/></root>"
+        for validate in [True, False]:
+            try:
+                self._load_with_dtd(dtd_str, xml_str, validate=validate)
+                assert 0
+            except Exception as e:
+                self.assertEqual(str(e), "b is defined so you can't add c")
+
+        dtd_str = "<!ELEMENT root (a*)>\n<!ELEMENT a (#PCDATA)>"
+        obj = self._load_with_dtd(dtd_str, "<root><a>1</a><a>2</a></root>")
+        self.assertEqual([a.text for a in obj["a"]], ["1", "2"])
+        xml_str = "<root><a>1</a><?pi value?></root>"
+        for validate in [True, False]:
+            try:
+                self._load_with_dtd(dtd_str, xml_str, validate=validate)
+                assert 0
+            except Exception as e:
+                self.assertTrue(str(e).startswith("Invalid child"))
+
+    def test_load_cdata(self):
+        xml_str = open("tests/exercise.xml", "r").read()
+        xml_str = xml_str.replace("exercise.dtd", "tests/exercise.dtd")
+        xml_str = xml_str.replace(
+            "<comment>My comment 1</comment>",
+            '<comment idcomment="a>b">My <![CDATA[<b>comment</b>]]></comment>',
+        )
+        with mock.patch("xmltool.elements.etree.tostring") as tostring:
+            # The idcomment is not a valid ID
+            obj = factory.load_string(xml_str, validate=False)
+            self.assertEqual(tostring.call_count, 0)
+        comments = obj["test"][1]["comments"]["comment"]
+        self.assertEqual(comments[0].text, "My <b>comment</b>")
+        self.assertEqual(comments[0].cdata, True)
+        self.assertEqual(comments[1].cdata, True)
+        self.assertEqual(obj["test"][0]["question"].cdata, False)
+        self.assertEqual(
+            obj._cdata_lxml_elts, frozenset([c._lxml_elt for c in comments])
+        )
+
+        obj = factory.load("tests/exercise.xml")
+        self.assertEqual(len(obj._cdata_lxml_elts), 1)
+        # The source is not available
+        obj = factory.load_stream("tests/exercise.xml")
+        self.assertEqual(obj._cdata_lxml_elts, None)
+        comments = obj["test"][1]["comments"]["comment"]
+        self.assertEqual([c.cdata for c in comments], [False, True])
+
+        # expat doesn't support this encoding
+        obj = factory.load_string(
+            xml_str.replace("UTF-8", "Shift_JIS").encode("shift_jis"),
+            validate=False,
+        )
+        self.assertEqual(obj._cdata_lxml_elts, None)
+        comments = obj["test"][1]["comments"]["comment"]
+        self.assertEqual([c.cdata for c in comments], [True, True])
+
+        xml_str = xml_str.replace("<![CDATA[", "").replace("]]>", "")
+        obj = factory.load_string(xml_str, validate=False)
+        self.assertEqual(obj._cdata_lxml_elts, frozenset())
+
+    def test_load_comments(self):
+        xml_str = open("tests/exercise.xml", "r").read()
+        xml_str = xml_str.replace("exercise.dtd", "tests/exercise.dtd")
+        xml_str = xml_str.replace("<test ", "<!-- c1 --><!-- c2 --><test ", 1)
+        xml_str = xml_str.replace("</comments>", "</comments><!-- c3 --><!-- c4 -->", 1)
+        load_comment = elements.Element._load_comment_from_xml
+        with mock.patch(
+            "xmltool.elements.Element._load_comment_from_xml",
+            autospec=True,
+            side_effect=load_comment,
+        ) as m:
+            obj = factory.load_string(xml_str)
+            # The parents give the comments to their children, only the
+            # root looks at its siblings
+            self.assertEqual(m.call_count, 1)
+        self.assertEqual(obj["test"][0].comment, " c1 \n c2 ")
+        self.assertEqual(obj["test"][1].comment, None)
+        self.assertEqual(obj["test"][0]["comments"].comment, " c3 \n c4 ")
+        self.assertEqual(obj["test"][1]["question"].comment, None)
+
+    def test_load_lazy(self):
+        obj = factory.load("tests/exercise.xml", lazy=True)
+        expected = factory.load("tests/exercise.xml")
+        self.assertEqual(str(obj), str(expected))
+
+        obj = factory.create("Exercise", dtd_url="tests/exercise.dtd", lazy=True)
+        self.assertEqual(obj.tagname, "Exercise")
+
     def test_load_string(self):
         xml_str = open("tests/exercise.xml", "r").read()
         xml_str = xml_str.replace("exercise.dtd", "tests/exercise.dtd")
@@ -58,3 +216,308 @@ class TestFactory(BaseTest):
         xml_str = xml_str.replace("exercise.dtd", "tests/exercise.dtd")
         obj = factory.load_string(xml_str, validate=False)
         self.assertEqual(obj.tagname, "Exercise")
+
+    def test_load_stream(self):
+        obj = factory.load_stream("tests/exercise.xml")
+        expected = factory.load("tests/exercise.xml")
+        self.assertEqual(str(obj), str(expected))
+        self.assertEqual(obj.dtd_url, "exercise.dtd")
+        self.assertEqual(obj.encoding, "UTF-8")
+        self.assertEqual(obj.attributes, {"idexercise": "E1"})
+        # The lxml elements are not kept
+        self.assertEqual(getattr(obj["test"][0], "_lxml_elt", None), None)
+
+        with open("tests/exercise.xml", "rb") as f:
+            data = f.read().replace(b'"exercise.dtd"', b'"tests/exercise.dtd"')
+        for source in [data, bytearray(data), memoryview(data)]:
+            obj = factory.load_stream(source)
+            self.assertEqual(str(obj), str(expected))
+            self.assertEqual(obj.filename, None)
+        self.assertEqual(len(list(factory.iterload(data, "test"))), 2)
+
+        try:
+            factory.load_stream("tests/exercise-notvalid.xml")
+            assert 0
+        except etree.DocumentInvalid as e:
+            self.assertTrue(
+                str(e).startswith(
+                    "Element comments content does not follow the DTD, "
+                    "expecting (comment)+, got ()"
+                )
+            )
+        obj = factory.load_stream("tests/exercise-notvalid.xml", validate=False)
+        self.assertEqual(obj.tagname, "Exercise")
+
+    def test_load_stream_comments(self):
+        xml_str = open("tests/exercise.xml", "r").read()
+        xml_str = xml_str.replace("exercise.dtd", "tests/exercise.dtd")
+        xml_str = xml_str.replace("<Exercise ", "<!-- before -->\n<Exercise ").replace(
+            "</Exercise>", "<!-- last -->\n</Exercise>\n<!-- after -->"
+        )
+        xml_str = xml_str.replace("<test ", "<!-- test -->\n<test ")
+        obj = factory.load_stream(BytesIO(xml_str.encode("utf-8")))
+        expected = factory.load_string(xml_str)
+        self.assertEqual(str(obj), str(expected))
+        self.assertEqual(obj.comment, " before \n after ")
+        self.assertEqual(obj["test"][0].comment, " test ")
+        self.assertEqual(obj["test"][1].comment, " test \n last ")
+
+    def test_iterload(self):
+        expected = factory.load("tests/exercise.xml")
+        objs = []
+        for obj in factory.iterload("tests/exercise.xml"):
+            self.assertEqual(obj.tagname, "test")
+            # The previous items are removed from the root
+            self.assertEqual(obj.position, 0)
+            self.assertEqual(obj.root["number"].text, "1")
+            objs += [str(obj)]
+        self.assertEqual(objs, [str(o) for o in expected["test"]])
+
+        objs = list(factory.iterload("tests/exercise.xml", tagname="number"))
+        self.assertEqual([o.text for o in objs], ["1"])
+
+    def test_load_single_pass(self):
+        expected = factory.load("tests/exercise.xml")
+        with mock.patch("xmltool.dtd.DTD.validate_xml") as m:
+            obj = factory.load("tests/exercise.xml", single_pass=True)
+            self.assertEqual(m.call_count, 0)
+        self.assertEqual(str(obj), str(expected))
+        self.assertEqual(obj.dtd_url, "exercise.dtd")
+        # The parser is reused
+        parser = factory._get_validating_parser()
+        self.assertTrue(factory._get_validating_parser() is parser)
+
+        try:
+            factory.load("tests/exercise-notvalid.xml", single_pass=True)
+            assert 0
+        except etree.DocumentInvalid as e:
+            # The error is found when the element ends
+            self.assertEqual(
+                str(e),
+                "Element comments content does not follow the DTD, expecting "
+                "(comment)+, got (), line 18",
+            )
+
+        obj = factory.load(
+            "tests/exercise-notvalid.xml", validate=False, single_pass=True
+        )
+        self.assertEqual(obj.tagname, "Exercise")
+
+        xml_str = open("tests/exercise.xml", "r").read()
+        xml_str = xml_str.replace("exercise.dtd", "tests/exercise.dtd")
+        obj = factory.load_string(xml_str, single_pass=True)
+        self.assertEqual(str(obj), str(expected))
+
+    def test_remote_dtd_resolver(self):
+        resolver = factory._RemoteDTDResolver()
+        self.assertEqual(resolver.resolve("tests/exercise.dtd", None, None), None)
+        with mock.patch("xmltool.dtd.DTD.content", "<!ELEMENT a (#PCDATA)>"):
+            with mock.patch.object(resolver, "resolve_string") as m:
+                # Only the dtd of the XML is resolved
+                for url in ["http://example.com/a.dtd", "file:///tmp/a.dtd"]:
+                    self.assertEqual(resolver.resolve(url, None, None), None)
+                resolver.system_url = "file:///tmp/a.dtd"
+                self.assertEqual(
+                    resolver.resolve(resolver.system_url, None, None), None
+                )
+                self.assertEqual(m.call_count, 0)
+                resolver.system_url = "http://example.com/a.dtd"
+                resolver.resolve("http://example.com/a.dtd", None, "context")
+        m.assert_called_once_with(b"<!ELEMENT a (#PCDATA)>", "context")
+
+    def test_get_doctype_system_url(self):
+        self.assertEqual(
+            factory._get_doctype_system_url("tests/exercise.xml"), "exercise.dtd"
+        )
+        self.assertEqual(
+            factory._get_doctype_system_url(
+                b"<!DOCTYPE a PUBLIC 'a' 'http://example.com/a.dtd'><a/>"
+            ),
+            "http://example.com/a.dtd",
+        )
+        source = BytesIO(b'<?xml version="1.0"?><!DOCTYPE a SYSTEM "a.dtd"><a/>')
+        self.assertEqual(factory._get_doctype_system_url(source), "a.dtd")
+        self.assertEqual(source.tell(), 0)
+        self.assertEqual(factory._get_doctype_system_url(b"<a/>"), None)
+        # The internal subset is not supported
+        self.assertEqual(
+            factory._get_doctype_system_url(b'<!DOCTYPE a SYSTEM "a.dtd" [ ]><a/>'),
+            None,
+        )
+        self.assertEqual(factory._get_doctype_system_url("http://a/a.xml"), None)
+
+    def test_load_stream_parameter_entities(self):
+        directory = tempfile.mkdtemp()
+        try:
+            with open(os.path.join(directory, "x.dtd"), "w") as f:
+                f.write(
+                    '<!ENTITY % items "a+">\n'
+                    "<!ELEMENT root (%items;)>\n<!ELEMENT a (#PCDATA)>"
+                )
+            filename = os.path.join(directory, "x.xml")
+            with open(filename, "w") as f:
+                f.write('<!DOCTYPE root SYSTEM "x.dtd"><root><a>1</a></root>')
+            obj = factory.load_stream(filename)
+            self.assertEqual(obj["a"][0].text, "1")
+
+            with open(filename, "w") as f:
+                f.write('<!DOCTYPE root SYSTEM "x.dtd"><root></root>')
+            try:
+                factory.load_stream(filename)
+                assert 0
+            except etree.DocumentInvalid as e:
+                self.assertTrue(str(e).startswith("Element root content does not"))
+        finally:
+            shutil.rmtree(directory)
+
+    def test_load_external_entities(self):
+        requests = []
+        DTD = b"<!ELEMENT root (a)>\n<!ELEMENT a (#PCDATA)>"
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                requests.append(self.path)
+                self.send_response(200)
+                self.end_headers()
+                if self.path == "/x.dtd":
+                    self.wfile.write(DTD)
+                else:
+                    self.wfile.write(b"SECRET")
+
+            def log_message(self, *args):
+                pass
+
+        server = HTTPServer(("127.0.0.1", 0), Handler)
+        thread = threading.Thread(target=server.serve_forever)
+        thread.start()
+        directory = tempfile.mkdtemp()
+        try:
+            with open(os.path.join(directory, "x.dtd"), "wb") as f:
+                f.write(DTD)
+            with open(os.path.join(directory, "s.txt"), "w") as f:
+                f.write("SECRET")
+            urls = [
+                "http://127.0.0.1:%s/s.txt" % server.server_port,
+                "s.txt",
+                "file://%s" % os.path.join(directory, "s.txt"),
+            ]
+            for url in urls:
+                filename = os.path.join(directory, "x.xml")
+                with open(filename, "w") as f:
+                    f.write(
+                        '<!DOCTYPE root SYSTEM "x.dtd" '
+                        '[<!ENTITY x SYSTEM "%s">]><root><a>&x;</a></root>' % url
+                    )
+                # The entity is not defined since it's not loaded
+                self.assertRaises(
+                    etree.XMLSyntaxError, factory.load, filename, single_pass=True
+                )
+                # The entity is not expanded
+                try:
+                    obj = factory.load_stream(filename)
+                    self.assertEqual(obj["a"].text, "")
+                except etree.XMLSyntaxError:
+                    # lxml doesn't load the network entities
+                    pass
+            self.assertEqual(requests, [])
+
+            # Only the remote dtd of the XML is downloaded
+            dtd_url = "http://127.0.0.1:%s/x.dtd" % server.server_port
+            xml_str = '<!DOCTYPE root SYSTEM "%s"><root><a>text</a></root>' % dtd_url
+            obj = factory.load_string(xml_str, single_pass=True)
+            self.assertEqual(obj["a"].text, "text")
+            self.assertEqual(set(requests), set(["/x.dtd"]))
+
+            # The remote dtd is also given to iterparse
+            with open(filename, "w") as f:
+                f.write(xml_str)
+            obj = factory.load_stream(filename)
+            self.assertEqual(obj["a"].text, "text")
+            self.assertEqual(
+                [o.tagname for o in factory.iterload(filename, "a")], ["a"]
+            )
+            with open(filename, "w") as f:
+                f.write(
+                    '<!DOCTYPE root SYSTEM "%s" '
+                    '[<!ENTITY x SYSTEM "http://127.0.0.1:%s/s.txt">]>'
+                    "<root><a>text</a></root>" % (dtd_url, server.server_port)
+                )
+            obj = factory.load_stream(filename)
+            self.assertEqual(obj["a"].text, "text")
+            self.assertEqual(set(requests), set(["/x.dtd"]))
+        finally:
+            server.shutdown()
+            server.server_close()
+            thread.join()
+            shutil.rmtree(directory)
+
+    def test_load_string_bytes(self):
+        expected = factory.load("tests/exercise.xml")
+        xml_str = open("tests/exercise.xml", "r").read()
+        xml_str = xml_str.replace("exercise.dtd", "tests/exercise.dtd")
+        data = xml_str.encode("utf-8")
+        for value in [data, bytearray(data), memoryview(data)]:
+            obj = factory.load_string(value)
+            self.assertEqual(str(obj), str(expected))
+            self.assertEqual(obj.filename, None)
+            self.assertEqual(obj.dtd_url, "tests/exercise.dtd")
+            self.assertEqual(obj.encoding, "UTF-8")
+
+        obj = factory.load(data, single_pass=True)
+        self.assertEqual(str(obj), str(expected))
+
+        with tempfile.TemporaryFile() as f:
+            f.write(data)
+            f.flush()
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as m:
+                obj = factory.load_string(m)
+        self.assertEqual(str(obj), str(expected))
+
+    def test_load_file(self):
+        expected = factory.load("tests/exercise.xml")
+        obj = factory.load_file("tests/exercise.xml")
+        self.assertEqual(str(obj), str(expected))
+        self.assertEqual(obj.filename, "tests/exercise.xml")
+        self.assertEqual(obj.dtd_url, "exercise.dtd")
+        self.assertEqual(obj.encoding, "UTF-8")
+
+        obj = factory.load_file("tests/exercise.xml", single_pass=True)
+        self.assertEqual(str(obj), str(expected))
+
+        self.assertRaises(
+            etree.DocumentInvalid, factory.load_file, "tests/exercise-notvalid.xml"
+        )
+
+        with tempfile.NamedTemporaryFile(suffix=".xml") as f:
+            self.assertRaises(etree.XMLSyntaxError, factory.load_file, f.name)
+
+    def test_load_lazy_xml(self):
+        expected = factory.load("tests/exercise.xml")
+        obj = factory.load("tests/exercise.xml", lazy_xml=True)
+        self.assertEqual(obj.attributes, {"idexercise": "E1"})
+        # The children are not loaded
+        self.assertEqual(obj._xml_elements, None)
+        self.assertTrue(obj._lazy_xml is not None)
+
+        tests = obj["test"]
+        self.assertEqual(obj._lazy_xml, None)
+        self.assertEqual(len(tests), 2)
+        # Only the children of obj are loaded
+        self.assertEqual(tests[0]._xml_elements, None)
+        self.assertEqual(tests[0]["question"].text, "What is your favorite color?")
+        self.assertEqual(tests[1]._xml_elements, None)
+
+        self.assertEqual(str(obj), str(expected))
+        self.assertEqual(
+            [o.tagname for o in obj.walk()], [o.tagname for o in expected.walk()]
+        )
+
+        obj = factory.load("tests/exercise.xml", lazy_xml=True)
+        (question,) = obj.xpath("//question[@idquestion='Q1']")
+        self.assertEqual(question.text, "What is your favorite color?")
+        self.assertEqual(question.parent.parent, obj)
+
+        xml_str = open("tests/exercise.xml", "r").read()
+        xml_str = xml_str.replace("exercise.dtd", "tests/exercise.dtd")
+        obj = factory.load_string(xml_str, lazy_xml=True)
+        self.assertEqual([o.tagname for o in obj.children], ["number", "test", "test"])
@@ -0,0 +1,113 @@
+#!/usr/bin/env python
+
+from http.server import BaseHTTPRequestHandler, HTTPServer
+import mock
+import requests
+import threading
+from unittest import TestCase
+
+from xmltool import cache, dtd, fetch
+
+from .test_dtd_parser import EXERCISE_DTD
+
+
+class DTDHandler(BaseHTTPRequestHandler):
+    """Serve the dtd of the server with an ETag"""
+
+    def do_GET(self):
+        server = self.server
+        server.requests += [dict(self.headers)]
+        if server.status != 200:
+            self.send_response(server.status)
+            self.end_headers()
+            return
+        etag = '"%s"' % server.version
+        if self.headers.get("If-None-Match") == etag:
+            self.send_response(304)
+            self.end_headers()
+            return
+        body = server.content.encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "application/xml-dtd; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.send_header("ETag", etag)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class TestFetch(TestCase):
+    def setUp(self):
+        fetch.clear()
+        fetch.configure(retries=0)
+        self.server = HTTPServer(("127.0.0.1", 0), DTDHandler)
+        self.server.content = EXERCISE_DTD
+        self.server.version = 1
+        self.server.status = 200
+        self.server.requests = []
+        self.thread = threading.Thread(
+            target=self.server.serve_forever, kwargs={"poll_interval": 0.01}
+        )
+        self.thread.daemon = True
+        self.thread.start()
+        self.url = "http://127.0.0.1:%s/exercise.dtd" % self.server.server_port
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        fetch.clear()
+        fetch.configure(retries=3)
+
+    def test_fetch(self):
+        response = fetch.fetch(self.url)
+        self.assertEqual(response.content, EXERCISE_DTD)
+        self.assertEqual(response.etag, '"1"')
+        self.assertEqual(response.modified, True)
+        self.assertTrue("If-None-Match" not in self.server.requests[0])
+
+        # The second request is conditional
+        response = fetch.fetch(self.url)
+        self.assertEqual(response.content, EXERCISE_DTD)
+        self.assertEqual(response.modified, False)
+        self.assertEqual(self.server.requests[1]["If-None-Match"], '"1"')
+
+        self.server.content = "<!ELEMENT test (#PCDATA)>"
+        self.server.version = 2
+        response = fetch.fetch(self.url)
+        self.assertEqual(response.content, "<!ELEMENT test (#PCDATA)>")
+        self.assertEqual(response.modified, True)
+
+    def test_fetch_error(self):
+        self.server.status = 404
+        self.assertRaises(requests.HTTPError, fetch.fetch, self.url)
+
+    def test_session(self):
+        session = fetch.get_session()
+        self.assertTrue(fetch.get_session() is session)
+        adapter = session.get_adapter(self.url)
+        self.assertEqual(adapter.max_retries.total, 0)
+        fetch.configure(timeout=10, retries=2)
+        self.assertEqual(fetch.TIMEOUT, 10)
+        self.assertTrue(fetch.get_session() is not session)
+        adapter = fetch.get_session().get_adapter(self.url)
+        self.assertEqual(adapter.max_retries.total, 2)
+        fetch.configure(timeout=5)
+
+    def test_dtd_not_modified(self):
+        with mock.patch("xmltool.cache.CACHE_TIMEOUT", 3600):
+            dtd_obj = dtd.DTD(self.url)
+            dic = dtd_obj.parse()
+            self.assertEqual(len(self.server.requests), 1)
+
+            # Expire the cache, the dtd is revalidated with the server and we
+            # keep the parsed classes
+            cache.region.invalidate()
+            dtd_obj = dtd.DTD(self.url)
+            with mock.patch("xmltool.dtd.DTD._parse") as m:
+                self.assertTrue(dtd_obj.parse() is dic)
+                self.assertEqual(m.call_count, 0)
+            self.assertEqual(len(self.server.requests), 2)
+            self.assertEqual(self.server.requests[1]["If-None-Match"], '"1"')
+            self.assertEqual(dtd_obj._modified, False)
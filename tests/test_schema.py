@@ -0,0 +1,97 @@
+#!/usr/bin/env python
+
+from io import StringIO
+import mock
+import os
+import shutil
+import tempfile
+from unittest import TestCase
+
+from xmltool import dtd, schema
+from xmltool.elements import ChoiceElement, ListElement, TextElement
+
+from .test_dtd_parser import EXERCISE_DTD, MOVIE_DTD
+
+
+class TestSchema(TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_compile_schema(self):
+        compiled = schema.compile_schema(EXERCISE_DTD)
+        self.assertEqual(compiled["version"], schema.SCHEMA_VERSION)
+        self.assertEqual(compiled["hash"], schema.content_hash(EXERCISE_DTD))
+        self.assertEqual(
+            sorted(compiled["elements"]),
+            sorted(["Exercise", "choice", "mqm", "qcm", "question", "test"]),
+        )
+        self.assertEqual(compiled["elements"]["question"]["base"], "text")
+        self.assertEqual(compiled["elements"]["test"]["base"], "container")
+
+    def test_dump_load(self):
+        compiled = schema.compile_schema(MOVIE_DTD)
+        fp = StringIO()
+        schema.dump(compiled, fp)
+        fp.seek(0)
+        loaded = schema.load(fp)
+        # The content models are not parsed again
+        with mock.patch("xmltool.content_model.parse") as m:
+            dic = schema.build_classes(loaded)
+            self.assertEqual(m.call_count, 0)
+        self.assertEqual(sorted(dic), sorted(dtd.DTD(StringIO(MOVIE_DTD)).parse()))
+        movie = dic["Movie"]
+        self.assertEqual(
+            [c.tagname for c in movie.children_classes],
+            [
+                "is-publish",
+                "name",
+                "year",
+                "directors",
+                "actors",
+                "resume",
+                "list__critique",
+            ],
+        )
+        self.assertTrue(issubclass(movie.children_classes[-1], ListElement))
+        self.assertTrue(issubclass(dic["name"], TextElement))
+        self.assertTrue(
+            movie._automaton.accepts(["name", "year", "directors", "actors"])
+        )
+
+        fp = StringIO('{"version": 0}')
+        self.assertRaises(ValueError, schema.load, fp)
+
+    def test_build_classes_choice(self):
+        dic = schema.build_classes(schema.compile_schema(EXERCISE_DTD))
+        cls = dic["test"].children_classes[0]
+        self.assertTrue(issubclass(cls, ChoiceElement))
+        self.assertEqual([c.tagname for c in cls._choice_classes], ["qcm", "mqm"])
+
+    def test_store(self):
+        store = schema.SchemaStore(os.path.join(self.directory, "schemas"))
+        key = schema.content_hash(EXERCISE_DTD)
+        self.assertEqual(store.get(key), None)
+        compiled = store.get_or_compile(EXERCISE_DTD)
+        self.assertEqual(store.get(key), compiled)
+        self.assertEqual(
+            os.listdir(os.path.join(self.directory, "schemas")), ["%s.json" % key]
+        )
+
+        with mock.patch("xmltool.schema.compile_schema") as m:
+            self.assertEqual(store.get_or_compile(EXERCISE_DTD), compiled)
+            self.assertEqual(m.call_count, 0)
+
+    def test_dtd_parse(self):
+        with mock.patch("xmltool.cache.SCHEMA_DIR", self.directory):
+            dic = dtd.DTD(StringIO(EXERCISE_DTD)).parse()
+            self.assertEqual(len(os.listdir(self.directory)), 1)
+            with mock.patch("xmltool.dtd_parser.dtd_to_dict_v2") as m:
+                dic = dtd.DTD(StringIO(EXERCISE_DTD)).parse()
+                self.assertEqual(m.call_count, 0)
+        self.assertEqual(
+            sorted(dic),
+            sorted(["Exercise", "choice", "mqm", "qcm", "question", "test"]),
+        )
@@ -2,7 +2,11 @@ from .factory import (
     create,
     load,
     load_string,
+    load_file,
+    load_stream,
+    iterload,
 )
+from .batch import load_many, validate_many
 
 from .elements import EOL
 from . import cache
@@ -0,0 +1,229 @@
+"""Load or validate many XML files in parallel.
+
+The files are grouped by dtd: the classes of a dtd are created once for the
+batch. The work is done in a thread pool (lxml releases the GIL while
+parsing and validating), validate_many can also use a process pool. The
+results are yielded in the order of the files and only max_in_flight files
+are loaded at the same time so the memory stays flat.
+"""
+
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from functools import partial
+import os
+import threading
+
+from lxml import etree
+
+from . import dtd
+from . import factory
+
+
+class BatchError(Exception):
+    """The error of a file validated in another process, we only get its
+    message since the lxml errors can't be pickled"""
+
+    def __init__(self, message, error_type):
+        super(BatchError, self).__init__(message)
+        self.error_type = error_type
+
+    def __reduce__(self):
+        return (BatchError, (str(self), self.error_type))
+
+
+class Result(object):
+    """The result of a file: obj is the loaded object, error the exception
+    raised when loading or validating the file"""
+
+    def __init__(self, filename, obj=None, error=None):
+        self.filename = filename
+        self.obj = obj
+        self.error = error
+
+    @property
+    def ok(self):
+        return self.error is None
+
+    def __repr__(self):
+        return "<Result %s %s>" % (self.filename, "ok" if self.ok else self.error)
+
+
+class _Schemas(object):
+    """The dtds of a batch, the classes of each dtd are created once.
+
+    The lxml validators come from the cache of xmltool.dtd, they are compiled
+    once by thread.
+    """
+
+    def __init__(self, lazy=False, dtd_module=None):
+        self.lazy = lazy
+        self.dtd_module = dtd_module
+        self._dtds = {}
+        self._lock = threading.Lock()
+
+    def _get_dtd(self, dtd_url, path):
+        key = (dtd_url, path)
+        dtd_obj = self._dtds.get(key)
+        if dtd_obj is not None:
+            return dtd_obj
+        with self._lock:
+            dtd_obj = self._dtds.get(key)
+            if dtd_obj is None:
+                dtd_obj = dtd.DTD(dtd_url, path, lazy=self.lazy)
+                # Validate the dtd and create its classes
+                dtd_obj.validate()
+                dtd_obj.parse()
+                self._dtds[key] = dtd_obj
+        return dtd_obj
+
+    def get_classes(self, dtd_url, path):
+        if self.dtd_module is not None:
+            return self.dtd_module.CLASSES
+        return self._get_dtd(dtd_url, path).parse()
+
+    def get_validator(self, dtd_url, path):
+        if self.dtd_module is not None:
+            return dtd.get_validator(self.dtd_module.DTD_CONTENT)
+        return self._get_dtd(dtd_url, path).get_validator()
+
+
+def _parse(filename):
+    parser = etree.XMLParser(strip_cdata=False)
+    return etree.parse(filename, parser=parser)
+
+
+def _validate_tree(schemas, tree, filename):
+    dtd_url = tree.docinfo.system_url
+    path = os.path.dirname(filename)
+    schemas.get_validator(dtd_url, path).assertValid(tree)
+
+
+def _load_file(schemas, filename, validate, lazy_xml):
+    try:
+        tree = _parse(filename)
+        if validate:
+            _validate_tree(schemas, tree, filename)
+        dic = schemas.get_classes(tree.docinfo.system_url, os.path.dirname(filename))
+        obj = factory._create_from_tree(
+            tree, filename, dic, lazy_xml, trusted=validate, source=filename
+        )
+        return Result(filename, obj=obj)
+    except Exception as e:
+        return Result(filename, error=e)
+
+
+def _validate_file(schemas, filename):
+    try:
+        _validate_tree(schemas, _parse(filename), filename)
+        return Result(filename)
+    except Exception as e:
+        return Result(filename, error=e)
+
+
+# The dtds of the process when validate_many uses a process pool, by dtd
+# module name
+_process_schemas = {}
+
+
+def _get_process_schemas(dtd_module_name):
+    # ProcessPoolExecutor has no initializer before python 3.7, the schemas are
+    # created by the first file validated in the process.
+    schemas = _process_schemas.get(dtd_module_name)
+    if schemas is None:
+        dtd_module = None
+        if dtd_module_name:
+            dtd_module = __import__(dtd_module_name, fromlist=["CLASSES"])
+        schemas = _process_schemas[dtd_module_name] = _Schemas(dtd_module=dtd_module)
+    return schemas
+
+
+def _validate_file_in_process(dtd_module_name, filename):
+    result = _validate_file(_get_process_schemas(dtd_module_name), filename)
+    if result.error is not None:
+        result.error = BatchError(str(result.error), type(result.error).__name__)
+    return result
+
+
+def _run(executor, func, filenames, max_in_flight):
+    """Yield the results of func in the order of filenames, only
+    max_in_flight files are submitted at the same time"""
+    futures = deque()
+    with executor:
+        for filename in filenames:
+            if len(futures) >= max_in_flight:
+                yield futures.popleft().result()
+            futures.append(executor.submit(func, filename))
+        while futures:
+            yield futures.popleft().result()
+
+
+def _get_workers(workers, max_in_flight):
+    workers = workers or os.cpu_count() or 1
+    return workers, max_in_flight or 2 * workers
+
+
+def load_many(
+    filenames,
+    validate=True,
+    lazy=False,
+    dtd_module=None,
+    lazy_xml=False,
+    workers=None,
+    max_in_flight=None,
+):
+    """Load the XML files in a thread pool
+
+    Yield a Result for each file, in the same order. The errors are given in
+    Result.error, they don't stop the batch.
+
+    :param filenames: the XML filenames, it can be a generator
+    :param validate: validate the XML before generating the python object.
+    :param lazy: only create the classes of the dtd when we use them
+    :param dtd_module: module generated by xmltool.codegen to use instead of
+                       the dtd of the XML
+    :param lazy_xml: only create the children of an object when we use them
+    :param workers: the number of threads, by default the number of cpus
+    :param max_in_flight: the maximum number of files loaded and not yet
+                          yielded, by default 2 * workers
+    """
+    workers, max_in_flight = _get_workers(workers, max_in_flight)
+    schemas = _Schemas(lazy=lazy, dtd_module=dtd_module)
+    return _run(
+        ThreadPoolExecutor(max_workers=workers),
+        lambda filename: _load_file(schemas, filename, validate, lazy_xml),
+        filenames,
+        max_in_flight,
+    )
+
+
+def validate_many(
+    filenames, dtd_module=None, workers=None, max_in_flight=None, processes=False
+):
+    """Validate the XML files against their dtd
+
+    Yield a Result for each file, in the same order, Result.error is set when
+    the file is not valid.
+
+    :param filenames: the XML filenames, it can be a generator
+    :param dtd_module: module generated by xmltool.codegen to use instead of
+                       the dtd of the XML
+    :param workers: the number of threads or processes, by default the number
+                    of cpus
+    :param max_in_flight: the maximum number of files validated and not yet
+                          yielded, by default 2 * workers
+    :param processes: use a process pool, the errors are given as BatchError
+    """
+    workers, max_in_flight = _get_workers(workers, max_in_flight)
+    if processes:
+        executor = ProcessPoolExecutor(max_workers=workers)
+        func = partial(
+            _validate_file_in_process, dtd_module.__name__ if dtd_module else None
+        )
+    else:
+        schemas = _Schemas(dtd_module=dtd_module)
+        executor = ThreadPoolExecutor(max_workers=workers)
+
+        def func(filename):
+            return _validate_file(schemas, filename)
+
+    return _run(executor, func, filenames, max_in_flight)
@@ -1,14 +1,310 @@
+from collections import OrderedDict
+from collections.abc import Mapping
+import hashlib
 import os
+import pickle
+import sys
+import tempfile
+import threading
+
 from dogpile.cache import make_region
+from dogpile.cache.api import CacheBackend, NO_VALUE
+from dogpile.cache.region import register_backend
+
+
+def _get_int_env(name):
+    if os.environ.get(name):
+        try:
+            return int(os.environ.get(name))
+        except ValueError:
+            # TODO: add logging
+            pass
+    return None
+
+
+CACHE_TIMEOUT = _get_int_env("XMLTOOL_CACHE_TIMEOUT")
+
+# Directory where the compiled schemas are stored, see xmltool.schema
+SCHEMA_DIR = os.environ.get("XMLTOOL_SCHEMA_DIR") or None
+
+# The bounds of the memory cache: the number of entries and the size of the
+# values in bytes.
+DEFAULT_MAX_ENTRIES = 256
+MAX_ENTRIES = _get_int_env("XMLTOOL_CACHE_MAX_ENTRIES") or DEFAULT_MAX_ENTRIES
+MAX_BYTES = _get_int_env("XMLTOOL_CACHE_MAX_BYTES")
+
+# The approximate memory used by the classes of a dtd element, its list and
+# choice classes included (measured with tracemalloc).
+CLASS_SIZE = 7000
+
+# Serve the expired values while a thread creates the new ones
+SERVE_STALE = bool(os.environ.get("XMLTOOL_CACHE_SERVE_STALE"))
+
+# Directory of the disk cache, the values which can be pickled (the dtd
+# contents) are also stored there to keep them after a restart.
+CACHE_DIR = os.environ.get("XMLTOOL_CACHE_DIR") or None
+
+
+# The number of dtds memoized when there is no cache timeout
+MEMO_MAX_SIZE = _get_int_env("XMLTOOL_MEMO_MAX_SIZE") or 32
+
+
+class LRUDict(object):
+    """Thread-safe mapping which keeps the max_size last used items"""
+
+    def __init__(self, max_size):
+        self.max_size = max_size
+        self._dict = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            value = self._dict.get(key, NO_VALUE)
+            if value is NO_VALUE:
+                return default
+            self._dict.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._dict[key] = value
+            self._dict.move_to_end(key)
+            while len(self._dict) > self.max_size:
+                self._dict.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._dict.clear()
+
+    def __len__(self):
+        return len(self._dict)
+
+
+def _sizeof(value):
+    """The size of the cached value: the length of the dtd contents and an
+    estimate for the classes of the parsed dtds"""
+    payload = getattr(value, "payload", value)
+    if isinstance(payload, (str, bytes)):
+        return len(payload)
+    if isinstance(payload, Mapping):
+        # The classes of a dtd by tagname, the lazy ones are counted as if
+        # they were all created
+        return len(payload) * CLASS_SIZE
+    return sys.getsizeof(payload)
+
+
+class FileBackend(CacheBackend):
+    """Store each pickled value in a file of the given directory"""
+
+    def __init__(self, arguments):
+        self.directory = arguments["directory"]
+        if not os.path.isdir(self.directory):
+            os.makedirs(self.directory)
+
+    def _filename(self, key):
+        return os.path.join(
+            self.directory, hashlib.sha256(key.encode("utf-8")).hexdigest()
+        )
+
+    def get(self, key):
+        try:
+            with open(self._filename(key), "rb") as f:
+                return pickle.load(f)
+        except (IOError, OSError, EOFError, pickle.UnpicklingError):
+            return NO_VALUE
+
+    def get_multi(self, keys):
+        return [self.get(key) for key in keys]
+
+    def set(self, key, value):
+        try:
+            data = pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+        except (pickle.PicklingError, TypeError, AttributeError):
+            # The generated classes can't be pickled, we only keep them in
+            # memory
+            return False
+        f, tmp = tempfile.mkstemp(dir=self.directory)
+        try:
+            try:
+                os.write(f, data)
+            finally:
+                os.close(f)
+            # Atomic so we never read a partial file
+            os.replace(tmp, self._filename(key))
+        except Exception:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+            raise
+        return True
+
+    def set_multi(self, mapping):
+        for key, value in mapping.items():
+            self.set(key, value)
+
+    def delete(self, key):
+        try:
+            os.remove(self._filename(key))
+        except OSError:
+            pass
+
+    def delete_multi(self, keys):
+        for key in keys:
+            self.delete(key)
+
+
+class LRUBackend(CacheBackend):
+    """Memory cache bounded by a number of entries and/or a size in bytes.
+
+    When a directory is given the values are also stored on disk, we look at
+    the disk when a value is not in memory.
+    """
+
+    def __init__(self, arguments):
+        self.max_entries = arguments.get("max_entries")
+        self.max_bytes = arguments.get("max_bytes")
+        directory = arguments.get("directory")
+        self.disk = FileBackend({"directory": directory}) if directory else None
+        # key: (value, size)
+        self._cache = OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+        self._stats = dict.fromkeys(["hits", "misses", "disk_hits", "evictions"], 0)
+
+    def stats(self):
+        with self._lock:
+            dic = dict(self._stats)
+            dic["entries"] = len(self._cache)
+            dic["bytes"] = self._size
+        return dic
+
+    def _set_memory(self, key, value):
+        # Should be called with the lock
+        if key in self._cache:
+            self._size -= self._cache.pop(key)[1]
+        size = _sizeof(value)
+        self._cache[key] = (value, size)
+        self._size += size
+        while self._cache and (
+            (self.max_entries and len(self._cache) > self.max_entries)
+            or (self.max_bytes and self._size > self.max_bytes)
+        ):
+            self._size -= self._cache.popitem(last=False)[1][1]
+            self._stats["evictions"] += 1
+
+    def get(self, key):
+        with self._lock:
+            item = self._cache.get(key)
+            if item is not None:
+                self._cache.move_to_end(key)
+                self._stats["hits"] += 1
+                return item[0]
+        value = self.disk.get(key) if self.disk else NO_VALUE
+        with self._lock:
+            if value is NO_VALUE:
+                self._stats["misses"] += 1
+            else:
+                self._stats["disk_hits"] += 1
+                self._set_memory(key, value)
+        return value
+
+    def get_multi(self, keys):
+        return [self.get(key) for key in keys]
+
+    def set(self, key, value):
+        with self._lock:
+            self._set_memory(key, value)
+        if self.disk:
+            self.disk.set(key, value)
+
+    def set_multi(self, mapping):
+        for key, value in mapping.items():
+            self.set(key, value)
+
+    def delete(self, key):
+        with self._lock:
+            item = self._cache.pop(key, None)
+            if item is not None:
+                self._size -= item[1]
+        if self.disk:
+            self.disk.delete(key)
+
+    def delete_multi(self, keys):
+        for key in keys:
+            self.delete(key)
+
+
+register_backend("xmltool.lru", "xmltool.cache", "LRUBackend")
+
+
+def _get_arguments():
+    return {
+        "max_entries": MAX_ENTRIES,
+        "max_bytes": MAX_BYTES,
+        "directory": CACHE_DIR,
+    }
+
+
+def async_creation_runner(cache, somekey, creator, mutex):
+    """Create the value in a thread, the callers get the expired value in the
+    meantime. The mutex is released when the value is created."""
+
+    def runner():
+        try:
+            value = creator()
+            cache.set(somekey, value)
+        finally:
+            mutex.release()
+
+    thread = threading.Thread(target=runner)
+    thread.daemon = True
+    thread.start()
+
+
+def _get_async_creation_runner():
+    return async_creation_runner if SERVE_STALE else None
+
+
+# Use to put some cache. Use region.get_or_create: only one thread creates a
+# missing value, the others wait for it.
+region = make_region(async_creation_runner=_get_async_creation_runner()).configure(
+    "xmltool.lru", arguments=_get_arguments()
+)
+
+
+def configure(
+    max_entries=DEFAULT_MAX_ENTRIES, max_bytes=None, directory=None, serve_stale=False
+):
+    """Replace the cache backend, the cached values are lost
+
+    max_entries: the maximum number of values kept in memory, None for no
+    limit
+    max_bytes: the maximum size of the values kept in memory, the size of
+    the parsed dtds is estimated from their number of elements
+    directory: where to store the values on disk, None to disable the disk
+    serve_stale: give the expired values while they are refreshed in a thread
+    """
+    global MAX_ENTRIES, MAX_BYTES, CACHE_DIR, SERVE_STALE
+    MAX_ENTRIES = max_entries
+    MAX_BYTES = max_bytes
+    CACHE_DIR = directory
+    SERVE_STALE = serve_stale
+    region.async_creation_runner = _get_async_creation_runner()
+    region.configure(
+        "xmltool.lru", arguments=_get_arguments(), replace_existing_backend=True
+    )
+
 
+def get_schema_dir():
+    """The directory of the compiled schemas, by default they are stored in
+    the disk cache"""
+    if SCHEMA_DIR:
+        return SCHEMA_DIR
+    if CACHE_DIR:
+        return os.path.join(CACHE_DIR, "schemas")
+    return None
 
-CACHE_TIMEOUT = None
-if os.environ.get("XMLTOOL_CACHE_TIMEOUT"):
-    try:
-        CACHE_TIMEOUT = int(os.environ.get("XMLTOOL_CACHE_TIMEOUT"))
-    except ValueError:
-        # TODO: add logging
-        pass
 
-# Use to put some cache
-region = make_region().configure("dogpile.cache.memory")
+def stats():
+    """The counters of the cache: hits, misses, disk_hits and evictions and
+    the number of entries and bytes in memory"""
+    return region.backend.stats()
@@ -0,0 +1,212 @@
+"""Generate a python module defining the classes of a dtd.
+
+The generated module defines statically the classes created by
+dtd_parser._create_classes, so importing it (and its bytecode cache) replaces
+the parsing of the dtd. It can be given to factory.create and factory.load
+as dtd_module.
+
+Usage: xmltool-codegen movie.dtd movie_dtd.py
+"""
+
+import argparse
+import keyword
+import re
+import sys
+from io import StringIO
+
+from . import dtd, elements
+
+
+# The classes the generated classes can inherit from
+BASE_CLASSES = [
+    elements.ContainerElement,
+    elements.TextElement,
+    elements.ListElement,
+    elements.ChoiceElement,
+    elements.ChoiceListElement,
+    elements.InListMixin,
+    elements.InChoiceMixin,
+]
+
+# The attributes which are defined in the class body
+VALUE_ATTRIBUTES = ["tagname", "_required", "_is_empty"]
+
+# The attributes referencing other classes, set once all the classes are
+# defined.
+CLASS_ATTRIBUTES = ["_parent_cls", "_children_class"]
+CLASS_LIST_ATTRIBUTES = ["children_classes", "_choice_classes"]
+
+# The names defined in the generated module which are not classes
+MODULE_NAMES = [
+    "MappingProxyType",
+    "ContentModelAutomaton",
+    "DTD_URL",
+    "DTD_CONTENT",
+    "CLASSES",
+]
+
+identifier_regex_compile = re.compile(r"\W")
+
+
+class _Namer(object):
+    """Give a unique python identifier to each class"""
+
+    def __init__(self):
+        self.names = {}
+        self.used = set(cls.__name__ for cls in BASE_CLASSES)
+        self.used.update(MODULE_NAMES)
+
+    def __call__(self, cls, prefix=""):
+        name = self.names.get(cls)
+        if name is not None:
+            return name
+        name = identifier_regex_compile.sub("_", prefix + cls.__name__)
+        if name[0].isdigit() or keyword.iskeyword(name):
+            name = "_" + name
+        base = name
+        i = 1
+        while name in self.used:
+            i += 1
+            name = "%s_%s" % (base, i)
+        self.used.add(name)
+        self.names[cls] = name
+        return name
+
+
+def _iter_classes(class_dict):
+    """Yield all the classes we need to define, the base classes of a class
+    are yielded before it."""
+    seen = set()
+    todo = [class_dict[tagname] for tagname in sorted(class_dict)]
+    # The classes created for each tag first since they are the bases of the
+    # others.
+    for cls in todo:
+        seen.add(cls)
+        yield cls
+
+    while todo:
+        cls = todo.pop(0)
+        subs = []
+        for attr in CLASS_ATTRIBUTES:
+            value = cls.__dict__.get(attr)
+            if value is not None:
+                subs += [value]
+        for attr in CLASS_LIST_ATTRIBUTES:
+            subs += list(cls.__dict__.get(attr) or [])
+        for sub in subs:
+            if sub in seen:
+                continue
+            seen.add(sub)
+            todo.append(sub)
+            yield sub
+
+
+def _generate_class(cls, name, namer, lines):
+    bases = ", ".join(namer(base) for base in cls.__bases__)
+    lines += ["", "", "class %s(%s):" % (name, bases), "    __slots__ = ()"]
+    for attr in VALUE_ATTRIBUTES:
+        if attr in cls.__dict__:
+            lines += ["    %s = %r" % (attr, cls.__dict__[attr])]
+    if "_attribute_names" in cls.__dict__:
+        lines += [
+            "    _attribute_names = frozenset(%r)"
+            % sorted(cls.__dict__["_attribute_names"])
+        ]
+    if "_automaton" in cls.__dict__:
+        lines += [
+            "    _automaton = ContentModelAutomaton.from_data(%r)"
+            % (cls._automaton.to_data(),)
+        ]
+
+
+def _generate_references(cls, name, namer, lines):
+    for attr in CLASS_ATTRIBUTES:
+        value = cls.__dict__.get(attr)
+        if value is not None:
+            lines += ["%s.%s = %s" % (name, attr, namer(value))]
+    for attr in CLASS_LIST_ATTRIBUTES:
+        if attr in cls.__dict__:
+            names = [namer(c) for c in cls.__dict__[attr]]
+            lines += ["%s.%s = (%s)" % (name, attr, "".join(n + "," for n in names))]
+    if set(CLASS_LIST_ATTRIBUTES + ["_children_class"]) & set(cls.__dict__):
+        # The classes with children get their lookup table
+        table = cls._get_creatable_subclass_by_tagnames()
+        lines += [
+            "%s._creatable_subclasses = MappingProxyType({%s})"
+            % (
+                name,
+                ", ".join(
+                    "%r: %s" % (tagname, namer(c))
+                    for tagname, c in sorted(table.items())
+                ),
+            )
+        ]
+
+
+def generate_module(dtd_url=None, dtd_str=None, path=None):
+    """Returns the source of the python module defining the classes of the
+    dtd given by url or as string"""
+    url = dtd_url if dtd_url else StringIO(dtd_str)
+    dtd_obj = dtd.DTD(url, path)
+    content = dtd_obj.content
+    class_dict = dtd_obj.parse()
+
+    namer = _Namer()
+    for cls in BASE_CLASSES:
+        namer.names[cls] = cls.__name__
+    classes = []
+    tag_classes = set(class_dict.values())
+    for cls in _iter_classes(class_dict):
+        # Prefix the wrapper classes by their parent to keep readable names
+        prefix = ""
+        if cls not in tag_classes and cls._parent_cls is not None:
+            prefix = "%s__" % namer(cls._parent_cls)
+        classes += [(cls, namer(cls, prefix))]
+
+    lines = [
+        "# Generated by xmltool.codegen, don't edit it.",
+        "from types import MappingProxyType",
+        "from xmltool.content_model import ContentModelAutomaton",
+        "from xmltool.elements import (",
+    ]
+    lines += ["    %s," % cls.__name__ for cls in BASE_CLASSES]
+    lines += [
+        ")",
+        "",
+        "",
+        "DTD_URL = %r" % dtd_url,
+        "",
+        "DTD_CONTENT = %r" % content,
+    ]
+    for cls, name in classes:
+        _generate_class(cls, name, namer, lines)
+    lines += ["", ""]
+    for cls, name in classes:
+        _generate_references(cls, name, namer, lines)
+    lines += ["", "", "CLASSES = {"]
+    lines += [
+        "    %r: %s," % (tagname, namer(class_dict[tagname]))
+        for tagname in sorted(class_dict)
+    ]
+    lines += ["}", ""]
+    return "\n".join(lines)
+
+
+def write_module(filename, dtd_url=None, dtd_str=None, path=None):
+    source = generate_module(dtd_url=dtd_url, dtd_str=dtd_str, path=path)
+    with open(filename, "w") as f:
+        f.write(source)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Generate a python module defining the classes of a dtd"
+    )
+    parser.add_argument("dtd_url", help="the url or the filename of the dtd")
+    parser.add_argument("output", help="the python module to write")
+    args = parser.parse_args(argv)
+    write_module(args.output, dtd_url=args.dtd_url)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
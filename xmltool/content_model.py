@@ -0,0 +1,428 @@
+"""Parse the content models of the dtd elements and compile them.
+
+A content model like '(a,(b|c)+,d?)' is parsed to a tree of Name and Group
+nodes. This tree is compiled to a deterministic automaton which is stored on
+the generated classes with the tables used to check the children we add.
+"""
+
+import re
+
+# The special names we can find in a content model
+PCDATA = "#PCDATA"
+EMPTY = "EMPTY"
+ANY = "ANY"
+
+token_regex_compile = re.compile(r"[()|,?*+]|[^()|,?*+\s]+")
+
+
+class Node(object):
+    occurrence = ""
+
+    @property
+    def required(self):
+        return self.occurrence in ("", "+")
+
+    @property
+    def islist(self):
+        return self.occurrence in ("*", "+")
+
+
+class Name(Node):
+    def __init__(self, name, occurrence=""):
+        self.name = name
+        self.occurrence = occurrence
+
+    def __eq__(self, other):
+        return (
+            isinstance(other, Name)
+            and self.name == other.name
+            and self.occurrence == other.occurrence
+        )
+
+    def __repr__(self):
+        return "<Name %s%s>" % (self.name, self.occurrence)
+
+    def names(self):
+        return [self.name]
+
+
+class Group(Node):
+    def __init__(self, separator, children, occurrence=""):
+        # separator is ',' for a sequence and '|' for a choice
+        self.separator = separator
+        self.children = children
+        self.occurrence = occurrence
+
+    def __eq__(self, other):
+        return (
+            isinstance(other, Group)
+            and self.separator == other.separator
+            and self.children == other.children
+            and self.occurrence == other.occurrence
+        )
+
+    def __repr__(self):
+        return "<Group %s>" % to_string(self)
+
+    @property
+    def is_mixed(self):
+        return (
+            self.separator == "|"
+            and isinstance(self.children[0], Name)
+            and self.children[0].name == PCDATA
+        )
+
+    def names(self):
+        lis = []
+        for child in self.children:
+            lis += child.names()
+        return lis
+
+
+def _merge_occurrences(occ1, occ2):
+    if not occ1 or not occ2:
+        return occ1 or occ2
+    if occ1 == occ2 and occ1 in ("?", "+"):
+        return occ1
+    return "*"
+
+
+def _parse_group(tokens, pos, content):
+    """Parse the group starting after the '(' at tokens[pos]"""
+    children = []
+    separator = None
+    while True:
+        if pos >= len(tokens):
+            raise Exception("Unbalanced parenthesis %s" % content)
+        token = tokens[pos]
+        if token == "(":
+            node, pos = _parse_group(tokens, pos + 1, content)
+        elif token in "|,)?*+":
+            raise Exception("Error parsing content model %s" % content)
+        else:
+            node = Name(token)
+            pos += 1
+        if pos < len(tokens) and tokens[pos] in ("?", "*", "+"):
+            node.occurrence = _merge_occurrences(node.occurrence, tokens[pos])
+            pos += 1
+        children += [node]
+
+        if pos >= len(tokens):
+            raise Exception("Unbalanced parenthesis %s" % content)
+        token = tokens[pos]
+        pos += 1
+        if token == ")":
+            break
+        if token not in ("|", ","):
+            raise Exception("Error parsing content model %s" % content)
+        if separator is not None and separator != token:
+            raise Exception("Mixed separators in content model %s" % content)
+        separator = token
+
+    if len(children) == 1:
+        # A group with one child is just the child
+        return children[0], pos
+    return Group(separator, children), pos
+
+
+def parse(content):
+    """Parse the content model and returns its tree
+
+    The content can be given with or without the outer parenthesis like it's
+    returned by dtd_parser.parse_element: 'a,b' or '(a|b)+'.
+    """
+    content = content.strip()
+    if content in (EMPTY, ANY):
+        return Name(content)
+    tokens = token_regex_compile.findall("(%s)" % content)
+    node, pos = _parse_group(tokens, 1, content)
+    if pos < len(tokens) and tokens[pos] in ("?", "*", "+"):
+        node.occurrence = _merge_occurrences(node.occurrence, tokens[pos])
+        pos += 1
+    if pos != len(tokens):
+        raise Exception("Error parsing content model %s" % content)
+    return node
+
+
+def to_string(node):
+    """The content model string of the given node"""
+    if isinstance(node, Name):
+        return node.name + node.occurrence
+    return "(%s)%s" % (
+        node.separator.join(to_string(c) for c in node.children),
+        node.occurrence,
+    )
+
+
+def required_names(node):
+    """The names we find in all the sequences matching the node"""
+    if node.occurrence in ("?", "*"):
+        return set()
+    if isinstance(node, Name):
+        if node.name in (PCDATA, EMPTY, ANY):
+            return set()
+        return {node.name}
+    sets = [required_names(c) for c in node.children]
+    if node.separator == ",":
+        return set().union(*sets)
+    return set.intersection(*sets)
+
+
+def _add_follow(follow, last, first):
+    # The sets are shared between the positions when possible, the repeated
+    # choices like '(a|b|c)*' give the same follow set to all their positions
+    if first:
+        for p in last:
+            follow[p] = follow[p] | first if follow[p] else first
+
+
+def _glushkov(node, positions, follow):
+    """Compute the position automaton of the node.
+
+    Each Name of the node is a position, positions is filled with their
+    tagnames and follow with the frozensets of positions which can follow
+    them.
+    Returns (nullable, first, last)
+    """
+    if isinstance(node, Name):
+        if node.name in (PCDATA, EMPTY):
+            nullable, first, last = True, frozenset(), frozenset()
+        else:
+            index = len(positions)
+            positions.append(node.name)
+            follow.append(frozenset())
+            nullable, first, last = False, frozenset([index]), frozenset([index])
+    elif node.separator == "|":
+        results = [_glushkov(child, positions, follow) for child in node.children]
+        nullable = any(n for n, f, lt in results)
+        first = frozenset().union(*[f for n, f, lt in results])
+        last = frozenset().union(*[lt for n, f, lt in results])
+    else:
+        nullable, first, last = True, frozenset(), frozenset()
+        for child in node.children:
+            n, f, lt = _glushkov(child, positions, follow)
+            _add_follow(follow, last, f)
+            if nullable:
+                first = first | f
+            last = lt | last if n else lt
+            nullable = nullable and n
+
+    if node.occurrence in ("*", "+"):
+        _add_follow(follow, last, first)
+    if node.occurrence in ("?", "*"):
+        nullable = True
+    return nullable, first, last
+
+
+class ContentModelAutomaton(object):
+    """Deterministic automaton recognizing the sequences of child tagnames
+    allowed by a content model. The state 0 is the initial state.
+    """
+
+    def __init__(
+        self,
+        transitions,
+        accepting,
+        any_content=False,
+        required=None,
+        repeatable=None,
+        excluded=None,
+    ):
+        # transitions[state] is a dict {tagname: next_state}
+        self.transitions = tuple(transitions)
+        self.accepting = frozenset(accepting)
+        self.any_content = any_content
+        alphabet = set()
+        for dic in self.transitions:
+            alphabet.update(dic)
+        self.alphabet = frozenset(alphabet)
+        if required is None:
+            required = self._compute_required()
+        self.required = frozenset(required)
+        if repeatable is None or excluded is None:
+            repeatable, excluded = self._compute_cooccurrences()
+        # The tagnames which can be in an accepted sequence more than once
+        self.repeatable = frozenset(repeatable)
+        # tagname: the tagnames which are never in an accepted sequence with
+        # it, like the other names of a choice
+        self.excluded = dict(
+            (tagname, frozenset(names)) for tagname, names in excluded.items()
+        )
+
+    def to_data(self):
+        """Convert the automaton to lists and dicts which can be serialized"""
+        return {
+            "transitions": list(self.transitions),
+            "accepting": sorted(self.accepting),
+            "any": self.any_content,
+            "required": sorted(self.required),
+            "repeatable": sorted(self.repeatable),
+            "excluded": dict(
+                (tagname, sorted(names)) for tagname, names in self.excluded.items()
+            ),
+        }
+
+    @classmethod
+    def from_data(cls, data):
+        return cls(
+            data["transitions"],
+            data["accepting"],
+            any_content=data["any"],
+            required=data["required"],
+            repeatable=data["repeatable"],
+            excluded=data["excluded"],
+        )
+
+    @classmethod
+    def compile(cls, node):
+        if isinstance(node, Name) and node.name == ANY:
+            return cls([{}], [0], any_content=True)
+
+        positions = []
+        follow = []
+        nullable, first, last = _glushkov(node, positions, follow)
+
+        # Subset construction, even if the dtd content models should be
+        # deterministic. Two sets of positions with the same possible next
+        # positions and acceptance are the same state, it keeps the automaton
+        # small for the repeated choices like '(a|b|c)*'.
+        states = {}
+        todo = [(0, first)]
+        transitions = [{}]
+        accepting = [0] if nullable else []
+        while todo:
+            index, nexts = todo.pop()
+            dic = {}
+            for p in nexts:
+                dic.setdefault(positions[p], []).append(p)
+            for tagname, target in dic.items():
+                if len(target) == 1:
+                    follows = follow[target[0]]
+                else:
+                    follows = frozenset().union(*[follow[p] for p in target])
+                key = (follows, not last.isdisjoint(target))
+                state = states.get(key)
+                if state is None:
+                    state = states[key] = len(transitions)
+                    transitions.append({})
+                    if key[1]:
+                        accepting.append(state)
+                    todo.append((state, key[0]))
+                transitions[index][tagname] = state
+        return cls(transitions, accepting, required=required_names(node))
+
+    def _compute_required(self):
+        """The tagnames we find in all the accepted sequences"""
+        if self.any_content:
+            return frozenset()
+        required = set()
+        for tagname in self.alphabet:
+            seen = {0}
+            todo = [0]
+            while todo:
+                state = todo.pop()
+                for t, target in self.transitions[state].items():
+                    if t != tagname and target not in seen:
+                        seen.add(target)
+                        todo.append(target)
+            if not (seen & self.accepting):
+                required.add(tagname)
+        return frozenset(required)
+
+    def _reachable(self, state):
+        """The states we can reach from state, state included"""
+        seen = {state}
+        todo = [state]
+        while todo:
+            for target in self.transitions[todo.pop()].values():
+                if target not in seen:
+                    seen.add(target)
+                    todo.append(target)
+        return seen
+
+    def _compute_cooccurrences(self):
+        """Returns (repeatable, excluded), see __init__"""
+        if self.any_content:
+            return frozenset(), {}
+        count = len(self.transitions)
+        reachable = [self._reachable(state) for state in range(count)]
+        # The transitions from which we can still reach an accepting state
+        edges = [
+            (state, tagname, target)
+            for state, dic in enumerate(self.transitions)
+            for tagname, target in dic.items()
+            if reachable[target] & self.accepting
+        ]
+        # The tagnames we can read from a state, the ones we can read before
+        # reaching it and the states before and after each tagname
+        out_names = [set() for state in range(count)]
+        in_names = [set() for state in range(count)]
+        sides = dict((tagname, (set(), set())) for tagname in self.alphabet)
+        for state, tagname, target in edges:
+            out_names[state].add(tagname)
+            sides[tagname][0].add(state)
+            sides[tagname][1].add(target)
+            for s in reachable[target]:
+                in_names[s].add(tagname)
+        after = [
+            frozenset().union(*[out_names[s] for s in reachable[state]])
+            for state in range(count)
+        ]
+        # The tagnames of a repeated choice share the same states, compute
+        # once what we can read with them
+        computed = {}
+        repeatable = set()
+        excluded = {}
+        for tagname, (states, targets) in sides.items():
+            key = (frozenset(states), frozenset(targets))
+            value = computed.get(key)
+            if value is None:
+                together = frozenset().union(
+                    *([in_names[s] for s in states] + [after[t] for t in targets])
+                )
+                value = computed[key] = (together, self.alphabet - together)
+            together, missing = value
+            if tagname in together:
+                repeatable.add(tagname)
+            names = missing - {tagname}
+            if names:
+                excluded[tagname] = names
+        return repeatable, excluded
+
+    def next_state(self, state, tagname):
+        """Returns the next state or None if tagname is not allowed"""
+        if self.any_content:
+            return 0
+        return self.transitions[state].get(tagname)
+
+    def run(self, tagnames):
+        """Returns the state after reading tagnames or None"""
+        state = 0
+        for tagname in tagnames:
+            state = self.next_state(state, tagname)
+            if state is None:
+                return None
+        return state
+
+    def accepts(self, tagnames):
+        state = self.run(tagnames)
+        return state is not None and state in self.accepting
+
+    def allowed(self, tagnames):
+        """The tagnames allowed after the given sequence"""
+        state = self.run(tagnames)
+        if state is None:
+            return frozenset()
+        return frozenset(self.transitions[state])
+
+    def check_addable(self, tagnames, tagname):
+        """Raise an exception when tagname can't be added to the children
+        with the given tagnames. The order is not checked: the children are
+        added in any order."""
+        if tagname not in self.alphabet:
+            return
+        if tagname not in self.repeatable and tagname in tagnames:
+            raise Exception("%s is already defined" % tagname)
+        for name in self.excluded.get(tagname, ()):
+            if name in tagnames:
+                raise Exception("%s is defined so you can't add %s" % (name, tagname))
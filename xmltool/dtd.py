@@ -1,26 +1,161 @@
+from collections import OrderedDict
 from io import StringIO, open
 from dogpile.cache.api import NO_VALUE
 from lxml import etree
 import os
-import requests
-import tempfile
+import re
+import threading
 
 
 from . import dtd_parser
 from . import cache
+from . import fetch
+from . import schema
 
 
 class ValidationError(Exception):
     pass
 
 
+# The number of compiled lxml dtds we keep
+VALIDATORS_MAX_SIZE = 32
+
+# The compiled lxml dtds by the hash of their content. Only the valid dtds
+# are stored so we don't need to validate them again. The error log of a
+# validator can't be shared between threads, each thread has its validators.
+_local_validators = threading.local()
+# Increased by clear_validators to clear the validators of all the threads
+_validators_generation = 0
+
+# When there is no cache timeout, the dtd contents by (filename, mtime, size)
+# and the parsed classes by content hash. A modified file gives a new key.
+_memoized_contents = cache.LRUDict(cache.MEMO_MAX_SIZE)
+_memoized_classes = cache.LRUDict(cache.MEMO_MAX_SIZE)
+
+# The empty document used to compile a dtd, its system url is resolved to
+# the dtd content.
+DTD_SYSTEM_URL = "xmltool-dtd:content"
+DTD_DOCUMENT = (
+    '<!DOCTYPE xmltool-dtd SYSTEM "%s"><xmltool-dtd/>' % DTD_SYSTEM_URL
+).encode("utf-8")
+
+url_regex_compile = re.compile(r"^[a-zA-Z][a-zA-Z0-9+.-]*://")
+
+
+def _get_validators():
+    """The validators of the current thread"""
+    validators = getattr(_local_validators, "validators", None)
+    if validators is None or _local_validators.generation != _validators_generation:
+        validators = _local_validators.validators = OrderedDict()
+        _local_validators.generation = _validators_generation
+    return validators
+
+
+def _get_cached_validator(key):
+    validators = _get_validators()
+    validator = validators.get(key)
+    if validator is not None:
+        validators.move_to_end(key)
+    return validator
+
+
+def _cache_validator(key, validator):
+    validators = _get_validators()
+    validators[key] = validator
+    validators.move_to_end(key)
+    while len(validators) > VALIDATORS_MAX_SIZE:
+        validators.popitem(last=False)
+
+
+def clear_validators():
+    global _validators_generation
+    _validators_generation += 1
+
+
+def clear_memoized():
+    _memoized_contents.clear()
+    _memoized_classes.clear()
+
+
+class _DTDResolver(etree.Resolver):
+    """Give the dtd content to lxml and resolve its relative external entities
+    from the given path"""
+
+    def __init__(self, content, path=None):
+        super(_DTDResolver, self).__init__()
+        self.content = content
+        self.path = path
+
+    def resolve(self, system_url, public_id, context):
+        if system_url == DTD_SYSTEM_URL:
+            # TODO: Get encoding from the dtd file (xml tag).
+            return self.resolve_string(self.content.encode("utf-8"), context)
+        if (
+            not self.path
+            or not system_url
+            or os.path.isabs(system_url)
+            or url_regex_compile.match(system_url)
+        ):
+            return None
+        return self.resolve_filename(os.path.join(self.path, system_url), context)
+
+
+def compile_validator(content, path=None):
+    """Compile the dtd content with lxml
+
+    The dtd is compiled in memory as the external subset of an empty
+    document: etree.DTD doesn't report the validity errors like the multiple
+    ID attributes when it reads a StringIO. The relative external entities
+    are loaded from path.
+
+    It raises a ValidationError exception when the dtd is not valid and
+    etree.DTDParseError when it's unparsable
+    """
+    parser = etree.XMLParser(load_dtd=True, resolve_entities=True)
+    parser.resolvers.add(_DTDResolver(content, path))
+    try:
+        tree = etree.fromstring(DTD_DOCUMENT, parser).getroottree()
+    except etree.XMLSyntaxError as e:
+        errors = parser.error_log.filter_domains([etree.ErrorDomains.VALID])
+        if errors:
+            raise ValidationError(errors)
+        raise etree.DTDParseError(str(e))
+    return tree.docinfo.externalDTD
+
+
+def get_validator(content, path=None):
+    """The compiled lxml dtd of the given content, it's only compiled once
+    by thread"""
+    key = _validator_key(content, path)
+    validator = _get_cached_validator(key)
+    if validator is None:
+        validator = compile_validator(content, path)
+        _cache_validator(key, validator)
+    return validator
+
+
+def _validator_key(content, path):
+    # The same dtd can load different entities according to its path
+    if path:
+        content = "%s\0%s" % (path, content)
+    return schema.content_hash(content)
+
+
 class DTD(object):
-    def __init__(self, url, path=None):
+    def __init__(self, url, path=None, lazy=False):
         """
         url: the url to get the dtd, it can be http or filesystem resources
         path is used in case the dtd use relative filesystem path
+        lazy: parse returns a mapping which creates the classes on first access
         """
         self._parsed_dict = None
+        # False when the server said the dtd was not modified since our last
+        # fetch
+        self._modified = True
+        # True while we create the classes in the cache
+        self._creating = False
+        self.path = path
+        self.lazy = lazy
         if isinstance(url, StringIO):
             self.url = None
             # set _content and validation
@@ -29,7 +164,6 @@ class DTD(object):
             self.validate()
         else:
             self.url = url
-            self.path = path
             self._content = None
 
     def _get_dtd_url(self):
@@ -45,13 +179,20 @@ class DTD(object):
             url = os.path.join(self.path, self.url)
         return url
 
+    def _get_entities_path(self):
+        """The directory used to load the relative external entities"""
+        if not self.url or url_regex_compile.match(self.url):
+            return self.path
+        return os.path.dirname(self._get_dtd_url()) or self.path
+
     def _fetch(self):
         """Fetch the dtd content"""
         url = self._get_dtd_url()
+        self._modified = True
         if url.startswith("http://") or url.startswith("https://"):
-            res = requests.get(url, timeout=5)
-            # Use res.text to have str
-            self._content = res.text
+            response = fetch.fetch(url)
+            self._modified = response.modified
+            self._content = response.content
         else:
             # TODO: Get encoding from the dtd file (xml tag).
             self._content = open(url, "r").read()
@@ -63,16 +204,36 @@ class DTD(object):
         if self._content:
             return self._content
         if cache.CACHE_TIMEOUT is None:
-            return self._fetch()
+            return self._get_memoized_content()
 
         assert self.url
         cache_key = "xmltool.get_dtd_content.%s" % (self._get_dtd_url())
-        value = cache.region.get(cache_key, cache.CACHE_TIMEOUT)
-        if value is not NO_VALUE:
-            return value
+        self._content = cache.region.get_or_create(
+            cache_key, self._create_content, cache.CACHE_TIMEOUT
+        )
+        return self._content
+
+    def _get_memoized_content(self):
+        url = self._get_dtd_url()
+        if url_regex_compile.match(url):
+            # The remote dtds are revalidated with the server, see fetch
+            return self._fetch()
+        try:
+            stat = os.stat(url)
+        except OSError:
+            # _fetch raises the error
+            return self._fetch()
+        key = (os.path.abspath(url), stat.st_mtime_ns, stat.st_size)
+        content = _memoized_contents.get(key)
+        if content is None:
+            content = self._fetch()
+            _memoized_contents.set(key, content)
+        self._content = content
+        return content
+
+    def _create_content(self):
         content = self._fetch()
         self.validate()
-        cache.region.set(cache_key, content)
         return content
 
     def validate(self):
@@ -81,53 +242,104 @@ class DTD(object):
         It raises a ValidationError exception when not valid
         It also can raise etree.ParseError if the dtd is unparsable
         """
+        self.get_validator()
+
+    def get_validator(self):
+        """The compiled lxml dtd used to validate the XML
+
+        The dtd is validated when it's not already in the cache of the
+        validators.
+        """
         # Be careful when getting the content we can have a recursive loop
         # since we validate the dtd when getting it. But we also want to be
         # able to validate a dtd before we fetch the content.
         content = self._content if self._content else self.content
-        f, filename = tempfile.mkstemp()
-        # Don't know why but the validation doesn't work using a StringIO so we
-        # write a temporary file
-        try:
-            try:
-                # TODO: Get encoding from the dtd file (xml tag).
-                os.write(f, content.encode("utf-8"))
-            finally:
-                os.close(f)
-            dtd_obj = etree.DTD(filename)
-        finally:
-            os.remove(filename)
+        path = self._get_entities_path()
+        key = _validator_key(content, path)
+        validator = _get_cached_validator(key)
+        if validator is not None:
+            return validator
 
-        if dtd_obj.error_log:
-            raise ValidationError(dtd_obj.error_log)
+        validator = compile_validator(content, path)
         # It can raise an exception if something is wrong in the dtd
         # For example, etree.DTD doesn't raise exception if a sub element is
-        # not defined, self.parse does.
-        self.parse()
+        # not defined, self.parse does. When we are already creating the
+        # classes, the creation will raise.
+        if not self._creating:
+            self.parse()
+        _cache_validator(key, validator)
+        return validator
 
     def _parse(self):
+        schema_dir = cache.get_schema_dir()
+        if schema_dir:
+            # Don't parse the dtd if we have its compiled schema on disk
+            compiled = schema.SchemaStore(schema_dir).get_or_compile(self.content)
+            if self.lazy:
+                self._parsed_dict = dtd_parser.LazyClassDict(
+                    schema=compiled["elements"]
+                )
+            else:
+                self._parsed_dict = schema.build_classes(compiled)
+            return self._parsed_dict
         dtd_dict = dtd_parser.dtd_to_dict_v2(self.content)
-        self._parsed_dict = dtd_parser._create_classes(dtd_dict)
+        if self.lazy:
+            self._parsed_dict = dtd_parser.LazyClassDict(dtd_dict=dtd_dict)
+        else:
+            self._parsed_dict = dtd_parser._create_classes(dtd_dict)
         return self._parsed_dict
 
+    def _parse_cache_key(self):
+        if not self.url:
+            return None
+        # Same url as the content: the relative dtds are resolved
+        cache_key = "xmltool.parse.%s" % self._get_dtd_url()
+        if self.lazy:
+            cache_key += ".lazy"
+        return cache_key
+
+    def _get_memoized_classes(self):
+        key = (schema.content_hash(self.content), self.lazy, cache.get_schema_dir())
+        value = _memoized_classes.get(key)
+        if value is None:
+            value = self._parse()
+            _memoized_classes.set(key, value)
+        self._parsed_dict = value
+        return value
+
     def parse(self):
         if self._parsed_dict:
             return self._parsed_dict
 
         if cache.CACHE_TIMEOUT is None:
-            return self._parse()
-
-        cache_key = "xmltool.parse.%s" % self.url if self.url else None
+            return self._get_memoized_classes()
 
+        cache_key = self._parse_cache_key()
         if not cache_key:
             return self._parse()
 
-        value = cache.region.get(cache_key, cache.CACHE_TIMEOUT)
-        if value is not NO_VALUE:
-            return value
-        value = self._parse()
-        cache.region.set(cache_key, value)
-        return value
+        # Get the content before the lock of the classes: the creation of the
+        # content parses the dtd, so the locks are always taken in the same
+        # order.
+        self.content
+        # Only one thread parses the dtd, the others wait for its classes
+        return cache.region.get_or_create(
+            cache_key, lambda: self._create_parsed(cache_key), cache.CACHE_TIMEOUT
+        )
+
+    def _create_parsed(self, cache_key):
+        self._creating = True
+        try:
+            # The content is got before parsing (see parse): the server can
+            # say the dtd didn't change, in this case we keep the expired
+            # parsed classes.
+            if not self._modified:
+                value = cache.region.get(cache_key, ignore_expiration=True)
+                if value is not NO_VALUE:
+                    return value
+            return self._parse()
+        finally:
+            self._creating = False
 
     def validate_xml(self, xml_obj):
         """Validate an XML object
@@ -139,9 +351,6 @@ class DTD(object):
         :return: True. Raise an exception if the XML is not valid
         :rtype: bool
         """
-        # Make sure the dtd is valid
-        self.validate()
-        # We should cache the etree.DTD in the object
-        dtd_obj = etree.DTD(StringIO(self.content))
-        dtd_obj.assertValid(xml_obj)
+        # Make sure the dtd is valid, the validator is compiled once
+        self.get_validator().assertValid(xml_obj)
         return True
@@ -1,4 +1,9 @@
+from collections.abc import Mapping
+from functools import lru_cache
 import re
+import threading
+from types import MappingProxyType
+from . import content_model
 from .elements import (
     ContainerElement,
     TextElement,
@@ -10,12 +15,26 @@ from .elements import (
 )
 from dogpile.cache.api import NO_VALUE
 
-
-comment_regex_compile = re.compile(r"<!--(.*?)-->", re.DOTALL)
-tag_regex_compile = re.compile(r"<!(?P<type>[A-Z]+)(.*?)>", re.DOTALL)
-element_regex_compile = re.compile(r" *(?P<name>[^( ]+) *\((?P<elements>.+)\)")
+# Match in one scan either a comment or a declaration. The declaration body
+# can contain quoted literals, so a '>' inside quotes doesn't close it. Each
+# repetition starts with a quote so a declaration fails without backtracking.
+# The last alternative matches the start of an unterminated comment or
+# declaration: the scan stops there instead of trying the next starts.
+declaration_regex_compile = re.compile(
+    r"<!--.*?-->"
+    r"|<!(?P<type>[A-Z]+)"
+    r"(?P<value>[^>\"']*(?:(?:\"[^\"]*\"|'[^']*')[^>\"']*)*)>"
+    r"|(?P<unterminated><!(?:--|[A-Z]))",
+    re.DOTALL,
+)
+element_regex_compile = re.compile(
+    r" *(?P<name>[^( ]+) *\((?P<elements>.+)\) *(?P<occurrence>[?*+]?)"
+)
 empty_element_regex_compile = re.compile(r" *(?P<name>[^( ]+) *(?P<elements>.+)")
-entity_regex_compile = re.compile(r' *(?P<name>% *[^" ]+?) *"(?P<elements>.+)"')
+entity_regex_compile = re.compile(
+    r' *(?P<name>% *[^"\' ]+?) *(?P<quote>["\'])(?P<elements>.*)(?P=quote)'
+)
+entity_reference_regex_compile = re.compile(r"%([^;%\s]+);")
 
 
 def cleanup(value):
@@ -26,11 +45,16 @@ def cleanup(value):
 
 def parse_element(value):
     matchobj = element_regex_compile.match(value)
-    if not matchobj:
+    if matchobj:
+        name, elements, occurrence = matchobj.groups()
+        if occurrence:
+            # Keep the occurrence of the whole group: '(a|b)*'
+            elements = "(%s)%s" % (elements, occurrence)
+    else:
         matchobj = empty_element_regex_compile.match(value)
-    if not matchobj:
-        raise Exception("Error parsing element %s" % value)
-    name, elements = matchobj.groups()
+        if not matchobj:
+            raise Exception("Error parsing element %s" % value)
+        name, elements = matchobj.groups()
     if elements.count(")") != elements.count("("):
         raise Exception("Unbalanced parenthesis %s" % value)
     return name, elements.replace(" ", "")
@@ -40,7 +64,7 @@ def parse_entity(value):
     matchobj = entity_regex_compile.match(value)
     if not matchobj:
         raise Exception("Error parsing entity %s" % value)
-    name, elements = matchobj.groups()
+    name, _, elements = matchobj.groups()
     return name.replace(" ", ""), elements.replace(" ", "")
 
 
@@ -61,14 +85,69 @@ def parse_attribute(value):
     return name, attributes
 
 
+class EntityResolver(object):
+    """Expand the parameter entities of a dtd.
+
+    Each entity is expanded once (the entities referencing other entities
+    included) and the result is kept.
+    """
+
+    def __init__(self, entities):
+        # The entity names are stored with the '%' like '%person'
+        self.entities = entities
+        self._resolved = {}
+        self._resolving = set()
+
+    def resolve(self, name):
+        """Returns the fully expanded value of the given entity"""
+        value = self._resolved.get(name)
+        if value is not None:
+            return value
+        if name in self._resolving:
+            raise Exception("Recursive entity %s" % name)
+        self._resolving.add(name)
+        try:
+            value = self.expand(self.entities[name])
+        finally:
+            self._resolving.discard(name)
+        self._resolved[name] = value
+        return value
+
+    def _replace(self, matchobj):
+        name = "%" + matchobj.group(1)
+        if name not in self.entities:
+            # Keep the unknown references as is
+            return matchobj.group(0)
+        return self.resolve(name)
+
+    def expand(self, value):
+        """Replace all the entity references of value in one scan"""
+        if "%" not in value:
+            return value
+        return entity_reference_regex_compile.sub(self._replace, value)
+
+
+def iter_declarations(dtd):
+    """Scan the dtd once and yield the (type, value) of each declaration.
+
+    The comments are skipped and the quoted literals are kept as is. The scan
+    stops at an unterminated comment or declaration.
+    """
+    for matchobj in declaration_regex_compile.finditer(dtd):
+        element, value, unterminated = matchobj.groups()
+        if unterminated:
+            return
+        if not element:
+            # It's a comment
+            continue
+        yield element, value
+
+
 def dtd_to_dict_v2(dtd):
     dtd_entities = {}
     dtd_attributes = {}
     dtd_elements = {}
-    # Removed the comments
-    res = comment_regex_compile.sub("", dtd)
-    tags = tag_regex_compile.findall(res)
-    for element, value in tags:
+    for element, value in iter_declarations(dtd):
         clean_value = cleanup(value)
         if element == "ELEMENT":
             tagname, elements = parse_element(clean_value)
@@ -82,44 +161,53 @@ def dtd_to_dict_v2(dtd):
         else:
             raise Exception("%s is not supported" % element)
 
+    resolver = EntityResolver(dtd_entities)
     dic = {}
     for tagname, elements in dtd_elements.items():
-        for key, value in dtd_entities.items():
-            elements = elements.replace("%s;" % key, value)
-        dic[tagname] = {"elts": elements, "attrs": dtd_attributes.get(tagname) or []}
+        dic[tagname] = {
+            "elts": resolver.expand(elements),
+            "attrs": dtd_attributes.get(tagname) or [],
+        }
     return dic
 
 
-def _parse_elts(elts):
-    splitted = elts.split(",")
+def _node_to_elts(node, required=True, islist=False):
+    """Convert a content model node to the tuples
+    (tagname, required, islist, conditionals) used to create the classes.
+
+    The object structure supports elements, lists and choices. The nested
+    groups which can't be represented are flattened: an optional sequence
+    makes all its elements optional and a repeated sequence is converted to a
+    list of choices. The exact content model is kept in the automaton.
+    """
+    required = required and node.required
+    islist = islist or node.islist
+    if isinstance(node, content_model.Name):
+        return [(node.name, required, islist, [])]
+
+    if node.separator == "|" or islist:
+        tagnames = node.names()
+        sub = [(tg, True, False, []) for tg in tagnames]
+        return [("_".join(tagnames), required, islist, sub)]
+
     lis = []
-    for text in splitted:
-        tagname = text
-        required = True
-        islist = False
-        if text.endswith("+"):
-            tagname = text[:-1]
-            islist = True
-        elif text.endswith("*"):
-            tagname = text[:-1]
-            islist = True
-            required = False
-        elif text.endswith("?"):
-            tagname = text[:-1]
-            required = False
-
-        if "|" not in tagname:
-            lis += [(tagname, required, islist, [])]
-        else:
-            tagname = tagname.replace("(", "").replace(")", "")
-            tagnames = tagname.split("|")
-            sub = []
-            for tg in tagnames:
-                sub += _parse_elts(tg)
-            lis += [("%s" % "_".join(tagnames), required, islist, sub)]
+    for child in node.children:
+        lis += _node_to_elts(child, required)
     return lis
 
 
+def _content_model_to_elts(node):
+    if isinstance(node, content_model.Group) and node.is_mixed:
+        # Mixed content: the sub elements can be anywhere in the text, we
+        # only support to have each of them once.
+        return [(name, False, False, []) for name in node.names()[1:]]
+    return _node_to_elts(node)
+
+
+def _parse_elts(elts):
+    return _node_to_elts(content_model.parse(elts))
+
+
 def _create_new_class(
     class_dict, name, required, islist, conditionals, inlist=False, inchoice=False
 ):
@@ -130,12 +218,29 @@ def _create_new_class(
 
     if conditionals:
         assert name
+        choice_classes = []
+        for subname, subrequired, subislist, subconditionals in conditionals:
+            assert not subconditionals, subconditionals
+            assert not subislist
+            choice_classes += [
+                _create_new_class(
+                    class_dict,
+                    subname,
+                    subrequired,
+                    subislist,
+                    subconditionals,
+                    inlist=islist,
+                    inchoice=(not islist),
+                )
+            ]
+
         if not islist:
             parent_cls = type(
                 "%sChoice" % name,
                 (ChoiceElement,),
                 {
-                    "_choice_classes": [],
+                    "__slots__": (),
+                    "_choice_classes": tuple(choice_classes),
                     "tagname": "choice__%s" % name,
                     "_required": required,
                 },
@@ -145,26 +250,16 @@ def _create_new_class(
                 "%sChoiceList" % name,
                 (ChoiceListElement,),
                 {
-                    "_choice_classes": [],
+                    "__slots__": (),
+                    "_choice_classes": tuple(choice_classes),
                     "tagname": "list__%s" % name,
                     "_required": required,
                 },
             )
-
-        for subname, subrequired, subislist, subconditionals in conditionals:
-            assert not subconditionals, subconditionals
-            assert not subislist
-            sub_cls = _create_new_class(
-                class_dict,
-                subname,
-                subrequired,
-                subislist,
-                subconditionals,
-                inlist=islist,
-                inchoice=(not islist),
-            )
+        # The classes are not published yet, nobody can see them half built
+        for sub_cls in choice_classes:
             sub_cls._parent_cls = parent_cls
-            parent_cls._choice_classes += [sub_cls]
+        _set_creatable_subclasses(parent_cls)
         return parent_cls
 
     if not islist:
@@ -175,7 +270,9 @@ def _create_new_class(
             classes = (InListMixin,)
         if inchoice:
             classes = (InChoiceMixin,)
-        return type(cls.__name__, classes + (cls,), {"_required": required})
+        return type(
+            cls.__name__, classes + (cls,), {"__slots__": (), "_required": required}
+        )
 
     # Always create a new cls to make sure _required is well defined
     newcls = type(
@@ -184,74 +281,211 @@ def _create_new_class(
             InListMixin,
             cls,
         ),
-        {"_required": required},
+        {"__slots__": (), "_required": required},
     )
 
     listcls = type(
         "%sList" % cls.__name__,
         (ListElement,),
         {
+            "__slots__": (),
             "_children_class": newcls,
             "_required": required,
             "tagname": "list__%s" % name,
         },
     )
     newcls._parent_cls = listcls
+    _set_creatable_subclasses(listcls)
     return listcls
 
 
-def _create_class_dict(dtd_dict):
+@lru_cache(maxsize=1024)
+def _compile_automaton(model):
+    """The serializable automaton of the content model, the same models like
+    '(#PCDATA)' are used by many elements so they are compiled once"""
+    node = content_model.parse(model)
+    return content_model.ContentModelAutomaton.compile(node).to_data()
+
+
+def _element_schema(dic):
+    """The declarative description of the class to create for a dtd element.
+
+    It only contains lists, dicts and strings so it can be serialized.
+    """
+    is_empty = False
+    node = content_model.parse(dic["elts"])
+    names = node.names()
+    if isinstance(node, content_model.Group) and node.is_mixed:
+        # Mixed content
+        base = "text"
+    elif names in ([content_model.PCDATA], [content_model.EMPTY]):
+        base = "text"
+        is_empty = names == [content_model.EMPTY]
+    else:
+        base = "container"
+    children = [
+        [name, required, islist, [list(c) for c in conditionals]]
+        for name, required, islist, conditionals in _content_model_to_elts(node)
+        # Text with no sub elements
+        if name not in [content_model.PCDATA, content_model.EMPTY]
+    ]
+    return {
+        "base": base,
+        "empty": is_empty,
+        "attrs": [tple[0] for tple in dic["attrs"]],
+        "automaton": _compile_automaton(content_model.to_string(node)),
+        "children": children,
+    }
+
+
+def dtd_dict_to_schema(dtd_dict):
+    """Returns the description of all the classes to create"""
+    return dict((tagname, _element_schema(dic)) for tagname, dic in dtd_dict.items())
+
+
+BASE_CLASSES = {
+    "text": TextElement,
+    "container": ContainerElement,
+}
+
+
+def _create_base_class(tagname, element):
+    return type(
+        tagname,
+        (BASE_CLASSES[element["base"]],),
+        {
+            # Only the slots of the base classes, see elements.ELEMENT_SLOTS
+            "__slots__": (),
+            "tagname": tagname,
+            "_attribute_names": tuple(element["attrs"]),
+            "children_classes": (),
+            "_is_empty": element["empty"],
+            "_automaton": content_model.ContentModelAutomaton.from_data(
+                element["automaton"]
+            ),
+        },
+    )
+
+
+def _set_creatable_subclasses(cls):
+    """Build once the read-only table used by get_class_to_create, the
+    children classes of cls should be defined"""
+    cls._creatable_subclasses = MappingProxyType(
+        cls._get_creatable_subclass_by_tagnames()
+    )
+
+
+def _create_children_classes(class_dict, cls, element):
+    lis = []
+    for name, required, islist, conditionals in element["children"]:
+        sub_cls = _create_new_class(class_dict, name, required, islist, conditionals)
+        sub_cls._parent_cls = cls
+        lis += [sub_cls]
+    return tuple(lis)
+
+
+def _create_class_dict_from_schema(schema):
     class_dict = {}
-    for tagname, dic in dtd_dict.items():
-        is_empty = False
-        lis = _parse_elts(dic["elts"])
-        if dic["elts"] in ["#PCDATA", "EMPTY"]:
-            c = TextElement
-            if dic["elts"] == "EMPTY":
-                is_empty = True
-        elif lis[0][3] and lis[0][3][0][0] in ["#PCDATA", "EMPTY"]:
-            # Special case with mixed content
-            c = TextElement
-            if lis[0][3][0][0] == "EMPTY":
-                is_empty = True
-            # TODO: find a better way to handle the mixed content
-            #
-            # Make some replacements to have the same dtd than for the children
-            # like this 'sub1, sub2'. Not sure we can have list of elements in,
-            # but it is sure it is not supported!
-            dic["elts"] = dic["elts"].replace("#PCDATA|", "")
-            dic["elts"] = dic["elts"].replace("EMPTY|", "")
-            dic["elts"] = dic["elts"].replace("|", "?,")
-            dic["elts"] = dic["elts"][1:-2] + "?"  # Remove the '*' at the end
-        else:
-            c = ContainerElement
-        cls = type(
-            tagname,
-            (c,),
-            {
-                "tagname": tagname,
-                "_attribute_names": [tple[0] for tple in dic["attrs"]],
-                "children_classes": [],
-                "_is_empty": is_empty,
-            },
-        )
-        class_dict[tagname] = cls
+    for tagname, element in schema.items():
+        class_dict[tagname] = _create_base_class(tagname, element)
     return class_dict
 
 
-def _create_classes(dtd_dict):
-    class_dict = _create_class_dict(dtd_dict)
-    for tagname, dic in dtd_dict.items():
+def _create_class_dict(dtd_dict):
+    return _create_class_dict_from_schema(dtd_dict_to_schema(dtd_dict))
+
+
+def create_classes_from_schema(schema):
+    """Create the classes from the description returned by
+    dtd_dict_to_schema
+
+    The classes are only wired together here, the returned dict is complete
+    and they are not modified after, so it can be shared between threads.
+    """
+    class_dict = _create_class_dict_from_schema(schema)
+    for tagname, element in schema.items():
         cls = class_dict[tagname]
-        lis = _parse_elts(dic["elts"])
-        for name, required, islist, conditionals in lis:
-            if name in ["#PCDATA", "EMPTY"]:
-                # Text with no sub elements
-                continue
-            sub_cls = _create_new_class(
-                class_dict, name, required, islist, conditionals
-            )
-            sub_cls._parent_cls = cls
-            cls.children_classes += [sub_cls]
+        cls.children_classes = _create_children_classes(class_dict, cls, element)
+        _set_creatable_subclasses(cls)
 
     return class_dict
+
+
+class _LazyChildrenClasses(object):
+    """Descriptor set as children_classes on the classes created by
+    LazyClassDict. The first time it's read, the children classes are created
+    and replace it.
+    """
+
+    def __init__(self, class_dict, tagname, element):
+        self.class_dict = class_dict
+        self.tagname = tagname
+        self.element = element
+
+    def __get__(self, obj, owner):
+        return self.class_dict._create_children(self.tagname)
+
+
+class LazyClassDict(Mapping):
+    """Mapping tagname -> class which creates the classes on first access.
+
+    The class of a tag is created when we get it and its children_classes
+    when we read them, so we don't pay for the part of the dtd we don't use.
+    It can be created from a dtd_dict or from a compiled schema.
+    """
+
+    def __init__(self, dtd_dict=None, schema=None):
+        assert (dtd_dict is None) != (schema is None)
+        self._dtd_dict = dtd_dict
+        self._schema = schema
+        self._classes = {}
+        # The classes are created with the lock, they are only set in
+        # self._classes or as children_classes when they are complete so we
+        # don't need the lock to read them.
+        self._lock = threading.RLock()
+
+    def _get_element(self, tagname):
+        if self._schema is not None:
+            return self._schema[tagname]
+        return _element_schema(self._dtd_dict[tagname])
+
+    def _tagnames(self):
+        return self._schema if self._schema is not None else self._dtd_dict
+
+    def __getitem__(self, tagname):
+        cls = self._classes.get(tagname)
+        if cls is not None:
+            return cls
+        with self._lock:
+            cls = self._classes.get(tagname)
+            if cls is None:
+                element = self._get_element(tagname)
+                cls = _create_base_class(tagname, element)
+                cls.children_classes = _LazyChildrenClasses(self, tagname, element)
+                self._classes[tagname] = cls
+        return cls
+
+    def _create_children(self, tagname):
+        cls = self[tagname]
+        with self._lock:
+            children = cls.__dict__["children_classes"]
+            if not isinstance(children, _LazyChildrenClasses):
+                # Already created by another thread
+                return children
+            children = _create_children_classes(self, cls, children.element)
+            cls.children_classes = children
+            _set_creatable_subclasses(cls)
+        return children
+
+    def __contains__(self, tagname):
+        return tagname in self._tagnames()
+
+    def __iter__(self):
+        return iter(self._tagnames())
+
+    def __len__(self):
+        return len(self._tagnames())
+
+
+def _create_classes(dtd_dict):
+    return create_classes_from_schema(dtd_dict_to_schema(dtd_dict))
@@ -3,6 +3,9 @@
 from io import StringIO, open
 import os
 import re
+import threading
+from types import MappingProxyType
+import weakref
 from lxml import etree
 
 
@@ -12,6 +15,11 @@ DEFAULT_ENCODING = "UTF-8"
 EOL = "\n"
 eol_regex = re.compile(r"\r?\n|\r\n?")
 
+# The skeletons by class, see Element._get_skeleton. The classes are not
+# modified once built so the skeletons are not stored on them.
+_skeletons = weakref.WeakKeyDictionary()
+_skeletons_lock = threading.Lock()
+
 
 def update_eol(text):
     """We only want EOL as end of line"""
@@ -21,17 +29,81 @@ def update_eol(text):
     return eol_regex.sub(EOL, text)
 
 
+def _iter_children_xml(xml):
+    """Yield (child, comments) for the children of xml, comments are the
+    comments of child: the ones just before it and for the last child the ones
+    after it. It's what _load_comment_from_xml finds but in one pass.
+    """
+    child = child_comments = None
+    comments = []
+    for e in xml:
+        if isinstance(e, etree._Comment):
+            comments.append(e.text)
+            continue
+        if child is not None:
+            yield child, child_comments
+        child, child_comments, comments = e, comments, []
+    if child is not None:
+        yield child, child_comments + comments
+
+
 class EmptyElement(object):
     """This object is used in the ListElement to keep the good index."""
 
+    __slots__ = ("_parent_obj", "_auto_added")
+
     def __init__(self, parent_obj):
         self._parent_obj = parent_obj
         self._auto_added = False
 
 
+def _extra_property(name, default=None):
+    """Attribute stored in the _extra dict of the object, it's used for the
+    attributes which are rarely defined so they don't take memory"""
+
+    def fget(self):
+        extra = self._extra
+        if extra is None:
+            return default
+        return extra.get(name, default)
+
+    def fset(self, value):
+        if self._extra is None:
+            if value == default:
+                return
+            self._extra = {}
+        self._extra[name] = value
+
+    return property(fget, fset)
+
+
+# The attributes of the elements. The classes which can't have slots (the
+# lists) keep them in their __dict__.
+ELEMENT_SLOTS = (
+    "_parent_obj",
+    "parent",
+    "root",
+    "_xml_elements",
+    "_auto_added",
+    "attributes",
+    "_lxml_elt",
+    "_lazy_xml",
+    "sourceline",
+    "_extra",
+)
+
+# The xml_elements of the objects without children, it's shared so it can't
+# be modified.
+NO_ELEMENTS = MappingProxyType({})
+
+
 class Element(object):
     """After reading a dtd file we construct some Element"""
 
+    # The attributes are in the slots of the subclasses, see ELEMENT_SLOTS.
+    # The generated classes should also define empty __slots__.
+    __slots__ = ()
+
     tagname = None
     _attribute_names = None
     attributes = None
@@ -39,17 +111,45 @@ class Element(object):
     _required = False
     _parent_cls = None
     sourceline = None
-    comment = None
+    comment = _extra_property("comment")
     _is_empty = False
+    # Precomputed result of _get_creatable_subclass_by_tagnames, for example
+    # defined in the modules generated by xmltool.codegen.
+    _creatable_subclasses = None
+    # The automaton of the content model, defined when the class is generated
+    # from a dtd.
+    _automaton = None
 
     # The following attributes should be used for the root element.
-    filename = None
-    dtd_url = None
-    dtd_str = None
-    encoding = None
+    filename = _extra_property("filename")
+    dtd_url = _extra_property("dtd_url")
+    dtd_str = _extra_property("dtd_str")
+    encoding = _extra_property("encoding")
+    # False when the root is loaded in streaming, the lxml elements are freed
+    # so we don't keep them in the objects.
+    _keep_lxml_elts = _extra_property("_keep_lxml_elts", True)
+    # True when the root is loaded with lazy_xml, the children of an object
+    # are loaded from its lxml element when we use them.
+    _lazy_load = _extra_property("_lazy_load", False)
+    # True when the XML is validated against the dtd, the following items
+    # of a list are attached without the checks made by add.
+    _trusted_xml = _extra_property("_trusted_xml", False)
+    # The lxml elements having a CDATA section in their text, None when we
+    # don't know them
+    _cdata_lxml_elts = _extra_property("_cdata_lxml_elts")
+    # The loaded objects by id of their lxml element, used by xpath
+    _cached_lxml_elts = _extra_property("_cached_lxml_elts")
+    # The lxml element we still need to load the children from
+    _lazy_xml = None
 
     def __init__(self, parent_obj=None, parent=None, auto_added=False, *args, **kw):
         super(Element, self).__init__(*args, **kw)
+        self.attributes = None
+        self._lxml_elt = None
+        self._lazy_xml = None
+        self.sourceline = None
+        # The rarely defined attributes, see _extra_property
+        self._extra = None
         # parent and parent_obj are differents where the element is in a list:
         # the parent_obj of the element is the list but the parent is the
         # parent of the list. It's because the ListElement is just a container
@@ -69,13 +169,22 @@ class Element(object):
         else:
             self.root = self
 
-        # Store the XML element here
-        self.xml_elements = {}
+        # Store the XML element here, the dict is created with the first one
+        self._xml_elements = None
         # Will be set to True when we add tag to render the object.  This flag
         # is used to know the object has been added by the code so we should
         # remove it in the code.
         self._auto_added = auto_added
 
+    @property
+    def xml_elements(self):
+        if self._lazy_xml is not None:
+            self._load_children_from_xml()
+        xml_elements = self._xml_elements
+        if xml_elements is None:
+            return NO_ELEMENTS
+        return xml_elements
+
     @property
     def position(self):
         """If the parent is a list, returns the position of self.
@@ -103,7 +212,10 @@ class Element(object):
     @classmethod
     def get_class_to_create(cls, tagname):
         """Returns the class to create according to the given tagname"""
-        return cls._get_creatable_subclass_by_tagnames().get(tagname)
+        table = cls._creatable_subclasses
+        if table is None:
+            table = cls._get_creatable_subclass_by_tagnames()
+        return table.get(tagname)
 
     @classmethod
     def _get_value_from_parent(cls, parent_obj):
@@ -167,11 +279,28 @@ class Element(object):
             obj.set_text(value)
         return obj
 
+    @classmethod
+    def _attach(cls, parent_obj):
+        """Create the object in parent_obj without checking it can be added,
+        the caller already knows it's valid"""
+        return cls(parent_obj)
+
+    @classmethod
+    def _check_content_model(cls, obj, tagname):
+        """Check the content model of obj allows tagname with the children
+        of obj"""
+        if obj._automaton is not None:
+            obj._automaton.check_addable(obj, tagname)
+
     @classmethod
     def _check_addable(cls, obj, tagname):
         """Check if the given tagname is addable to the given obj"""
         if tagname in obj:
             raise Exception("%s is already defined" % tagname)
+        automaton = obj._automaton
+        if automaton is not None and tagname in automaton.excluded:
+            # The content model can't have tagname with some other children
+            automaton.check_addable(obj, tagname)
 
     def is_addable(self, tagname):
         """Check if the given tagname can be added to the object"""
@@ -185,6 +314,127 @@ class Element(object):
             pass
         return False
 
+    @classmethod
+    def required_tagnames(cls):
+        """The tagnames of the children required by the content model"""
+        if cls._automaton is not None:
+            return cls._automaton.required
+        names = set()
+        for c in cls.children_classes:
+            if c._required and not issubclass(c, MultipleMixin):
+                if issubclass(c, BaseListElement):
+                    # A required list needs one item
+                    c = c._children_class
+                names.add(c.tagname)
+        return frozenset(names)
+
+    @classmethod
+    def _get_skeleton(cls):
+        """The required descendants of the class as nested tuples
+        ((class, skeleton), ...), it's the minimal valid content. They are
+        created by factory.create with skeleton=True.
+
+        The choices are not in the skeleton since we can't know which one to
+        create. The skeleton is computed once by class.
+        """
+        with _skeletons_lock:
+            skeleton = _skeletons.get(cls)
+        if skeleton is None:
+            skeleton = cls._build_skeleton(())
+            with _skeletons_lock:
+                _skeletons[cls] = skeleton
+        return skeleton
+
+    @classmethod
+    def _build_skeleton(cls, path):
+        """The skeleton of the class under the tagnames of path, a recursive
+        dtd is cut at the first tagname already in the path"""
+        path = path + (cls.tagname,)
+        skeleton = []
+        required = cls.required_tagnames()
+        for c in cls.children_classes:
+            if issubclass(c, MultipleMixin):
+                continue
+            if issubclass(c, BaseListElement):
+                # A required list needs one item
+                c = c._children_class
+            if c.tagname not in required:
+                continue
+            if c.tagname in path:
+                # A recursive dtd, we can't create an infinite skeleton
+                continue
+            skeleton += [(c, c._build_skeleton(path))]
+        return tuple(skeleton)
+
+    def _add_skeleton(self):
+        """Create the required descendants of the object"""
+        todo = [(self, self._get_skeleton())]
+        while todo:
+            parent_obj, skeleton = todo.pop()
+            for cls, sub_skeleton in skeleton:
+                obj = cls._attach(parent_obj)
+                if sub_skeleton:
+                    todo += [(obj, sub_skeleton)]
+
+    def _copy_values(self, obj):
+        """Copy the values of self which are not children to obj"""
+        if self.attributes:
+            obj.attributes = dict(self.attributes)
+        obj.comment = self.comment
+        obj.sourceline = self.sourceline
+
+    def _clone_children_into(self, obj):
+        """Copy the descendants of self in obj, obj has the same tagname"""
+        todo = [(self, obj)]
+        while todo:
+            src, dst = todo.pop()
+            for child in src.children:
+                if isinstance(child, EmptyElement) or child._auto_added:
+                    continue
+                cls = dst.get_class_to_create(child.tagname)
+                if cls is None:
+                    raise Exception("Invalid child %s" % child.tagname)
+                new = cls._attach(dst)
+                child._copy_values(new)
+                todo += [(child, new)]
+
+    def clone(self):
+        """Copy the object and its descendants without going through lxml.
+        The copy has no parent, the copy of a root keeps its filename and
+        dtd."""
+        obj = self.__class__()
+        self._copy_values(obj)
+        if self._parent_obj is None:
+            obj.filename = self.filename
+            obj.dtd_url = self.dtd_url
+            obj.dtd_str = self.dtd_str
+            obj.encoding = self.encoding
+        self._clone_children_into(obj)
+        return obj
+
+    def clone_into(self, parent_obj):
+        """Copy the object and its descendants as a child of parent_obj, it
+        can be in another document"""
+        if isinstance(parent_obj, (BaseListElement, ChoiceElement)):
+            # The logic to add Element to a list or a choice is on the parent
+            parent_obj = parent_obj._parent_obj
+        cls = parent_obj.get_class_to_create(self.tagname)
+        if cls is None:
+            raise Exception("Invalid child %s" % self.tagname)
+        # May raise an exception
+        cls._check_addable(parent_obj, self.tagname)
+        obj = cls._attach(parent_obj)
+        self._copy_values(obj)
+        self._clone_children_into(obj)
+        return obj
+
+    def has_valid_children(self):
+        """Check the children of the object are allowed by the content
+        model"""
+        if self._automaton is None:
+            return True
+        return self._automaton.accepts([c.tagname for c in self.children])
+
     def add(self, tagname, value=None, index=None):
         cls = self.get_class_to_create(tagname)
         if cls is None:
@@ -214,6 +464,12 @@ class Element(object):
         self.attributes[name] = value
 
     def _load_attributes_from_xml(self, xml):
+        if not len(xml.attrib):
+            return
+        if self.root._trusted_xml:
+            # The dtd allows the attributes
+            self.attributes = dict(xml.attrib)
+            return
         for k, v in xml.attrib.items():
             self.add_attribute(k, v)
 
@@ -255,28 +511,76 @@ class Element(object):
         elt = etree.Comment(update_eol(self.comment))
         xml.addprevious(elt)
 
-    def _load_extra_from_xml(self, xml):
+    def _load_extra_from_xml(self, xml, comments=None):
         self._load_attributes_from_xml(xml)
-        self._load_comment_from_xml(xml)
+        if comments is None:
+            self._load_comment_from_xml(xml)
+        else:
+            # Already read by the parent
+            self.comment = "\n".join(comments) or None
         self.sourceline = xml.sourceline
 
     def set_lxml_elt(self, xml):
+        if not self.root._keep_lxml_elts:
+            return
         self._lxml_elt = xml
-        d = getattr(self.root, "_cached_lxml_elts", None)
+        d = self.root._cached_lxml_elts
         if not d:
             d = {}
             self.root._cached_lxml_elts = d
         d[id(xml)] = self
 
-    def load_from_xml(self, xml):
+    def load_from_xml(self, xml, comments=None):
+        """Load the XML element xml
+
+        :param comments: the comments of xml, by default we look at its
+                         siblings to find them
+        """
         self.set_lxml_elt(xml)
-        self._load_extra_from_xml(xml)
-        for child in xml:
-            if isinstance(child, etree._Comment):
-                # The comments are loaded when we load the object
-                continue
+        self._load_extra_from_xml(xml, comments)
+        if self.root._lazy_load:
+            # The children are loaded when we use them
+            self._lazy_xml = xml
+            return
+        self._load_children_from_xml(xml)
+
+    def _load_children_from_xml(self, xml=None):
+        if xml is None:
+            xml = self._lazy_xml
+            self._lazy_xml = None
+        if self.root._trusted_xml:
+            self._attach_children_from_xml(xml)
+            return
+        for child, comments in _iter_children_xml(xml):
             obj = self.add(child.tag)
-            obj.load_from_xml(child)
+            obj.load_from_xml(child, comments)
+
+    def _attach_children_from_xml(self, xml):
+        """Load the children of a validated XML: the following items of a
+        list are attached without the checks of add.
+
+        The other children are still checked, the object model is flatter
+        than the dtd: a valid XML can have a child twice.
+        """
+        table = self._creatable_subclasses
+        if table is None:
+            table = self._get_creatable_subclass_by_tagnames()
+        # The items of a list follow each other, we keep the last list
+        list_cls = list_obj = None
+        for child, comments in _iter_children_xml(xml):
+            cls = table.get(child.tag)
+            if cls is None:
+                raise Exception("Invalid child %s" % child.tag)
+            if cls is list_cls:
+                obj = cls(parent_obj=list_obj, parent=self)
+                list_obj.append(obj)
+            else:
+                # May raise an exception
+                cls._check_addable(self, child.tag)
+                obj = cls._attach(self)
+                if isinstance(obj, InListMixin):
+                    list_cls, list_obj = cls, obj._parent_obj
+            obj.load_from_xml(child, comments)
 
     def to_xml(self):
         xml = etree.Element(self.tagname)
@@ -306,7 +610,11 @@ class Element(object):
     def __setitem__(self, tagname, value):
         # TODO: Perhaps we should check the value type and if the tagname is
         # allowed
-        self.xml_elements[tagname] = value
+        if self._lazy_xml is not None:
+            self._load_children_from_xml()
+        if self._xml_elements is None:
+            self._xml_elements = {}
+        self._xml_elements[tagname] = value
 
     def __getitem__(self, tagname):
         v = self.xml_elements.get(tagname)
@@ -315,7 +623,9 @@ class Element(object):
         return v
 
     def __delitem__(self, tagname):
-        del self.xml_elements[tagname]
+        if tagname not in self.xml_elements:
+            raise KeyError(tagname)
+        del self._xml_elements[tagname]
 
     def __contains__(self, tagname):
         return tagname in self.xml_elements
@@ -395,11 +705,15 @@ class Element(object):
         open(filename, "wb").write(xml_str)
 
     def xpath(self, xpath):
-        lxml_elt = getattr(self, "_lxml_elt", None)
+        lxml_elt = self._lxml_elt
         if lxml_elt is None:
             raise Exception(
                 "The xpath is only supported " "when the object is loaded from XML"
             )
+        if self.root._lazy_load:
+            # Load all the objects, we don't know which ones we will get
+            for elt in self.root.walk():
+                pass
         lis = self._lxml_elt.xpath(xpath)
         o = []
         for res in lis:
@@ -412,12 +726,16 @@ class Element(object):
 
 
 class ContainerElement(Element):
-    pass
+    __slots__ = ELEMENT_SLOTS
 
 
 class TextElement(Element):
-    text = None
-    cdata = False
+    __slots__ = ELEMENT_SLOTS + ("text", "cdata")
+
+    def __init__(self, *args, **kw):
+        self.text = None
+        self.cdata = False
+        super(TextElement, self).__init__(*args, **kw)
 
     def __repr__(self):
         return '<TextElement %s "%s">' % (self.tagname, (self.text or "").strip())
@@ -425,42 +743,38 @@ class TextElement(Element):
     def set_text(self, value):
         self.text = value
 
-    def load_from_xml(self, xml):
+    def _copy_values(self, obj):
+        super(TextElement, self)._copy_values(obj)
+        obj.text = self.text
+        obj.cdata = self.cdata
+
+    def load_from_xml(self, xml, comments=None):
         """
         TODO: we should support to have sub element in TextElement
         """
         self.set_lxml_elt(xml)
-        self._load_extra_from_xml(xml)
+        self._load_extra_from_xml(xml, comments)
         if len(xml):
             # Special case: we have comments in the text element
-            # Since on iteration we only get comment elements, we parse in 2
-            # steps.
-            self.text = ""
-
-            # Get the comments
-            comments = []
-            for e in xml:
-                if isinstance(e, etree._Comment):
-                    comments += [e.text]
+            comments = [e.text for e in xml if isinstance(e, etree._Comment)]
             if comments:
                 self.comment = self.comment or ""
                 if self.comment:
                     self.comment += "\n"
                 self.comment += "\n".join(comments)
 
-            for s in xml.itertext():
-                if s in comments:
-                    comments.remove(s)
-                    continue
-                # Don't support CDATA here, since it's a bit strange, we
-                # already have comments with the text
-                self.text += s
+            # The text without the comments, it's what we get from the
+            # elements. Don't support CDATA here, since it's a bit strange, we
+            # already have comments with the text
+            self.text = "".join(xml.itertext(etree.Element))
         else:
-            # Didn't find any other way to detect CDATA. This way is not ideal
-            # but it's working for simple case. Also it doesn't support mixed
-            # content (text + CDATA) in the same element
             self.text = xml.text
-            if etree.tostring(xml).split(b">")[1].startswith(b"<![CDATA["):
+            cdata_elts = self.root._cdata_lxml_elts
+            if cdata_elts is not None:
+                self.cdata = xml in cdata_elts
+            elif b"<![CDATA[" in etree.tostring(xml, with_tail=False):
+                # The source is unknown. xml has no child, the CDATA can only
+                # be in its text.
                 self.cdata = True
 
         # We should have text != None to be sure we keep the existing empty tag.
@@ -485,6 +799,8 @@ class TextElement(Element):
 
 
 class InChoiceMixin(object):
+    __slots__ = ()
+
     @classmethod
     def _create(cls, tagname, parent_obj, value=None, index=None):
         choice_parent_obj = parent_obj.get_or_add(cls._parent_cls.tagname)
@@ -500,6 +816,16 @@ class InChoiceMixin(object):
             obj.set_text(value)
         return obj
 
+    @classmethod
+    def _attach(cls, parent_obj):
+        choice_parent_obj = parent_obj.get(cls._parent_cls.tagname)
+        if choice_parent_obj is None:
+            choice_parent_obj = cls._parent_cls(parent_obj)
+        obj = cls(parent_obj=choice_parent_obj, parent=parent_obj)
+        choice_parent_obj._value = obj
+        parent_obj[obj.tagname] = obj
+        return obj
+
     @classmethod
     def _check_addable(cls, obj, tagname):
         """Check if the given tagname is addable to the given obj"""
@@ -510,6 +836,8 @@ class InChoiceMixin(object):
 
 
 class InListMixin(object):
+    __slots__ = ()
+
     @classmethod
     def _create(cls, tagname, parent_obj, value=None, index=None):
         # Make sure the parent list is create and get it.
@@ -523,18 +851,30 @@ class InListMixin(object):
             obj.set_text(value)
         return obj
 
+    @classmethod
+    def _attach(cls, parent_obj):
+        list_parent_obj = parent_obj.get(cls._parent_cls.tagname)
+        if list_parent_obj is None:
+            list_parent_obj = cls._parent_cls(parent_obj)
+        obj = cls(parent_obj=list_parent_obj, parent=parent_obj)
+        list_parent_obj.append(obj)
+        return obj
+
     @classmethod
     def _check_addable(cls, obj, tagname):
         """Check if the given tagname is addable to the given obj"""
-        # TODO: perhaps we have some check to do here
-        # We can always add an element to a list.
-        pass
+        # We can always add an element to a list when the content model
+        # allows it.
+        cls._check_content_model(obj, tagname)
 
     def delete(self):
         self._parent_obj.remove(self)
 
 
 class BaseListElement(list, Element):
+    # list can't be combined with slots, the attributes of the lists are in
+    # their __dict__
+
     def __init__(self, *args, **kw):
         # We only want to call the __init__ from Element since the __init__
         # with parameter from list wants to append an element to self
@@ -563,8 +903,9 @@ class BaseListElement(list, Element):
     @classmethod
     def _check_addable(cls, obj, tagname):
         """Check if the given tagname is addable to the given obj"""
-        # We can always add an element to a list.
-        pass
+        # We can always add an element to a list when the content model
+        # allows it.
+        cls._check_content_model(obj, tagname)
 
     @classmethod
     def _create(cls, tagname, parent_obj, value=None, index=None):
@@ -588,6 +929,21 @@ class BaseListElement(list, Element):
         # The logic to add Element to a list is on the parent
         return self._parent_obj.add(*args, **kw)
 
+    def clone(self):
+        raise Exception("Can't clone a list, clone its items")
+
+    def clone_into(self, parent_obj):
+        """Copy the items of the list in parent_obj, returns the list of
+        parent_obj or None when there is no item"""
+        obj = None
+        for e in self:
+            if isinstance(e, EmptyElement) or e._auto_added:
+                continue
+            obj = e.clone_into(parent_obj)
+        if obj is None:
+            return None
+        return obj._parent_obj
+
     def get_or_add(self, tagname, value=None, index=None):
         if index is None:
             raise Exception("Parameter index is required")
@@ -662,6 +1018,7 @@ class ListElement(BaseListElement):
 
 
 class MultipleMixin(object):
+    __slots__ = ()
     _choice_classes = None
 
     @classmethod
@@ -686,8 +1043,11 @@ class ChoiceListElement(MultipleMixin, BaseListElement):
 
 
 class ChoiceElement(MultipleMixin, Element):
-    # TODO: we should have an init to define this attribute
-    _value = None
+    __slots__ = ELEMENT_SLOTS + ("_value",)
+
+    def __init__(self, *args, **kw):
+        self._value = None
+        super(ChoiceElement, self).__init__(*args, **kw)
 
     @classmethod
     def _create(cls, tagname, parent_obj, value=None, index=None):
@@ -706,6 +1066,14 @@ class ChoiceElement(MultipleMixin, Element):
         # The logic to add Element to a choice is on the parent
         return self._parent_obj.add(*args, **kw)
 
+    def clone(self):
+        raise Exception("Can't clone a choice, clone its value")
+
+    def clone_into(self, parent_obj):
+        """Copy the value of the choice in parent_obj, returns the choice of
+        parent_obj"""
+        return self._value.clone_into(parent_obj)._parent_obj
+
     def delete(self):
         super(ChoiceElement, self).delete()
         # Delete the shortcut
@@ -735,6 +1103,7 @@ class ChoiceElement(MultipleMixin, Element):
                 if elt.tagname != tagname:
                     err = "%s is defined so you can't add %s" % (elt.tagname, tagname)
                 raise Exception(err)
+        cls._check_content_model(obj, tagname)
 
     @classmethod
     def _get_value_from_parent(cls, parent_obj):
@@ -1,6 +1,10 @@
 #!/usr/bin/env python
 
+import mmap
 import os
+import re
+import threading
+from xml.parsers import expat
 from lxml import etree
 from io import StringIO, BytesIO, IOBase
 from . import utils
@@ -8,64 +12,509 @@ from . import elements
 from . import dtd
 
 
-def create(root_tag, dtd_url=None, dtd_str=None):
+def create(
+    root_tag, dtd_url=None, dtd_str=None, lazy=False, dtd_module=None, skeleton=False
+):
     """Create a python object for the given root_tag
 
     :param root_tag: The root tag to create
     :param dtd_url: The dtd url
     :param dtd_str: The dtd as string
+    :param lazy: only create the classes of the dtd when we use them
+    :param dtd_module: module generated by xmltool.codegen to use instead of
+                       the dtd
+    :param skeleton: create the required descendants of the root. Their
+                     classes are computed once by dtd and root tag.
     """
-    url = dtd_url if dtd_url else StringIO(dtd_str)
-    dtd_obj = dtd.DTD(url)
-    dic = dtd_obj.parse()
+    if dtd_module is not None:
+        dic = dtd_module.CLASSES
+        dtd_url = dtd_url or dtd_module.DTD_URL
+        if not dtd_url:
+            dtd_str = dtd_module.DTD_CONTENT
+    else:
+        url = dtd_url if dtd_url else StringIO(dtd_str)
+        dtd_obj = dtd.DTD(url, lazy=lazy)
+        dic = dtd_obj.parse()
     if root_tag not in dic:
         raise Exception("Bad root_tag %s, " "it's not supported by the dtd" % root_tag)
     obj = dic[root_tag]()
+    if skeleton:
+        obj._add_skeleton()
     obj.dtd_url = dtd_url
+    if dtd_module is not None and not dtd_url:
+        obj.dtd_str = dtd_str
     obj.encoding = elements.DEFAULT_ENCODING
     return obj
 
 
-def load(filename, validate=True):
+# The objects parsed in memory by load and load_string without copying them
+BUFFER_TYPES = (bytes, bytearray, memoryview, mmap.mmap)
+
+
+def _parse(source, parser, base_url=None):
+    if isinstance(source, BUFFER_TYPES):
+        return etree.fromstring(source, parser, base_url=base_url).getroottree()
+    return etree.parse(source, parser=parser)
+
+
+# The parsers validating the XML while parsing it by thread, a lxml parser
+# can't be used by many threads at the same time
+_validating_parsers = threading.local()
+
+
+REMOTE_URL_REGEX = re.compile(r"^https?://")
+
+
+class _RemoteDTDResolver(etree.Resolver):
+    """Give the remote dtd of the XML to lxml from the xmltool cache, lxml
+    doesn't load it from the network. The other urls are not resolved."""
+
+    system_url = None
+
+    def resolve(self, system_url, public_id, context):
+        if system_url != self.system_url or not REMOTE_URL_REGEX.match(system_url):
+            return None
+        content = dtd.DTD(system_url).content
+        return self.resolve_string(content.encode("utf-8"), context)
+
+
+def _get_validating_parser():
+    parser = getattr(_validating_parsers, "parser", None)
+    if parser is None:
+        # The external entities are not loaded, the parameter entities of the
+        # dtd are still resolved
+        parser = etree.XMLParser(
+            strip_cdata=False,
+            load_dtd=True,
+            dtd_validation=True,
+            resolve_entities=False,
+        )
+        _validating_parsers.resolver = _RemoteDTDResolver()
+        parser.resolvers.add(_validating_parsers.resolver)
+        _validating_parsers.parser = parser
+    return parser
+
+
+# The doctype is at the start of the XML, we only read this size to find it
+DOCTYPE_HEAD_SIZE = 64 * 1024
+DOCTYPE_REGEX = re.compile(
+    rb"<!DOCTYPE\s+[^\s>\[]+\s+(?:SYSTEM|PUBLIC\s+(?:\"[^\"]*\"|'[^']*'))"
+    rb"\s+(?:\"([^\"]*)\"|'([^']*)')\s*(\[)?"
+)
+
+
+def _read_head(source):
+    if isinstance(source, BUFFER_TYPES):
+        with memoryview(source) as view:
+            return view[:DOCTYPE_HEAD_SIZE].tobytes()
+    if isinstance(source, str):
+        if not os.path.isfile(source):
+            return None
+        with open(source, "rb") as f:
+            return f.read(DOCTYPE_HEAD_SIZE)
+    if isinstance(source, IOBase) and source.seekable():
+        position = source.tell()
+        head = source.read(DOCTYPE_HEAD_SIZE)
+        source.seek(position)
+        return head if isinstance(head, bytes) else None
+    return None
+
+
+def _get_doctype_system_url(source, internal_subset=False):
+    """The system url of the doctype of the XML, None if we can't find it or
+    if the doctype has an internal subset: its external entities would be
+    loaded by the validating parser. With internal_subset=True, the url is
+    also given when there is an internal subset."""
+    head = _read_head(source)
+    if not head:
+        return None
+    match = DOCTYPE_REGEX.search(head)
+    if match is None or (match.group(3) and not internal_subset):
+        return None
+    system_url = match.group(1) if match.group(1) is not None else match.group(2)
+    return system_url.decode("utf-8")
+
+
+def _parse_and_validate(source, system_url, base_url=None):
+    """Parse the XML and validate it against its dtd in the same pass
+
+    system_url: the url of the dtd of the XML, the only one we download
+    """
+    parser = _get_validating_parser()
+    _validating_parsers.resolver.system_url = system_url
+    try:
+        return _parse(source, parser, base_url)
+    except etree.XMLSyntaxError:
+        errors = parser.error_log.filter_domains([etree.ErrorDomains.VALID])
+        if errors:
+            error = errors[0]
+            raise etree.DocumentInvalid(
+                "%s, line %s" % (error.message, error.line), errors
+            )
+        raise
+
+
+def load(
+    filename,
+    validate=True,
+    lazy=False,
+    dtd_module=None,
+    lazy_xml=False,
+    single_pass=False,
+):
     """Generate a python object
 
-    :param filename: XML filename or Byte like object we should load
+    :param filename: XML filename, file object or bytes like object (bytes,
+                     bytearray, memoryview, mmap) we should load. The bytes
+                     like objects are parsed without being copied.
     :param validate: validate the XML before generating the python object.
+    :param lazy: only create the classes of the dtd when we use them
+    :param dtd_module: module generated by xmltool.codegen to use instead of
+                       the dtd of the XML
+    :param lazy_xml: only create the children of an object when we use them,
+                     the lxml tree is kept until then
+    :param single_pass: validate the XML while parsing it instead of
+                        validating the parsed tree. It's not used with a
+                        dtd_module since the XML is validated against the dtd
+                        of the module, nor when the doctype of the XML has an
+                        internal subset.
     :type filename: str
     :type validate: bool
+    :type lazy: bool
+    :type lazy_xml: bool
+    :type single_pass: bool
     :return: the generated python object
     :rtype: :class:`Element`
     """
-    parser = etree.XMLParser(strip_cdata=False)
-    tree = etree.parse(filename, parser=parser)
+    if isinstance(filename, BUFFER_TYPES):
+        return _load(filename, None, validate, lazy, dtd_module, lazy_xml, single_pass)
+    return _load(filename, filename, validate, lazy, dtd_module, lazy_xml, single_pass)
+
+
+def _load(source, filename, validate, lazy, dtd_module, lazy_xml, single_pass):
+    """Load the parsed source, filename is used to find the relative dtd"""
+    base_url = filename if isinstance(filename, str) else None
+    single_pass = single_pass and validate and dtd_module is None
+    if single_pass:
+        system_url = _get_doctype_system_url(source)
+        # Without the doctype or with an internal subset, we validate the
+        # parsed tree
+        single_pass = system_url is not None
+    if single_pass:
+        tree = _parse_and_validate(source, system_url, base_url)
+    else:
+        parser = etree.XMLParser(strip_cdata=False)
+        tree = _parse(source, parser, base_url)
     dtd_url = tree.docinfo.system_url
-    path = os.path.dirname(filename) if not isinstance(filename, BytesIO) else None
+    path = os.path.dirname(filename) if base_url else None
 
-    dtd_obj = dtd.DTD(dtd_url, path)
-    if validate:
-        dtd_obj.validate_xml(tree)
+    if dtd_module is not None:
+        if validate:
+            dtd.get_validator(dtd_module.DTD_CONTENT).assertValid(tree)
+        dic = dtd_module.CLASSES
+    else:
+        dtd_obj = dtd.DTD(dtd_url, path, lazy=lazy)
+        if validate and not single_pass:
+            dtd_obj.validate_xml(tree)
+        dic = dtd_obj.parse()
+
+    return _create_from_tree(
+        tree, filename, dic, lazy_xml, trusted=validate, source=source
+    )
+
+
+CDATA_REGEX = re.compile(rb"<!\[CDATA\[")
+GZIP_MAGIC = b"\x1f\x8b"
+
+
+class _CDATAFinder(object):
+    """Find the elements having a CDATA section in their text, by their
+    index in the document order"""
+
+    def __init__(self):
+        self.count = 0
+        self.stack = []
+        self.indexes = set()
+
+    def start(self, tag, attrib):
+        self.stack.append(self.count)
+        self.count += 1
+
+    def end(self, tag):
+        self.stack.pop()
+
+    def cdata(self):
+        self.indexes.add(self.stack[-1])
+
+    def parse(self, data):
+        parser = expat.ParserCreate()
+        parser.StartElementHandler = self.start
+        parser.EndElementHandler = self.end
+        parser.StartCdataSectionHandler = self.cdata
+        parser.Parse(data, True)
+
+
+def _find_cdata_elements(data, root):
+    if not CDATA_REGEX.search(data):
+        return frozenset()
+    finder = _CDATAFinder()
+    try:
+        finder.parse(data)
+    except (expat.ExpatError, ValueError):
+        # ValueError: expat doesn't support the multi-byte encodings
+        return None
+    elts = []
+    count = 0
+    for count, elt in enumerate(root.iter(etree.Element), 1):
+        if count - 1 in finder.indexes:
+            elts.append(elt)
+    if count != finder.count:
+        # The entities of the dtd have created some elements
+        return None
+    return frozenset(elts)
 
-    dic = dtd_obj.parse()
+
+def _get_cdata_elements(source, root):
+    """The lxml elements of root having a CDATA section in their text.
+
+    lxml doesn't tell if a text comes from a CDATA section, the source is
+    parsed again with expat when it contains one. Returns None when we can't
+    read the source.
+    """
+    if isinstance(source, BUFFER_TYPES):
+        return _find_cdata_elements(source, root)
+    if isinstance(source, BytesIO):
+        return _find_cdata_elements(source.getbuffer(), root)
+    if isinstance(source, str) and os.path.isfile(source):
+        with open(source, "rb") as f:
+            if not os.fstat(f.fileno()).st_size:
+                return None
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+                if data[:2] == GZIP_MAGIC:
+                    # libxml2 has uncompressed the file
+                    return None
+                return _find_cdata_elements(data, root)
+    return None
+
+
+def _create_from_tree(tree, filename, dic, lazy_xml=False, trusted=False, source=None):
+    """Create the python object of the parsed XML with the given classes
+
+    trusted: the XML is valid, the objects are created without checking
+    they can be added
+    source: the parsed source, used to find the CDATA sections
+    """
     root = tree.getroot()
     obj = dic[root.tag]()
+    obj._lazy_load = lazy_xml
+    obj._trusted_xml = trusted
+    if source is not None:
+        obj._cdata_lxml_elts = _get_cdata_elements(source, root)
     obj.load_from_xml(root)
     obj.filename = filename
-    obj.dtd_url = dtd_url
+    obj.dtd_url = tree.docinfo.system_url
     obj.encoding = tree.docinfo.encoding
     return obj
 
 
-def load_string(xml_str, validate=True):
+def load_string(
+    xml_str,
+    validate=True,
+    lazy=False,
+    dtd_module=None,
+    lazy_xml=False,
+    single_pass=False,
+):
     """Generate a python object
 
-    :param xml_str: the XML file as string
+    :param xml_str: the XML file as string or bytes like object (bytes,
+                    bytearray, memoryview, mmap) which is not copied
     :type xml_str: str
     :param validate: validate the XML before generating the python object.
     :type validate: bool
+    :param lazy: only create the classes of the dtd when we use them
+    :type lazy: bool
+    :param dtd_module: module generated by xmltool.codegen to use instead of
+                       the dtd of the XML
+    :param lazy_xml: only create the children of an object when we use them
+    :type lazy_xml: bool
+    :param single_pass: validate the XML while parsing it
+    :type single_pass: bool
     :return: the generated python object
     :rtype: :class:`Element`
     """
-    if not isinstance(xml_str, BytesIO):
+    if isinstance(xml_str, str):
         # TODO: Get encoding from the dtd file (xml tag).
-        xml_str = BytesIO(xml_str.encode("utf-8"))
-    return load(xml_str, validate)
+        xml_str = xml_str.encode("utf-8")
+    return load(
+        xml_str,
+        validate,
+        lazy=lazy,
+        dtd_module=dtd_module,
+        lazy_xml=lazy_xml,
+        single_pass=single_pass,
+    )
+
+
+def load_file(
+    filename,
+    validate=True,
+    lazy=False,
+    dtd_module=None,
+    lazy_xml=False,
+    single_pass=False,
+):
+    """Generate a python object from a XML file mapped in memory
+
+    The file is parsed from the mapped pages, we don't hold a copy of the
+    file in the python memory. The parameters are the same as load.
+    """
+    with open(filename, "rb") as f:
+        if not os.fstat(f.fileno()).st_size:
+            # An empty file can't be mapped, lxml raises the error
+            return load(filename, validate, lazy, dtd_module, lazy_xml, single_pass)
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            return _load(
+                data, filename, validate, lazy, dtd_module, lazy_xml, single_pass
+            )
+
+
+def _create_stream_root(xml, filename, lazy, dtd_module, validate):
+    docinfo = xml.getroottree().docinfo
+    dtd_url = docinfo.system_url
+    if dtd_module is not None:
+        dic = dtd_module.CLASSES
+    else:
+        path = os.path.dirname(filename) if isinstance(filename, str) else None
+        dic = dtd.DTD(dtd_url, path, lazy=lazy).parse()
+    obj = dic[xml.tag]()
+    obj._keep_lxml_elts = False
+    obj._load_attributes_from_xml(xml)
+    # The children are validated when we load them
+    obj._trusted_xml = validate
+    obj.sourceline = xml.sourceline
+    obj.filename = filename
+    obj.dtd_url = dtd_url
+    return obj
+
+
+def _load_stream_child(root_obj, xml):
+    obj = root_obj.add(xml.tag)
+    obj.load_from_xml(xml)
+    # Free the loaded lxml elements, the comments after xml stay since they
+    # are for the next element.
+    parent = xml.getparent()
+    while parent[0] is not xml:
+        del parent[0]
+    del parent[0]
+    return obj
+
+
+def _iterparse(filename, validate, lazy, dtd_module):
+    """Load the XML file with iterparse
+
+    Yield (root_obj, obj) each time a child of the root is loaded. A child is
+    loaded when the next one starts, we need its following comments.
+    """
+    source = filename
+    if isinstance(filename, BUFFER_TYPES):
+        # iterparse takes the bytes for a filename
+        source = BytesIO(filename)
+        filename = None
+    context = etree.iterparse(
+        source,
+        events=("start", "end"),
+        load_dtd=validate,
+        dtd_validation=validate,
+        # The external entities of the XML are not loaded
+        resolve_entities=False,
+        strip_cdata=False,
+    )
+    if validate:
+        # Only the remote dtd of the XML is resolved, like in
+        # _parse_and_validate
+        resolver = _RemoteDTDResolver()
+        resolver.system_url = _get_doctype_system_url(source, internal_subset=True)
+        context.resolvers.add(resolver)
+    root = root_obj = pending = None
+    depth = 0
+    try:
+        for event, xml in context:
+            if event == "start":
+                depth += 1
+                if depth == 1:
+                    root = xml
+                    root_obj = _create_stream_root(
+                        xml, filename, lazy, dtd_module, validate
+                    )
+                elif depth == 2 and pending is not None:
+                    yield root_obj, _load_stream_child(root_obj, pending)
+                    pending = None
+            else:
+                depth -= 1
+                if depth == 1 and not isinstance(root_obj, elements.TextElement):
+                    pending = xml
+    except etree.XMLSyntaxError as e:
+        errors = context.error_log.filter_domains([etree.ErrorDomains.VALID])
+        if errors:
+            raise etree.DocumentInvalid(str(e), errors)
+        raise
+
+    if pending is not None:
+        yield root_obj, _load_stream_child(root_obj, pending)
+    if isinstance(root_obj, elements.TextElement):
+        root_obj.load_from_xml(root)
+    else:
+        root_obj._load_comment_from_xml(root)
+    # Only known at the end of the parsing
+    root_obj.encoding = root.getroottree().docinfo.encoding
+
+
+def load_stream(filename, validate=True, lazy=False, dtd_module=None):
+    """Generate a python object like load without having the full lxml tree
+    in memory: the XML is read with iterparse and the lxml elements are freed
+    once loaded. The xpath is not supported on the returned object.
+
+    The validation is made during the parsing with the dtd declared in the
+    XML, it raises etree.DocumentInvalid.
+
+    :param filename: XML filename, file object or bytes like object (bytes,
+                     bytearray, memoryview, mmap) we should load
+    :param validate: validate the XML while parsing it
+    :param lazy: only create the classes of the dtd when we use them
+    :param dtd_module: module generated by xmltool.codegen to use instead of
+                       the dtd of the XML to create the classes
+    :return: the generated python object
+    :rtype: :class:`Element`
+    """
+    root_obj = None
+    for root_obj, obj in _iterparse(filename, validate, lazy, dtd_module):
+        pass
+    return root_obj
+
+
+def iterload(filename, tagname=None, validate=True, lazy=False, dtd_module=None):
+    """Yield the children of the root element one at a time
+
+    It's useful for the big XML files which are a long list of records: the
+    yielded objects are removed from the root after use so the memory doesn't
+    grow. The other children are kept in the root which is available as
+    obj.root.
+
+    :param filename: XML filename, file object or bytes like object (bytes,
+                     bytearray, memoryview, mmap) we should load
+    :param tagname: the tagname of the children to yield, by default the
+                    children in a list
+    :param validate: validate the XML while parsing it
+    :param lazy: only create the classes of the dtd when we use them
+    :param dtd_module: module generated by xmltool.codegen to use instead of
+                       the dtd of the XML to create the classes
+    """
+    for root_obj, obj in _iterparse(filename, validate, lazy, dtd_module):
+        if tagname is not None:
+            if obj.tagname != tagname:
+                continue
+        elif not isinstance(obj, elements.InListMixin):
+            continue
+        yield obj
+        obj.delete()
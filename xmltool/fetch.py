@@ -0,0 +1,153 @@
+"""Fetch the remote dtds.
+
+The requests are made with a pooled session which keeps the connections alive
+and retries on the connection errors. The last response of each url is kept
+so we can revalidate it with the server (ETag and Last-Modified) instead of
+downloading the dtd again.
+"""
+
+from collections import OrderedDict
+import os
+import threading
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+
+def _get_env(name, default, type_=int):
+    value = os.environ.get(name)
+    if not value:
+        return default
+    try:
+        return type_(value)
+    except ValueError:
+        # TODO: add logging
+        return default
+
+
+# The timeout in seconds of a request
+TIMEOUT = _get_env("XMLTOOL_HTTP_TIMEOUT", 5, float)
+# The number of retries on the connection errors and the 5xx responses
+RETRIES = _get_env("XMLTOOL_HTTP_RETRIES", 3)
+# The number of kept connections by host
+POOL_SIZE = _get_env("XMLTOOL_HTTP_POOL_SIZE", 10)
+# The number of responses kept to revalidate them
+MAX_RESPONSES = 32
+
+_session = None
+_session_lock = threading.Lock()
+
+_responses = OrderedDict()
+_responses_lock = threading.Lock()
+
+
+class Response(object):
+    """The content of a url with the headers used to revalidate it"""
+
+    def __init__(self, url, content, etag=None, last_modified=None, modified=True):
+        self.url = url
+        self.content = content
+        self.etag = etag
+        self.last_modified = last_modified
+        # False when the server answered the content is not modified
+        self.modified = modified
+
+    def conditional_headers(self):
+        headers = {}
+        if self.etag:
+            headers["If-None-Match"] = self.etag
+        if self.last_modified:
+            headers["If-Modified-Since"] = self.last_modified
+        return headers
+
+
+def configure(timeout=None, retries=None, pool_size=None):
+    """Change the settings of the requests, the session is created again"""
+    global TIMEOUT, RETRIES, POOL_SIZE, _session
+    with _session_lock:
+        if timeout is not None:
+            TIMEOUT = timeout
+        if retries is not None:
+            RETRIES = retries
+        if pool_size is not None:
+            POOL_SIZE = pool_size
+        if _session is not None:
+            _session.close()
+        _session = None
+
+
+def clear():
+    """Forget the responses kept to revalidate them"""
+    with _responses_lock:
+        _responses.clear()
+
+
+def _create_session():
+    retry = Retry(
+        total=RETRIES,
+        backoff_factor=0.2,
+        status_forcelist=[500, 502, 503, 504],
+        allowed_methods=["GET"],
+    )
+    adapter = HTTPAdapter(
+        max_retries=retry, pool_connections=POOL_SIZE, pool_maxsize=POOL_SIZE
+    )
+    session = requests.Session()
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+
+def get_session():
+    global _session
+    with _session_lock:
+        if _session is None:
+            _session = _create_session()
+        return _session
+
+
+def _get_response(url):
+    with _responses_lock:
+        response = _responses.get(url)
+        if response is not None:
+            _responses.move_to_end(url)
+        return response
+
+
+def _set_response(response):
+    with _responses_lock:
+        _responses[response.url] = response
+        _responses.move_to_end(response.url)
+        while len(_responses) > MAX_RESPONSES:
+            _responses.popitem(last=False)
+
+
+def fetch(url):
+    """Get the content of the url as a Response
+
+    When we already got the url, the request is conditional and we keep the
+    previous content if the server answers it's not modified.
+    """
+    previous = _get_response(url)
+    headers = previous.conditional_headers() if previous else {}
+    res = get_session().get(url, headers=headers, timeout=TIMEOUT)
+    if previous is not None and res.status_code == 304:
+        return Response(
+            url,
+            previous.content,
+            etag=previous.etag,
+            last_modified=previous.last_modified,
+            modified=False,
+        )
+    res.raise_for_status()
+    # Use res.text to have str
+    response = Response(
+        url,
+        res.text,
+        etag=res.headers.get("ETag"),
+        last_modified=res.headers.get("Last-Modified"),
+    )
+    if response.etag or response.last_modified:
+        _set_response(response)
+    return response
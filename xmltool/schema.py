@@ -0,0 +1,89 @@
+"""Compiled schema: the serializable description of the classes generated
+from a dtd.
+
+The generated classes can't be pickled, so to skip the dtd parsing when a
+process starts we store this description on disk, keyed by the hash of the
+dtd content, and rehydrate the classes from it.
+"""
+
+import hashlib
+import json
+import os
+import tempfile
+
+from . import dtd_parser
+
+# Increase it when the format of the compiled schema changes
+SCHEMA_VERSION = 3
+
+
+def content_hash(content):
+    """The hash of the dtd content used as key"""
+    return hashlib.sha256(content.encode("utf-8")).hexdigest()
+
+
+def compile_schema(content):
+    """Parse the dtd content and returns its compiled schema"""
+    dtd_dict = dtd_parser.dtd_to_dict_v2(content)
+    return {
+        "version": SCHEMA_VERSION,
+        "hash": content_hash(content),
+        "elements": dtd_parser.dtd_dict_to_schema(dtd_dict),
+    }
+
+
+def build_classes(schema):
+    """Create the classes described by the compiled schema"""
+    return dtd_parser.create_classes_from_schema(schema["elements"])
+
+
+def dump(schema, fp):
+    json.dump(schema, fp, separators=(",", ":"))
+
+
+def load(fp):
+    schema = json.load(fp)
+    if schema.get("version") != SCHEMA_VERSION:
+        raise ValueError("Unsupported schema version %s" % schema.get("version"))
+    return schema
+
+
+class SchemaStore(object):
+    """Store the compiled schemas as json files in a directory"""
+
+    def __init__(self, directory):
+        self.directory = directory
+
+    def _get_path(self, key):
+        return os.path.join(self.directory, "%s.json" % key)
+
+    def get(self, key):
+        """Returns the compiled schema for the given content hash or None"""
+        try:
+            with open(self._get_path(key), "r") as fp:
+                return load(fp)
+        except (IOError, OSError, ValueError):
+            # Missing, unreadable or outdated file: it will be recompiled
+            return None
+
+    def set(self, schema):
+        if not os.path.isdir(self.directory):
+            os.makedirs(self.directory)
+        # Write in a temporary file then rename it, the other processes never
+        # read a partial file.
+        f, filename = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+        try:
+            with os.fdopen(f, "w") as fp:
+                dump(schema, fp)
+            os.replace(filename, self._get_path(schema["hash"]))
+        except Exception:
+            if os.path.exists(filename):
+                os.remove(filename)
+            raise
+
+    def get_or_compile(self, content):
+        schema = self.get(content_hash(content))
+        if schema is None:
+            schema = compile_schema(content)
+            self.set(schema)
+        return schema